@@ -0,0 +1,380 @@
+
+"""
+Load test for the API. Boots main.app in-process against the Postgres in
+DATABASE_URL and the Redis in REDIS_URL (or an in-process fakeredis with
+--fake-redis), seeds bench users and drives a weighted mix of requests from
+concurrent virtual users while the crash loop runs:
+
+    python bench.py --users 200 --concurrency 50 --duration 30 --out bench.json
+    python bench.py ... --compare bench.json         # deltas against an earlier run
+    python bench.py --url http://localhost:8000 ...  # a running server; latency only
+
+Per route it reports p50/p95/p99 latency, req/s, status codes, Postgres
+round trips per request and time spent waiting for a pool connection. The
+JSON written with --out is what --compare reads, so runs from two commits
+can be diffed. Bench users get ids from BENCH_UID up and are reset on each
+run. Needs httpx, and fakeredis for --fake-redis (requirements-dev.txt).
+"""
+import argparse, asyncio, contextvars, functools, json, os, random, subprocess, sys, time
+from collections import Counter, defaultdict
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("bench needs httpx: pip install -r requirements-dev.txt")
+
+BENCH_UID  = 990_000_000_000
+BENCH_GOLD = 10**12
+BET        = 100
+
+# ── Postgres instrumentation ─────────────────────────────
+# The pools are wrapped before the app starts, so every route sees the
+# wrappers through get_pool() and get_read_pool(). Calls are charged to the
+# request running in the current context; background tasks (crash loop,
+# sweeper) have none.
+
+_probe: contextvars.ContextVar = contextvars.ContextVar("bench_probe", default=None)
+
+# Methods that make one round trip to the server
+ROUND_TRIPS = {"execute", "executemany", "fetch", "fetchrow", "fetchval",
+               "copy_records_to_table", "copy_to_table", "copy_from_query"}
+
+def _charge(calls: int = 1, wait: float = 0.0):
+    p = _probe.get()
+    if p is not None:
+        p[0] += calls
+        p[1] += wait
+
+def _counted(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        _charge()
+        return await fn(*args, **kwargs)
+    return wrapper
+
+class CountingConnection:
+    """Delegates to an asyncpg connection; a transaction block counts as two
+    round trips (BEGIN and COMMIT/ROLLBACK)."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        return _counted(attr) if name in ROUND_TRIPS else attr
+
+    def transaction(self, **kwargs):
+        _charge(2)
+        return self._conn.transaction(**kwargs)
+
+class _TimedAcquire:
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    async def __aenter__(self):
+        t0 = time.perf_counter()
+        conn = await self._ctx.__aenter__()
+        _charge(0, time.perf_counter() - t0)
+        return CountingConnection(conn)
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+class TimedPool:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._pool, name)
+        return _counted(attr) if name in ROUND_TRIPS else attr
+
+    def acquire(self, **kwargs):
+        return _TimedAcquire(self._pool.acquire(**kwargs))
+
+# ── Results ──────────────────────────────────────────────
+
+class RouteStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.waits: list[float] = []
+        self.status = Counter()
+        self.round_trips = 0
+
+    def add(self, elapsed: float, status, probe):
+        self.latencies.append(elapsed)
+        self.status[str(status)] += 1
+        self.round_trips += probe[0]
+        self.waits.append(probe[1])
+
+def _pct(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def summarize(stats: dict[str, RouteStats], seconds: float, instrumented: bool) -> dict:
+    out = {}
+    for route, s in sorted(stats.items()):
+        lat, waits = sorted(s.latencies), sorted(s.waits)
+        n = len(lat)
+        out[route] = {
+            "count":   n,
+            "rps":     round(n / seconds, 1),
+            "p50_ms":  round(_pct(lat, 50) * 1000, 2),
+            "p95_ms":  round(_pct(lat, 95) * 1000, 2),
+            "p99_ms":  round(_pct(lat, 99) * 1000, 2),
+            "max_ms":  round(lat[-1] * 1000, 2),
+            "status":  dict(s.status),
+            "db_round_trips":   round(s.round_trips / n, 2) if instrumented else None,
+            "pool_wait_ms":     round(sum(waits) / n * 1000, 3) if instrumented else None,
+            "pool_wait_p95_ms": round(_pct(waits, 95) * 1000, 3) if instrumented else None,
+        }
+    return out
+
+def print_report(routes: dict, total: dict, baseline: dict | None):
+    print(f"{'route':42} {'n':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'db/req':>7} {'wait':>7}  status")
+    for route, r in routes.items():
+        db   = "-" if r["db_round_trips"] is None else f"{r['db_round_trips']:.1f}"
+        wait = "-" if r["pool_wait_ms"] is None else f"{r['pool_wait_ms']:.2f}"
+        line = (f"{route:42} {r['count']:7} {r['rps']:8.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+                f"{r['p99_ms']:8.2f} {db:>7} {wait:>7}  {r['status']}")
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old and old["p95_ms"] and old["rps"]:
+            line += (f"  p95 {100 * (r['p95_ms'] / old['p95_ms'] - 1):+.0f}%"
+                     f" rps {100 * (r['rps'] / old['rps'] - 1):+.0f}%")
+        print(line)
+    print(f"total: {total['requests']} requests, {total['rps']:.1f} req/s, "
+          f"{total['errors']} transport errors, {total['seconds']:.1f}s")
+
+# ── Workload ─────────────────────────────────────────────
+
+class VirtualUser:
+    def __init__(self, uid: int, token: str):
+        self.uid = uid
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.bet_round   = None      # last crash round bet on
+        self.crash_round = None      # round with a bet waiting for a manual cashout
+
+class Runner:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.stats: dict[str, RouteStats] = defaultdict(RouteStats)
+        self.recording = False
+        self.errors = 0
+
+    async def call(self, user: VirtualUser, method: str, path: str, **kwargs):
+        probe = [0, 0.0]
+        token = _probe.set(probe)
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.request(method, path, headers=user.headers, **kwargs)
+            status = r.status_code
+        except httpx.HTTPError:
+            r, status = None, "error"
+            self.errors += 1
+        finally:
+            _probe.reset(token)
+        if self.recording:
+            self.stats[f"{method} {path.split('?')[0]}"].add(time.perf_counter() - t0, status, probe)
+        return r if r is not None and r.status_code == 200 else None
+
+    # One action may issue several requests, as a player would
+    async def coin(self, u):
+        await self.call(u, "POST", "/api/games/coin/play", json={"bet": BET, "side": random.choice(("heads", "tails"))})
+
+    async def dice(self, u):
+        await self.call(u, "POST", "/api/games/dice/play", json={"bet": BET, "chosen": random.randint(2, 12)})
+
+    async def slots(self, u):
+        await self.call(u, "POST", "/api/games/slots/play", json={"bet": BET})
+
+    async def roulette(self, u):
+        bets = {random.choice(("cat_red", "cat_black", "cat_odd", "cat_even")): BET,
+                f"num_{random.randint(0, 36)}": BET}
+        await self.call(u, "POST", "/api/games/roulette/play", json={"bets": bets})
+
+    async def autoplay(self, u):
+        await self.call(u, "POST", "/api/games/dice/autoplay", json={"bet": BET, "rounds": 10, "chosen": 7})
+
+    async def mines(self, u):
+        r = await self.call(u, "POST", "/api/games/mines/start", json={"bet": BET, "mines": 3})
+        if r is None:
+            return
+        game_id = r.json()["game_id"]
+        if random.random() < 0.3:
+            await self.call(u, "POST", "/api/games/mines/reveal-batch",
+                            json={"game_id": game_id, "auto_pick": 3, "cashout": True})
+            return
+        for cell in random.sample(range(25), random.randint(1, 3)):
+            r = await self.call(u, "POST", "/api/games/mines/reveal", json={"game_id": game_id, "cell": cell})
+            if r is None or not r.json()["safe"]:
+                return
+        await self.call(u, "POST", "/api/games/mines/cashout", json={"game_id": game_id})
+
+    async def crash(self, u):
+        r = await self.call(u, "GET", "/api/games/crash/state")
+        if r is None:
+            return
+        state = r.json()
+        if state["phase"] == "waiting" and u.bet_round != state["round_id"]:
+            auto = random.choice((None, 1.5, 2.0))
+            u.bet_round = state["round_id"]
+            if await self.call(u, "POST", "/api/games/crash/bet", json={"bet": BET, "auto_cashout": auto}):
+                u.crash_round = state["round_id"] if auto is None else None
+        elif state["phase"] == "running" and u.crash_round == state["round_id"]:
+            await self.call(u, "POST", "/api/games/crash/cashout")
+            u.crash_round = None
+
+    async def lobby(self, u):
+        await self.call(u, "GET", "/api/stats/lobby")
+
+    async def leaderboard(self, u):
+        await self.call(u, "GET", "/api/stats/leaderboard",
+                        params={"type": random.choice(("profit", "wagered")),
+                                "window": random.choice(("all", "day", "week"))})
+
+    async def profile(self, u):
+        await self.call(u, "GET", random.choice(("/api/user/balance", "/api/user/profile")))
+        if random.random() < 0.2:
+            await self.call(u, "GET", "/api/stats/leaderboard/me")
+
+# action -> weight
+MIX = {
+    "coin": 12, "dice": 12, "slots": 12, "roulette": 8, "autoplay": 3,
+    "mines": 10, "crash": 15, "lobby": 10, "leaderboard": 8, "profile": 10,
+}
+
+async def drive(runner: Runner, users: list[VirtualUser], concurrency: int, warmup: float, duration: float) -> float:
+    actions = [getattr(runner, name) for name in MIX]
+    weights = list(MIX.values())
+    stop_at = time.perf_counter() + warmup + duration
+
+    async def worker(i: int):
+        while time.perf_counter() < stop_at:
+            user = users[random.randrange(len(users))] if len(users) > concurrency else users[i % len(users)]
+            await random.choices(actions, weights)[0](user)
+
+    workers = [asyncio.create_task(worker(i)) for i in range(concurrency)]
+    await asyncio.sleep(warmup)
+    runner.recording = True
+    started = time.perf_counter()
+    await asyncio.gather(*workers)
+    runner.recording = False
+    return time.perf_counter() - started
+
+# ── Setup ────────────────────────────────────────────────
+
+async def seed(pool, n: int):
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO users(id, username, first_name, gold) "
+            "SELECT g, 'bench' || (g - $1), 'Bench ' || (g - $1), $3 FROM generate_series($1::bigint, $1 + $2 - 1) g "
+            "ON CONFLICT (id) DO UPDATE SET gold = EXCLUDED.gold, gold_ver = users.gold_ver + 1",
+            BENCH_UID, n, BENCH_GOLD
+        )
+    # Cached balances from an earlier run would hide the reset
+    from redis_client import get_redis
+    from services.balance_cache import balance_key
+    redis = await get_redis()
+    for start in range(0, n, 1000):
+        await redis.delete(*[balance_key(BENCH_UID + i) for i in range(start, min(n, start + 1000))])
+
+def make_users(n: int) -> list[VirtualUser]:
+    from jose import jwt
+    from config import settings
+    exp = int(time.time()) + 86400
+    return [VirtualUser(uid, jwt.encode({"sub": str(uid), "exp": exp}, settings.SECRET_KEY, algorithm="HS256"))
+            for uid in range(BENCH_UID, BENCH_UID + n)]
+
+def _commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    if args.fake_redis:
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("--fake-redis needs fakeredis: pip install -r requirements-dev.txt")
+        import redis_client
+        redis_client._redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    import database, main
+    from middleware import rate_limit
+    if not args.keep_limits:
+        for bucket in rate_limit.LIMITS:
+            rate_limit.LIMITS[bucket] = (10**9, 10**9)
+
+    real_pool = await database.get_pool()
+    real_read_pool = await database.get_read_pool()
+    instrumented = args.url is None
+    if instrumented:
+        database._pool = TimedPool(real_pool)
+        database._read_pool = TimedPool(real_read_pool)
+        transport = httpx.ASGITransport(app=main.app)
+        lifespan = main.lifespan(main.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30)
+    else:
+        lifespan = None
+        client = httpx.AsyncClient(base_url=args.url, timeout=30,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+
+    if lifespan:
+        await lifespan.__aenter__()
+    try:
+        await seed(real_pool, args.users)
+        users = make_users(args.users)
+        runner = Runner(client)
+        seconds = await drive(runner, users, args.concurrency, args.warmup, args.duration)
+    finally:
+        await client.aclose()
+        if lifespan:
+            await lifespan.__aexit__(None, None, None)   # closes the pools
+        else:
+            await database.close_pools()
+
+    routes = summarize(runner.stats, seconds, instrumented)
+    requests = sum(r["count"] for r in routes.values())
+    return {
+        "meta": {
+            "commit": _commit(), "time": int(time.time()), "target": args.url or "in-process",
+            "users": args.users, "concurrency": args.concurrency, "duration": args.duration,
+            "fake_redis": args.fake_redis, "rate_limits": args.keep_limits,
+            "python": sys.version.split()[0],
+        },
+        "total": {"requests": requests, "rps": round(requests / seconds, 1),
+                  "errors": runner.errors, "seconds": round(seconds, 2)},
+        "routes": routes,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds first")
+    ap.add_argument("--fake-redis", action="store_true", help="in-process fakeredis instead of REDIS_URL")
+    ap.add_argument("--keep-limits", action="store_true", help="leave the rate limits on")
+    ap.add_argument("--url", help="drive a running server instead of booting the app")
+    ap.add_argument("--out", help="write the results as JSON")
+    ap.add_argument("--compare", help="JSON of an earlier run to show deltas against")
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args()
+    if "DATABASE_URL" not in os.environ:
+        sys.exit("DATABASE_URL must point at the Postgres to seed and test against")
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result["routes"], result["total"], baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
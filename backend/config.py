@@ -3,10 +3,30 @@ from typing import List
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Reads that tolerate replica lag go here; empty means a second pool on the primary
+    DATABASE_READ_URL: str = ""
+    DB_POOL_MIN: int = 2
+    DB_POOL_MAX: int = 10
+    DB_READ_POOL_MIN: int = 1
+    DB_READ_POOL_MAX: int = 5
+    DB_ACQUIRE_TIMEOUT: float = 5.0       # seconds to wait for a free connection
+    DB_COMMAND_TIMEOUT: float = 30.0
+    DB_STATEMENT_CACHE_SIZE: int = 100    # prepared statements kept per connection
+    DB_PGBOUNCER: bool = False            # behind a transaction-pooling proxy: no statement cache
+    # Write-behind of bets/transactions rows, see services/ledger.py
+    LEDGER_BATCH: int = 5000              # outbox rows per write
+    LEDGER_FLUSH_INTERVAL: float = 0.2    # seconds between writes when no batch is full
+    LEDGER_QUEUE_HIGH: int = 100_000      # outbox rows above which producers wait
+    LEDGER_BACKPRESSURE_WAIT: float = 2.0 # longest a producer waits for the outbox to drain
     REDIS_URL: str = "redis://localhost:6379"
+    TRUSTED_PROXIES: int = 0              # proxies in front that append to X-Forwarded-For
     TELEGRAM_BOT_TOKEN: str = ""
     SECRET_KEY: str = "dev_secret"
     HOUSE_EDGE: float = 0.05
+    # Provably fair crash, see services/crash_fair.py
+    CRASH_SALT: str = "so2-casino-crash"  # public; mixed into every crash point
+    CRASH_CHAIN_LENGTH: int = 1_000_000   # rounds per generated seed chain
+    CRASH_LEASE_TTL: float = 3.0          # seconds before a silent crash engine is replaced
     MIN_BET: int = 10
     MAX_BET: int = 50000
     WITHDRAW_MIN: int = 200
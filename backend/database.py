@@ -1,68 +1,92 @@
+import asyncio, logging
 import asyncpg
 from config import settings
+from migrations import MIGRATIONS
+from services.metrics import InstrumentedPool
 
-_pool: asyncpg.Pool = None
+log = logging.getLogger("database")
 
-async def get_pool() -> asyncpg.Pool:
+_pool: InstrumentedPool = None
+_read_pool: InstrumentedPool = None
+
+PARTITIONED_TABLES = ("bets", "transactions")
+PARTITION_MONTHS_AHEAD = 3
+MIGRATION_LOCK = 7_301_001    # pg_advisory_lock key
+
+async def _create_pool(name: str, dsn: str, min_size: int, max_size: int) -> InstrumentedPool:
+    pool = await asyncpg.create_pool(
+        dsn, min_size=min_size, max_size=max_size,
+        command_timeout=settings.DB_COMMAND_TIMEOUT,
+        # A transaction-pooling proxy may run the next statement on another
+        # server connection, where a named prepared statement does not exist
+        statement_cache_size=0 if settings.DB_PGBOUNCER else settings.DB_STATEMENT_CACHE_SIZE,
+    )
+    return InstrumentedPool(pool, name, settings.DB_ACQUIRE_TIMEOUT)
+
+async def get_pool() -> InstrumentedPool:
+    """The primary: all writes, and reads that must see them (balances, game state)."""
     global _pool
     if _pool is None:
-        _pool = await asyncpg.create_pool(settings.DATABASE_URL, min_size=2, max_size=10)
+        _pool = await _create_pool("write", settings.DATABASE_URL, settings.DB_POOL_MIN, settings.DB_POOL_MAX)
     return _pool
 
-async def create_tables():
+async def get_read_pool() -> InstrumentedPool:
+    """Read-only queries that tolerate replica lag (profile, history, leaderboard
+    rebuilds). Kept apart from the primary pool so they never queue game writes."""
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = await _create_pool("read", settings.DATABASE_READ_URL or settings.DATABASE_URL,
+                                        settings.DB_READ_POOL_MIN, settings.DB_READ_POOL_MAX)
+    return _read_pool
+
+async def close_pools():
+    global _pool, _read_pool
+    for pool in (_pool, _read_pool):
+        if pool is not None:
+            await pool.close()
+    _pool = _read_pool = None
+
+async def migrate():
+    """Applies pending migrations, one transaction each. An advisory lock
+    keeps several processes booting at once from racing each other."""
     pool = await get_pool()
     async with pool.acquire() as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id            BIGINT PRIMARY KEY,
-                username      VARCHAR(64),
-                first_name    VARCHAR(64),
-                gold          BIGINT DEFAULT 5000,
-                xp            INT DEFAULT 0,
-                games_played  INT DEFAULT 0,
-                games_won     INT DEFAULT 0,
-                total_wagered BIGINT DEFAULT 0,
-                total_profit  BIGINT DEFAULT 0,
-                created_at    TIMESTAMP DEFAULT NOW(),
-                last_seen     TIMESTAMP DEFAULT NOW()
-            );
-            CREATE TABLE IF NOT EXISTS transactions (
-                id          SERIAL PRIMARY KEY,
-                user_id     BIGINT REFERENCES users(id),
-                type        VARCHAR(32),
-                amount      BIGINT,
-                description VARCHAR(128),
-                game        VARCHAR(32),
-                created_at  TIMESTAMP DEFAULT NOW()
-            );
-            CREATE TABLE IF NOT EXISTS bets (
-                id          SERIAL PRIMARY KEY,
-                user_id     BIGINT REFERENCES users(id),
-                game        VARCHAR(32),
-                bet_amount  BIGINT,
-                payout      BIGINT,
-                multiplier  DECIMAL(10,2),
-                meta        JSONB,
-                created_at  TIMESTAMP DEFAULT NOW()
-            );
-            CREATE TABLE IF NOT EXISTS mines_sessions (
-                id          VARCHAR(64) PRIMARY KEY,
-                user_id     BIGINT REFERENCES users(id),
-                bet         BIGINT,
-                mine_count  INT,
-                board       JSONB,
-                revealed    JSONB DEFAULT '[]',
-                cashed_out  BOOLEAN DEFAULT FALSE,
-                created_at  TIMESTAMP DEFAULT NOW()
-            );
-            CREATE TABLE IF NOT EXISTS withdrawals (
-                id          SERIAL PRIMARY KEY,
-                user_id     BIGINT REFERENCES users(id),
-                amount      BIGINT,
-                fee         BIGINT,
-                net_amount  BIGINT,
-                so2_nick    VARCHAR(64),
-                status      VARCHAR(16) DEFAULT 'pending',
-                created_at  TIMESTAMP DEFAULT NOW()
-            );
-        ''')
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK)
+        try:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version     INT PRIMARY KEY,
+                    name        VARCHAR(64),
+                    applied_at  TIMESTAMP DEFAULT NOW()
+                )
+            ''')
+            applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+            for version, name, sql in sorted(MIGRATIONS):
+                if version in applied:
+                    continue
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations(version, name) VALUES($1,$2)", version, name
+                    )
+                log.info("applied migration %04d %s", version, name)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+    await ensure_partitions()
+
+async def ensure_partitions():
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        for table in PARTITIONED_TABLES:
+            await conn.execute(
+                "SELECT ensure_monthly_partitions($1, NOW()::date, $2)", table, PARTITION_MONTHS_AHEAD
+            )
+
+async def partition_maintenance_loop():
+    """Keeps future monthly partitions created ahead of time."""
+    while True:
+        await asyncio.sleep(86400)
+        try:
+            await ensure_partitions()
+        except Exception:
+            log.exception("partition maintenance failed")
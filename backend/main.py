@@ -1,29 +1,61 @@
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import asyncio
+import asyncio, logging, math
 
-from database import create_tables
+from database import migrate, partition_maintenance_loop, close_pools
 from redis_client import get_redis
 from config import settings
 from routes import auth, user, stats
 from routes.games import coin, dice, roulette, slots, crash, mines
-from services.crash_worker import crash_loop
+from services.crash_worker import run_engine as crash_engine
+from services.leaderboard import rebuild_if_missing
+from middleware.rate_limit import rate_limit
+from middleware.metrics import track_requests
+from services import metrics
+from services.mines_store import sweeper_loop as mines_sweeper_loop
+from services.user_stats import flush as flush_user_stats, flusher_loop as stats_flusher_loop
+from services import ledger, crash_stream, presence
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("main")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await create_tables()
+    await migrate()
     redis = await get_redis()
     await redis.ping()
-    task = asyncio.create_task(crash_loop())
+    crash_events = asyncio.create_task(crash_stream.listen())
+    task = asyncio.create_task(crash_engine())
+    lb_task = asyncio.create_task(rebuild_if_missing())
+    partitions = asyncio.create_task(partition_maintenance_loop())
+    sweeper = asyncio.create_task(mines_sweeper_loop())
+    stats_flusher = asyncio.create_task(stats_flusher_loop())
+    ledger_writer = asyncio.create_task(ledger.writer_loop())
+    presence_flusher = asyncio.create_task(presence.flusher_loop())
     yield
-    task.cancel()
+    for t in (task, crash_events, lb_task, partitions, sweeper, stats_flusher, ledger_writer, presence_flusher):
+        t.cancel()
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # A task that already ended with an error (the one-off rebuild) must not stop shutdown
+            log.exception("background task failed")
+    try:
+        await flush_user_stats()
+    except Exception:
+        log.exception("final user stats flush failed")
     try:
-        await task
-    except asyncio.CancelledError:
-        pass
+        await ledger.drain()
+    except Exception:
+        log.exception("ledger drain failed")
+    await close_pools()
 
 app = FastAPI(title="SO2 Casino API", version="1.0.0", lifespan=lifespan)
 
@@ -35,19 +67,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Rate limiting middleware (simple Redis-based)
-@app.middleware("http")
-async def rate_limit(request: Request, call_next):
-    uid = request.headers.get("X-User-Id")
-    if uid and request.url.path.startswith("/api/"):
-        redis = await get_redis()
-        key   = f"rl:{uid}"
-        count = await redis.incr(key)
-        if count == 1:
-            await redis.expire(key, 60)
-        if count > 30:
-            return JSONResponse({"error": "rate_limited", "message": "Слишком много запросов"}, status_code=429)
-    return await call_next(request)
+# json.loads accepts Infinity/NaN/1e999, and the default 422 handler echoes
+# the input back, which cannot be serialized; send such values as strings
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    detail = jsonable_encoder(exc.errors(), custom_encoder={float: lambda v: v if math.isfinite(v) else str(v)})
+    return JSONResponse({"detail": detail}, status_code=422)
+
+# Rate limiting: per-identity token buckets, see middleware/rate_limit.py
+app.middleware("http")(rate_limit)
+# Outermost, so rate-limited requests are measured too
+app.middleware("http")(track_requests)
 
 app.include_router(auth.router,     prefix="/api/auth",              tags=["auth"])
 app.include_router(user.router,     prefix="/api/user",              tags=["user"])
@@ -62,3 +92,8 @@ app.include_router(mines.router,    prefix="/api/games/mines",       tags=["game
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
@@ -0,0 +1,35 @@
+
+import time
+from fastapi import Request
+from starlette.routing import Match
+from services.metrics import HTTP_IN_FLIGHT, HTTP_LATENCY
+
+# path -> route template, so metrics are labeled by route, not by raw path
+_routes: dict[str, str] = {}
+
+def route_template(request: Request) -> str:
+    path = request.url.path
+    template = _routes.get(path)
+    if template is None:
+        template = "unmatched"
+        for route in request.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                template = route.path
+                break
+        if template != "unmatched" and len(_routes) < 10_000:
+            _routes[path] = template
+    return template
+
+async def track_requests(request: Request, call_next):
+    method, route = request.method, route_template(request)
+    in_flight = HTTP_IN_FLIGHT.labels(method, route)
+    in_flight.inc()
+    t0, status = time.perf_counter(), 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_flight.dec()
+        HTTP_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - t0)
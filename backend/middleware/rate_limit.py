@@ -0,0 +1,138 @@
+
+import logging, time
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from redis_client import get_redis
+from middleware.tg_auth import verify_token, verify_telegram_init_data, bearer_token
+from config import settings
+
+log = logging.getLogger("rate_limit")
+
+# Token buckets per identity: bucket -> (capacity, refill per second)
+LIMITS = {
+    "read": (240, 4.0),
+    "play": (60, 1.0),
+    "auth": (10, 0.2),
+}
+
+# First matching prefix wins: (path prefix, bucket, cost)
+ROUTES = [
+    ("/api/games/crash/state",      "read", 1),
+    ("/api/games/crash/history",    "read", 1),
+    ("/api/games/crash/verify",     "read", 1),
+    ("/api/games/coin/autoplay",    "play", 5),
+    ("/api/games/dice/autoplay",    "play", 5),
+    ("/api/games/slots/autoplay",   "play", 5),
+    ("/api/games/",                 "play", 1),
+    ("/api/user/withdraw",          "play", 10),
+    ("/api/user/history/export",    "read", 30),
+    ("/api/auth/",                  "auth", 1),
+    ("/api/",                       "read", 1),
+]
+
+# Tokens are leased from Redis a few at a time and spent locally, and a
+# refusal is remembered until its retry time, so most requests are decided
+# without a Redis call. Leased tokens that go unused just lapse, which can
+# only make the limit stricter, never looser.
+LEASE_FACTOR = 4
+LEASE_TTL    = 2.0
+LOCAL_MAX    = 50_000
+
+# Returns {granted, retry_after_ms}: grants up to ARGV[3] tokens when at
+# least ARGV[4] are available, using the Redis clock so all processes agree.
+_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cap, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local want, need = tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or cap
+local ts = tonumber(b[2]) or now
+tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+local granted = 0
+if tokens >= need then
+    granted = math.min(want, math.floor(tokens))
+    tokens = tokens - granted
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(cap / rate * 1000) + 1000)
+if granted > 0 then return {granted, 0} end
+return {0, math.ceil((need - tokens) / rate * 1000)}
+"""
+
+_script = None
+# "bucket:identity" -> [leased tokens, lease expiry, blocked until]
+_local: dict[str, list[float]] = {}
+
+def route_rule(path: str) -> tuple[str, int] | None:
+    for prefix, bucket, cost in ROUTES:
+        if path.startswith(prefix):
+            return bucket, cost
+    return None
+
+def client_identity(request: Request) -> str:
+    """Verified user id when the request carries valid credentials, else the client IP."""
+    token = bearer_token(request)
+    if token:
+        uid = verify_token(token)
+        if uid is not None:
+            return f"u{uid}"
+    init_data = request.headers.get("X-Tg-Init-Data")
+    if init_data:
+        try:
+            user = verify_telegram_init_data(init_data)
+        except ValueError:
+            user = None
+        if user:
+            return f"u{user['id']}"
+    if settings.DEV_MODE and request.headers.get("X-User-Id"):
+        return f"u{request.headers['X-User-Id']}"
+    # Each proxy appends the address it got the request from, so only the
+    # entry added by the outermost of our TRUSTED_PROXIES is the client's;
+    # anything to its left came with the request and is not evidence of anything.
+    n = settings.TRUSTED_PROXIES
+    if n:
+        hops = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        if len(hops) >= n:
+            return "ip" + hops[-n]
+    return "ip" + (request.client.host if request.client else "unknown")
+
+async def take(bucket: str, identity: str, cost: int) -> float:
+    """Spends cost tokens; returns 0 if allowed, else seconds until a retry can succeed."""
+    global _script
+    key = f"{bucket}:{identity}"
+    now = time.monotonic()
+    st = _local.get(key)
+    if st:
+        if st[2] > now:
+            return st[2] - now
+        if st[1] > now and st[0] >= cost:
+            st[0] -= cost
+            return 0.0
+
+    capacity, rate = LIMITS[bucket]
+    if _script is None:
+        _script = (await get_redis()).register_script(_TAKE)
+    granted, retry_ms = await _script(keys=[f"rl:{key}"],
+                                      args=[capacity, rate, cost * LEASE_FACTOR, cost])
+    if len(_local) > LOCAL_MAX:
+        _local.clear()
+    if granted:
+        _local[key] = [granted - cost, now + LEASE_TTL, 0.0]
+        return 0.0
+    _local[key] = [0, 0.0, now + retry_ms / 1000]
+    return retry_ms / 1000
+
+async def rate_limit(request: Request, call_next):
+    rule = route_rule(request.url.path)
+    if rule:
+        bucket, cost = rule
+        try:
+            retry_after = await take(bucket, client_identity(request), cost)
+        except Exception as e:
+            log.warning("limiter unavailable, allowing request: %s", e)
+            retry_after = 0.0
+        if retry_after > 0:
+            return JSONResponse({"error": "rate_limited", "message": "Слишком много запросов"},
+                                status_code=429, headers={"Retry-After": str(max(1, round(retry_after)))})
+    return await call_next(request)
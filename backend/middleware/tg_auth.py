@@ -1,25 +1,86 @@
 import hmac, hashlib, json, time
+from collections import OrderedDict
 from urllib.parse import unquote
 from fastapi import Request, HTTPException
+from jose import jwt, JWTError
 from config import settings
+from services import presence
+
+INIT_DATA_MAX_AGE = 86400
+CACHE_SIZE = 20_000
+CACHE_TTL  = 600
+
+_bot_secret: bytes | None = None
+# blake2b digest of init data / bearer token -> (expires_at, verified value)
+_verified: OrderedDict[bytes, tuple[float, object]] = OrderedDict()
+
+def _secret_key() -> bytes:
+    global _bot_secret
+    if _bot_secret is None:
+        _bot_secret = hmac.new(b'WebAppData', settings.TELEGRAM_BOT_TOKEN.encode(), hashlib.sha256).digest()
+    return _bot_secret
+
+def _cache_get(key: bytes):
+    hit = _verified.get(key)
+    if hit is None:
+        return None
+    if hit[0] < time.time():
+        del _verified[key]
+        return None
+    _verified.move_to_end(key)
+    return hit[1]
+
+def _cache_put(key: bytes, expires_at: float, value):
+    _verified[key] = (min(expires_at, time.time() + CACHE_TTL), value)
+    if len(_verified) > CACHE_SIZE:
+        _verified.popitem(last=False)
+
+def _digest(prefix: bytes, s: str) -> bytes:
+    return hashlib.blake2b(prefix + s.encode(), digest_size=20).digest()
 
 def verify_telegram_init_data(init_data: str) -> dict | None:
+    key = _digest(b'i', init_data)
+    user = _cache_get(key)
+    if user is not None:
+        return user
+
     vals = dict(chunk.split('=', 1) for chunk in init_data.split('&') if '=' in chunk)
     received_hash = vals.pop('hash', None)
     if not received_hash:
         return None
     data_check = '\n'.join(f'{k}={unquote(v)}' for k, v in sorted(vals.items()))
-    secret_key = hmac.new(b'WebAppData', settings.TELEGRAM_BOT_TOKEN.encode(), hashlib.sha256).digest()
-    computed   = hmac.new(secret_key, data_check.encode(), hashlib.sha256).hexdigest()
+    computed   = hmac.new(_secret_key(), data_check.encode(), hashlib.sha256).hexdigest()
     if not hmac.compare_digest(computed, received_hash):
         return None
-    if time.time() - int(vals.get('auth_date', 0)) > 86400:
+    auth_date = int(vals.get('auth_date', 0))
+    if time.time() - auth_date > INIT_DATA_MAX_AGE:
         return None
-    return json.loads(unquote(vals.get('user', '{}')))
+    user = json.loads(unquote(vals.get('user', '{}')))
+    _cache_put(key, auth_date + INIT_DATA_MAX_AGE, user)
+    return user
 
-async def get_current_user_id(request: Request) -> int:
-    init_data = request.headers.get('X-Tg-Init-Data')
-    user_id_header = request.headers.get('X-User-Id')
+def verify_token(token: str) -> int | None:
+    """User id from a JWT issued by /api/auth/telegram, or None."""
+    key = _digest(b't', token)
+    uid = _cache_get(key)
+    if uid is not None:
+        return uid
+    try:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        uid = int(claims["sub"])
+        exp = float(claims["exp"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return None
+    _cache_put(key, exp, uid)
+    return uid
+
+def resolve_user_id(init_data: str | None, user_id_header: str | None, token: str | None = None) -> int:
+    if token:
+        uid = verify_token(token)
+        if uid is not None:
+            return uid
+        if not init_data:
+            raise HTTPException(status_code=401, detail={"error": "invalid_token", "message": "Сессия истекла"})
 
     if init_data:
         user = verify_telegram_init_data(init_data)
@@ -31,3 +92,13 @@ async def get_current_user_id(request: Request) -> int:
         return int(user_id_header)
 
     raise HTTPException(status_code=401, detail={"error": "invalid_init_data", "message": "Требуется авторизация"})
+
+def bearer_token(request: Request) -> str | None:
+    auth = request.headers.get('Authorization', '')
+    return auth[7:] if auth[:7].lower() == 'bearer ' else None
+
+async def get_current_user_id(request: Request) -> int:
+    uid = resolve_user_id(request.headers.get('X-Tg-Init-Data'), request.headers.get('X-User-Id'),
+                          bearer_token(request))
+    presence.seen_request(uid, request.url.path)
+    return uid
@@ -0,0 +1,209 @@
+
+# Forward-only schema migrations, applied once each in version order by
+# database.migrate(). Never edit a migration that has shipped; add a new one.
+
+MIGRATIONS: list[tuple[int, str, str]] = []
+
+def migration(version: int, name: str, sql: str):
+    MIGRATIONS.append((version, name, sql))
+
+# The original schema; IF NOT EXISTS lets databases created before
+# migrations existed adopt it as-is.
+migration(1, "baseline", '''
+    CREATE TABLE IF NOT EXISTS users (
+        id            BIGINT PRIMARY KEY,
+        username      VARCHAR(64),
+        first_name    VARCHAR(64),
+        gold          BIGINT DEFAULT 5000,
+        xp            INT DEFAULT 0,
+        games_played  INT DEFAULT 0,
+        games_won     INT DEFAULT 0,
+        total_wagered BIGINT DEFAULT 0,
+        total_profit  BIGINT DEFAULT 0,
+        created_at    TIMESTAMP DEFAULT NOW(),
+        last_seen     TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS transactions (
+        id          SERIAL PRIMARY KEY,
+        user_id     BIGINT REFERENCES users(id),
+        type        VARCHAR(32),
+        amount      BIGINT,
+        description VARCHAR(128),
+        game        VARCHAR(32),
+        created_at  TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS bets (
+        id          SERIAL PRIMARY KEY,
+        user_id     BIGINT REFERENCES users(id),
+        game        VARCHAR(32),
+        bet_amount  BIGINT,
+        payout      BIGINT,
+        multiplier  DECIMAL(10,2),
+        meta        JSONB,
+        created_at  TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS mines_sessions (
+        id          VARCHAR(64) PRIMARY KEY,
+        user_id     BIGINT REFERENCES users(id),
+        bet         BIGINT,
+        mine_count  INT,
+        board       JSONB,
+        revealed    JSONB DEFAULT '[]',
+        cashed_out  BOOLEAN DEFAULT FALSE,
+        created_at  TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS withdrawals (
+        id          SERIAL PRIMARY KEY,
+        user_id     BIGINT REFERENCES users(id),
+        amount      BIGINT,
+        fee         BIGINT,
+        net_amount  BIGINT,
+        so2_nick    VARCHAR(64),
+        status      VARCHAR(16) DEFAULT 'pending',
+        created_at  TIMESTAMP DEFAULT NOW()
+    );
+''')
+
+# bets and transactions become monthly range partitions on created_at, so
+# appends and per-month lookups stay flat as the ledger grows and old months
+# can be detached instead of deleted. Ids move to BIGINT; the primary key
+# has to include the partition key.
+_PARTITION_TABLE = '''
+    ALTER TABLE {t} RENAME TO {t}_legacy;
+    ALTER TABLE {t}_legacy RENAME CONSTRAINT {t}_pkey TO {t}_legacy_pkey;
+    ALTER SEQUENCE {t}_id_seq AS BIGINT OWNED BY NONE;
+    CREATE TABLE {t} (
+        id          BIGINT NOT NULL DEFAULT nextval('{t}_id_seq'),
+        {columns},
+        created_at  TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE {t}_id_seq OWNED BY {t}.id;
+    CREATE TABLE {t}_default PARTITION OF {t} DEFAULT;
+    SELECT ensure_monthly_partitions('{t}',
+        COALESCE((SELECT MIN(created_at) FROM {t}_legacy), NOW())::date, 3);
+    UPDATE {t}_legacy SET created_at = NOW() WHERE created_at IS NULL;
+    INSERT INTO {t} SELECT * FROM {t}_legacy;
+    DROP TABLE {t}_legacy;
+'''
+
+migration(2, "partition_bets_transactions", '''
+    CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent TEXT, from_date DATE, months_ahead INT)
+    RETURNS VOID AS $$
+    DECLARE
+        m    DATE := date_trunc('month', from_date);
+        stop DATE := date_trunc('month', NOW()) + make_interval(months => months_ahead);
+    BEGIN
+        WHILE m <= stop LOOP
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           parent || '_' || to_char(m, 'YYYYMM'), parent, m, m + INTERVAL '1 month');
+            m := m + INTERVAL '1 month';
+        END LOOP;
+    END
+    $$ LANGUAGE plpgsql;
+''' + _PARTITION_TABLE.format(t="transactions", columns='''user_id     BIGINT REFERENCES users(id),
+        type        VARCHAR(32),
+        amount      BIGINT,
+        description VARCHAR(128),
+        game        VARCHAR(32)''') + _PARTITION_TABLE.format(t="bets", columns='''user_id     BIGINT REFERENCES users(id),
+        game        VARCHAR(32),
+        bet_amount  BIGINT,
+        payout      BIGINT,
+        multiplier  DECIMAL(10,2),
+        meta        JSONB'''))
+
+# Indexes for the hot lookups: a user's ledger newest-first, time-window
+# scans of bets, and the open Mines session of a user.
+migration(3, "hot_path_indexes", '''
+    CREATE INDEX IF NOT EXISTS transactions_user_created_idx ON transactions (user_id, created_at DESC);
+    CREATE INDEX IF NOT EXISTS bets_user_created_idx ON bets (user_id, created_at DESC);
+    CREATE INDEX IF NOT EXISTS bets_created_idx ON bets (created_at);
+    CREATE INDEX IF NOT EXISTS mines_sessions_open_idx ON mines_sessions (user_id) WHERE NOT cashed_out;
+''')
+
+# Balance version for the Redis balance cache: every statement that changes
+# gold bumps it, so cache writes can be ordered (services/balance_cache.py).
+migration(4, "users_gold_ver", '''
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS gold_ver BIGINT NOT NULL DEFAULT 0;
+''')
+
+# Play statistics move off users, whose row is now written once per play
+# (the balance); plays are counted in Redis and added here in bulk by
+# services/user_stats.py.
+migration(5, "user_stats", '''
+    CREATE TABLE user_stats (
+        user_id       BIGINT PRIMARY KEY REFERENCES users(id),
+        games_played  INT NOT NULL DEFAULT 0,
+        games_won     INT NOT NULL DEFAULT 0,
+        total_wagered BIGINT NOT NULL DEFAULT 0,
+        total_profit  BIGINT NOT NULL DEFAULT 0,
+        xp            INT NOT NULL DEFAULT 0,
+        flushed_batch BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO user_stats (user_id, games_played, games_won, total_wagered, total_profit, xp)
+    SELECT id, COALESCE(games_played, 0), COALESCE(games_won, 0), COALESCE(total_wagered, 0),
+           COALESCE(total_profit, 0), COALESCE(xp, 0)
+    FROM users WHERE games_played > 0 OR xp > 0;
+    ALTER TABLE users DROP COLUMN games_played, DROP COLUMN games_won, DROP COLUMN total_wagered,
+                      DROP COLUMN total_profit, DROP COLUMN xp;
+''')
+
+# bets and transactions rows are written behind the play by services/ledger.py,
+# which may deliver a row more than once; the key makes the second insert a no-op.
+migration(6, "ledger_dedupe_keys", '''
+    ALTER TABLE transactions ADD COLUMN dedupe_key UUID;
+    ALTER TABLE bets ADD COLUMN dedupe_key UUID;
+    CREATE UNIQUE INDEX transactions_dedupe_idx ON transactions (dedupe_key, created_at);
+    CREATE UNIQUE INDEX bets_dedupe_idx ON bets (dedupe_key, created_at);
+''')
+
+# Keyset paging and export of a user's history (services/history.py) walk
+# (user_id, created_at, id); the transactions index also carries the listed
+# columns so a page is read from the index alone.
+migration(7, "history_keyset_indexes", '''
+    DROP INDEX IF EXISTS transactions_user_created_idx;
+    DROP INDEX IF EXISTS bets_user_created_idx;
+    CREATE INDEX transactions_user_keyset_idx ON transactions (user_id, created_at DESC, id DESC)
+        INCLUDE (type, amount, description, game);
+    CREATE INDEX bets_user_keyset_idx ON bets (user_id, created_at, id);
+''')
+
+# Provably fair crash (services/crash_fair.py): precomputed seed chains, kept
+# as their terminal hash plus one checkpoint every 1000 hashes, and every
+# finished round with the seed it revealed.
+migration(8, "crash_seed_chains", '''
+    CREATE TABLE crash_chains (
+        id            SERIAL PRIMARY KEY,
+        length        INT NOT NULL,
+        terminal_hash CHAR(64) NOT NULL,
+        checkpoints   BYTEA NOT NULL,
+        next_index    INT NOT NULL DEFAULT 1,
+        created_at    TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE crash_rounds (
+        round_id      VARCHAR(64) PRIMARY KEY,
+        chain_id      INT NOT NULL REFERENCES crash_chains(id),
+        idx           INT NOT NULL,
+        seed          CHAR(64) NOT NULL,
+        crash_point   DECIMAL(12,2) NOT NULL,
+        bets          INT NOT NULL,
+        wagered       BIGINT NOT NULL,
+        created_at    TIMESTAMP DEFAULT NOW()
+    );
+''')
+
+# The ledger's write-behind queue moves into Postgres (services/ledger.py):
+# a play writes its bets/transactions entries here in the same transaction
+# as its gold change, and the writer moves them into the partitions.
+migration(9, "ledger_outbox", '''
+    CREATE TABLE ledger_outbox (
+        id          BIGSERIAL PRIMARY KEY,
+        entries     JSONB NOT NULL
+    );
+    CREATE TABLE ledger_dead (
+        id          BIGSERIAL PRIMARY KEY,
+        entry       JSONB NOT NULL,
+        error       TEXT,
+        created_at  TIMESTAMP DEFAULT NOW()
+    );
+''')
@@ -1,10 +1,11 @@
 import redis.asyncio as aioredis
 from config import settings
+from services.metrics import InstrumentedRedis
 
 _redis: aioredis.Redis = None
 
 async def get_redis() -> aioredis.Redis:
     global _redis
     if _redis is None:
-        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        _redis = InstrumentedRedis.from_url(settings.REDIS_URL, decode_responses=True)
     return _redis
@@ -4,6 +4,8 @@ from database import get_pool
 from middleware.tg_auth import verify_telegram_init_data
 from jose import jwt
 from config import settings
+from services import presence
+from services.leaderboard import set_name
 import time
 
 router = APIRouter()
@@ -35,6 +37,8 @@ async def auth_telegram(body: TelegramAuthRequest):
                 user_id, username, first_name
             )
         await conn.execute("UPDATE users SET last_seen=NOW() WHERE id=$1", user_id)
+    presence.seen(user_id)
+    await set_name(user_id, first_name)
 
     token = jwt.encode(
         {"sub": str(user_id), "exp": int(time.time()) + 86400 * 7},
@@ -3,12 +3,23 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from database import get_pool
 from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet, credit_win, record_game
+from services.wallet_service import settle_play
+from services.autoplay import AutoplayParams, check_bet, run_autoplay
+from services import rng
 from config import settings
-import secrets, math
+import math
 
 router = APIRouter()
 
+def payout_for(bet: int, side: str, result: str) -> int:
+    return math.floor(bet * 2 * (1 - settings.HOUSE_EDGE)) if result == side else 0
+
+def flip(bet: int, side: str, r: int | None = None) -> tuple[str, bool, int]:
+    """r: a pre-drawn rng.below(2), for batches."""
+    result = "heads" if (rng.below(2) if r is None else r) == 0 else "tails"
+    payout = payout_for(bet, side, result)
+    return result, result == side, payout
+
 class CoinRequest(BaseModel):
     bet: int
     side: str   # "heads" | "tails"
@@ -23,15 +34,28 @@ async def coin_play(body: CoinRequest, request: Request):
     if body.side not in ("heads", "tails"):
         raise HTTPException(400, {"error": "invalid_side"})
 
-    result = "heads" if secrets.randbelow(2) == 0 else "tails"
-    won    = result == body.side
-    payout = math.floor(body.bet * 2 * (1 - settings.HOUSE_EDGE)) if won else 0
+    result, won, payout = flip(body.bet, body.side)
 
     pool = await get_pool()
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            await deduct_bet(conn, uid, body.bet, "coin")
-            await credit_win(conn, uid, payout, "coin")
-            await record_game(conn, uid, "coin", body.bet, payout, 2.0 if won else 0.0)
+        res = await settle_play(conn, uid, "coin", body.bet, payout, 2.0 if won else 0.0)
+    if not res.ok:
+        raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
+
+    return {"result": result, "won": won, "payout": payout, "balance": res.balance}
+
+class CoinAutoplayRequest(AutoplayParams):
+    side: str
+
+@router.post("/autoplay")
+async def coin_autoplay(body: CoinAutoplayRequest, request: Request):
+    uid = await get_current_user_id(request)
+    check_bet(body.bet)
+    if body.side not in ("heads", "tails"):
+        raise HTTPException(400, {"error": "invalid_side"})
 
-    return {"result": result, "won": won, "payout": payout}
+    outcomes = []
+    for r in rng.below_many(2, body.rounds):
+        result, won, payout = flip(body.bet, body.side, r)
+        outcomes.append((payout, 2.0 if won else 0.0, {}, {"result": result, "won": won, "payout": payout}))
+    return await run_autoplay(uid, "coin", body, outcomes)
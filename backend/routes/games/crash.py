@@ -1,93 +1,185 @@
 
-from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel
-from redis_client import get_redis
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, Field, ValidationError
 from database import get_pool
-from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet
+from middleware.tg_auth import get_current_user_id, resolve_user_id
+from services.wallet_service import AfterCommit, deduct_bet, credit_wins
+from services import crash_stream, crash_round, crash_fair
+from services.crash_worker import crash_payout, seed_crash_point
 from config import settings
-import json, math
+import asyncio, json, logging
 from typing import Optional
 
 router = APIRouter()
-CRASH_KEY = "crash:state"
+log = logging.getLogger("crash")
 
 @router.get("/state")
 async def crash_state():
-    redis = await get_redis()
-    raw = await redis.get(CRASH_KEY)
-    if not raw:
-        return {"phase":"waiting","multiplier":1.0,"round_id":None,"countdown":5,"bets":[]}
-    s = json.loads(raw)
-    # Strip crash_at from response
-    s.pop("crash_at", None)
-    # Strip user_id from bets
-    for b in s.get("bets", []):
-        b.pop("user_id", None)
-        b.pop("auto_cashout", None)
-    return s
+    # Served from the in-process stream state: no Redis round trip, and it
+    # never contains crash_at, user ids or auto-cashout targets.
+    return crash_stream.snapshot()
+
+@router.get("/history")
+async def crash_history(limit: int = Query(20, ge=1, le=crash_fair.HISTORY_SIZE)):
+    # Finished rounds only, newest first, from the Redis ring buffer
+    return {"rounds": await crash_fair.history(limit)}
+
+@router.get("/verify")
+async def crash_verify(round_id: Optional[str] = None,
+                       seed: Optional[str] = Query(None, pattern="^[0-9a-f]{64}$")):
+    """Recomputes a crash point. With a seed: its crash point and the seed of
+    the round before it. With a round id: also checks the recorded crash
+    point and the seed's place in its chain."""
+    if seed:
+        return {"seed": seed, "crash_point": seed_crash_point(seed),
+                "previous_seed": crash_fair.previous_seed(seed), "salt": settings.CRASH_SALT}
+    if not round_id:
+        raise HTTPException(400, {"error": "missing_round", "message": "Укажите round_id или seed"})
+    r = await crash_fair.find_round(round_id)
+    if not r:
+        raise HTTPException(404, {"error": "round_not_found", "message": "Раунд не найден или ещё не завершён"})
+    computed = seed_crash_point(r["seed"])
+    in_chain = await crash_fair.chain_check(r["chain_id"], r["index"], r["seed"])
+    return {
+        **r,
+        "salt":          settings.CRASH_SALT,
+        "computed":      computed,
+        "previous_seed": crash_fair.previous_seed(r["seed"]),
+        "in_chain":      in_chain,
+        "valid":         in_chain and computed == r["crash_point"],
+    }
+
+MAX_AUTO_CASHOUT = 1_000_000
 
 class CrashBetRequest(BaseModel):
     bet: int
-    auto_cashout: Optional[float] = None
+    auto_cashout: Optional[float] = Field(None, ge=1.01, le=MAX_AUTO_CASHOUT, allow_inf_nan=False)
 
 @router.post("/bet")
 async def crash_bet(body: CrashBetRequest, request: Request):
     uid = await get_current_user_id(request)
-    if body.bet < settings.MIN_BET: raise HTTPException(400, {"error":"bet_too_low"})
-    if body.bet > settings.MAX_BET: raise HTTPException(400, {"error":"bet_too_high"})
+    return await place_bet(uid, body.bet, body.auto_cashout)
+
+async def place_bet(uid: int, bet: int, auto_cashout: Optional[float]) -> dict:
+    if bet < settings.MIN_BET: raise HTTPException(400, {"error":"bet_too_low"})
+    if bet > settings.MAX_BET: raise HTTPException(400, {"error":"bet_too_high"})
 
-    redis = await get_redis()
-    raw   = await redis.get(CRASH_KEY)
-    if not raw:
+    round_id, phase = await crash_round.current_round()
+    if not round_id:
         raise HTTPException(400, {"error":"wrong_phase","message":"Игра не запущена"})
-    s = json.loads(raw)
-    if s["phase"] != "waiting":
+    if phase != "waiting":
         raise HTTPException(400, {"error":"wrong_phase","message":"Ставки принимаются только в фазе ожидания"})
 
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await deduct_bet(conn, uid, body.bet, "crash")
-            row = await conn.fetchrow("SELECT first_name FROM users WHERE id=$1", uid)
-
-    s["bets"].append({
-        "user_id": uid,
-        "name":    row["first_name"] if row else "User",
-        "bet":     body.bet,
-        "cashout": None,
-        "auto_cashout": body.auto_cashout
-    })
-    await redis.set(CRASH_KEY, json.dumps(s))
-    return {"ok": True, "round_id": s["round_id"]}
+    # The bet is registered in Redis inside the debit transaction: if the
+    # script rejects it (phase moved on, second bet) the debit rolls back.
+    idx   = -1
+    pool  = await get_pool()
+    after = AfterCommit()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                balance = await deduct_bet(conn, after, uid, bet, "crash")
+                row  = await conn.fetchrow("SELECT first_name FROM users WHERE id=$1", uid)
+                name = row["first_name"] if row else "User"
+                idx  = await crash_round.place_bet(round_id, uid, name, bet, auto_cashout)
+                if idx == -1:
+                    raise HTTPException(400, {"error":"wrong_phase","message":"Ставки принимаются только в фазе ожидания"})
+                if idx == -2:
+                    raise HTTPException(400, {"error":"already_bet","message":"Ставка в этом раунде уже сделана"})
+                await after.stage(conn)
+    except Exception:
+        if idx >= 0:   # registered in Redis but the debit did not commit
+            await crash_round.cancel_bet(round_id, uid)
+        raise
+
+    await after.run()
+    await crash_stream.publish({"type": "bet", "round_id": round_id, "i": idx, "name": name, "bet": bet})
+    return {"ok": True, "round_id": round_id, "i": idx, "balance": balance[1]}
 
 @router.post("/cashout")
 async def crash_cashout(request: Request):
-    uid   = await get_current_user_id(request)
-    redis = await get_redis()
-    raw   = await redis.get(CRASH_KEY)
-    if not raw:
+    uid = await get_current_user_id(request)
+    return await cash_out(uid)
+
+async def cash_out(uid: int) -> dict:
+    round_id, phase = await crash_round.current_round()
+    if not round_id:
         raise HTTPException(400, {"error":"game_not_found"})
-    s = json.loads(raw)
-    if s["phase"] != "running":
+    if phase != "running":
         raise HTTPException(400, {"error":"wrong_phase"})
 
-    bet_entry = next((b for b in s["bets"] if b["user_id"] == uid and b["cashout"] is None), None)
-    if not bet_entry:
+    code, mult, bet_entry = await crash_round.cashout(round_id, uid)
+    if code == -1:
+        raise HTTPException(400, {"error":"wrong_phase"})
+    if code == -2:
         raise HTTPException(400, {"error":"game_not_found","message":"Активная ставка не найдена"})
 
-    mult   = s["multiplier"]
-    payout = math.floor(bet_entry["bet"] * mult * (1 - settings.HOUSE_EDGE))
-    bet_entry["cashout"] = mult
-    await redis.set(CRASH_KEY, json.dumps(s))
+    payout = crash_payout(bet_entry["bet"], mult)
+    await crash_stream.publish({"type": "cashout", "round_id": round_id, "i": bet_entry["i"], "multiplier": mult})
 
-    pool = await get_pool()
+    pool  = await get_pool()
+    after = AfterCommit()
     async with pool.acquire() as conn:
         async with conn.transaction():
-            await conn.execute("UPDATE users SET gold=gold+$1 WHERE id=$2", payout, uid)
-            await conn.execute(
-                "INSERT INTO transactions(user_id,type,amount,description,game) VALUES($1,'win',$2,$3,'crash')",
-                uid, payout, f"Crash cashout x{mult}"
-            )
+            balances = await credit_wins(conn, after, "crash", [(uid, payout, f"Crash cashout x{mult}")])
+            await after.stage(conn)
+    await after.run()
+
+    return {"ok": True, "payout": payout, "multiplier": mult,
+            "balance": balances[0][1] if balances else None}
+
+# ── Streaming ──────────────────────────────────────────────
+# Browsers cannot set headers on a WebSocket, so credentials come as query
+# params. Anonymous clients may watch; bets and cashouts need a user.
+@router.websocket("/ws")
+async def crash_ws(ws: WebSocket):
+    await ws.accept()
+    try:
+        uid = resolve_user_id(ws.query_params.get("init_data"), ws.query_params.get("uid"),
+                              ws.query_params.get("token"))
+    except HTTPException:
+        uid = None
+
+    q = crash_stream.subscribe()
+
+    async def pump():
+        while True:
+            await ws.send_text(await q.get())
 
-    return {"ok": True, "payout": payout, "multiplier": mult}
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+                action = msg.get("action")
+            except (ValueError, AttributeError):
+                continue
+            reply = {"type": "reply", "id": msg.get("id"), "action": action}
+            try:
+                if uid is None:
+                    raise HTTPException(401, {"error": "invalid_init_data", "message": "Требуется авторизация"})
+                if action == "bet":
+                    try:
+                        body = CrashBetRequest.model_validate(msg)
+                    except ValidationError:
+                        raise HTTPException(400, {"error": "invalid_request"})
+                    result = await place_bet(uid, body.bet, body.auto_cashout)
+                elif action == "cashout":
+                    result = await cash_out(uid)
+                else:
+                    raise HTTPException(400, {"error": "unknown_action"})
+                reply.update(result)
+                reply["ok"] = True
+            except HTTPException as e:
+                reply.update(ok=False, status=e.status_code, **(e.detail if isinstance(e.detail, dict) else {}))
+            except Exception:
+                # One failed action must not take the connection (and the
+                # client's pending replies) down with it
+                log.exception("crash ws %s failed", action)
+                reply.update(ok=False, status=500, error="internal_error", message="Внутренняя ошибка")
+            crash_stream.send_private(q, reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        crash_stream.unsubscribe(q)
@@ -3,14 +3,25 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from database import get_pool
 from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet, credit_win, record_game
+from services.wallet_service import settle_play
+from services.autoplay import AutoplayParams, check_bet, run_autoplay
+from services import rng
 from config import settings
-import secrets, math
+import math
 
 router = APIRouter()
 
 MULTIPLIERS = {2:36,3:18,4:12,5:9,6:7.2,7:6,8:7.2,9:9,10:12,11:18,12:36}
 
+def payout_for(bet: int, chosen: int, total: int) -> int:
+    return math.floor(bet * MULTIPLIERS[chosen] * (1 - settings.HOUSE_EDGE)) if total == chosen else 0
+
+def roll(bet: int, chosen: int, faces: list[int] | None = None) -> tuple[int, int, bool, int]:
+    """faces: two pre-drawn rng.below(6), for batches."""
+    die1, die2 = (x + 1 for x in faces or rng.below_many(6, 2))
+    payout = payout_for(bet, chosen, die1 + die2)
+    return die1, die2, die1 + die2 == chosen, payout
+
 class DiceRequest(BaseModel):
     bet: int
     chosen: int   # 2..12
@@ -22,19 +33,33 @@ async def dice_play(body: DiceRequest, request: Request):
     if body.bet > settings.MAX_BET:   raise HTTPException(400, {"error":"bet_too_high"})
     if body.chosen not in MULTIPLIERS: raise HTTPException(400, {"error":"invalid_chosen"})
 
-    die1 = secrets.randbelow(6) + 1
-    die2 = secrets.randbelow(6) + 1
+    die1, die2, won, payout = roll(body.bet, body.chosen)
     total = die1 + die2
-    won   = total == body.chosen
     mult  = MULTIPLIERS[body.chosen]
-    payout = math.floor(body.bet * mult * (1 - settings.HOUSE_EDGE)) if won else 0
 
     pool = await get_pool()
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            await deduct_bet(conn, uid, body.bet, "dice")
-            await credit_win(conn, uid, payout, "dice")
-            await record_game(conn, uid, "dice", body.bet, payout, mult if won else 0.0,
-                              {"die1": die1, "die2": die2})
+        res = await settle_play(conn, uid, "dice", body.bet, payout, mult if won else 0.0,
+                                {"die1": die1, "die2": die2})
+    if not res.ok:
+        raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
+
+    return {"die1": die1, "die2": die2, "sum": total, "won": won, "payout": payout, "balance": res.balance}
+
+class DiceAutoplayRequest(AutoplayParams):
+    chosen: int
+
+@router.post("/autoplay")
+async def dice_autoplay(body: DiceAutoplayRequest, request: Request):
+    uid = await get_current_user_id(request)
+    check_bet(body.bet)
+    if body.chosen not in MULTIPLIERS: raise HTTPException(400, {"error":"invalid_chosen"})
 
-    return {"die1": die1, "die2": die2, "sum": total, "won": won, "payout": payout}
+    mult = MULTIPLIERS[body.chosen]
+    outcomes = []
+    faces = rng.below_many(6, 2 * body.rounds)
+    for j in range(0, len(faces), 2):
+        die1, die2, won, payout = roll(body.bet, body.chosen, faces[j:j + 2])
+        outcomes.append((payout, mult if won else 0.0, {"die1": die1, "die2": die2},
+                         {"die1": die1, "die2": die2, "sum": die1 + die2, "won": won, "payout": payout}))
+    return await run_autoplay(uid, "dice", body, outcomes)
@@ -3,9 +3,10 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from database import get_pool
 from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet, credit_win, record_game
+from services.wallet_service import AfterCommit, deduct_bet, credit_win, record_game, record_games
+from services import mines_store as store, rng
 from config import settings
-import secrets, math, uuid, json
+import math, uuid, json
 from math import comb
 
 router = APIRouter()
@@ -16,6 +17,12 @@ def calc_multiplier(total_safe: int, found: int, total: int = 25, mine_count: in
         prob *= (total_safe - i) / (total - i)
     return round((1 / prob) * (1 - settings.HOUSE_EDGE), 2)
 
+# calc_multiplier for every (mine_count, found) pair, so reveals only index a list
+MULTIPLIERS = [[calc_multiplier(25 - m, f, 25, m) for f in range(26 - m)] for m in range(25)]
+
+def multiplier_for(mine_count: int, found: int) -> float:
+    return MULTIPLIERS[mine_count][found]
+
 class MinesStartRequest(BaseModel):
     bet: int
     mines: int   # 1..24
@@ -27,6 +34,65 @@ class MinesRevealRequest(BaseModel):
 class MinesCashoutRequest(BaseModel):
     game_id: str
 
+class MinesBatchRevealRequest(BaseModel):
+    game_id: str
+    cells: list[int] = []    # revealed in this order
+    auto_pick: int = 0       # or: this many random unrevealed cells
+    cashout: bool = False    # cash out at the end if no mine was hit
+
+_ERRORS = {
+    store.NOT_FOUND:        (404, "game_not_found"),
+    store.FORBIDDEN:        (403, "forbidden"),
+    store.EXPIRED:          (400, "session_expired"),
+    store.ALREADY_REVEALED: (400, "already_revealed"),
+    store.NOTHING_REVEALED: (400, "no_cells_revealed"),
+}
+
+def _raise_for(code: int):
+    status, error = _ERRORS[code]
+    raise HTTPException(status, {"error": error})
+
+async def _close_session(conn, session_id: str, revealed: int) -> bool:
+    """Marks the Postgres row ended; False if it was already closed elsewhere."""
+    return await conn.fetchval(
+        "UPDATE mines_sessions SET revealed=$1, cashed_out=TRUE WHERE id=$2 AND NOT cashed_out RETURNING TRUE",
+        json.dumps(store.cells(revealed)), session_id
+    ) is not None
+
+async def _settle_loss(session_id: str, uid: int, bet: int, mine_count: int, cells: int, revealed: int):
+    pool  = await get_pool()
+    after = AfterCommit()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await _close_session(conn, session_id, revealed):
+                return
+            record_game(after, uid, "mines", bet, 0, 0.0, {"mines": mine_count, "cells": cells})
+            await after.stage(conn)
+    await after.run()
+
+async def _settle_cashout(session_id: str, uid: int, bet: int, mine_count: int, found: int,
+                          revealed: int) -> tuple[int, float, int | None]:
+    """Pays out a session the store has already marked cashed; reopens it if that fails."""
+    mult   = multiplier_for(mine_count, found)
+    payout = math.floor(bet * mult)
+    pool  = await get_pool()
+    after = AfterCommit()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await _close_session(conn, session_id, revealed):
+                    raise HTTPException(400, {"error":"session_expired"})
+                balance = await credit_win(conn, after, uid, payout, "mines")
+                record_game(after, uid, "mines", bet, payout, mult, {"mines": mine_count, "cells": found})
+                await after.stage(conn)
+    except HTTPException:
+        raise
+    except Exception:
+        await store.reopen(session_id)
+        raise
+    await after.run()
+    return payout, mult, balance[1] if balance else None
+
 @router.post("/start")
 async def mines_start(body: MinesStartRequest, request: Request):
     uid = await get_current_user_id(request)
@@ -34,26 +100,36 @@ async def mines_start(body: MinesStartRequest, request: Request):
     if body.bet > settings.MAX_BET:  raise HTTPException(400, {"error":"bet_too_high"})
     if not (1 <= body.mines <= 24):  raise HTTPException(400, {"error":"invalid_mines"})
 
-    board = ['safe'] * 25
-    mine_positions = random_sample(25, body.mines)
-    for pos in mine_positions:
-        board[pos] = 'mine'
+    mines = rng.sample_mask(25, body.mines)
 
     session_id = str(uuid.uuid4())
-    pool = await get_pool()
+    pool  = await get_pool()
+    after = AfterCommit()
     async with pool.acquire() as conn:
         async with conn.transaction():
-            # Close any open session
-            await conn.execute(
-                "UPDATE mines_sessions SET cashed_out=TRUE WHERE user_id=$1 AND cashed_out=FALSE",
+            # Close any open session; it is forfeited and recorded as lost
+            forfeited = await conn.fetch(
+                "UPDATE mines_sessions SET cashed_out=TRUE WHERE user_id=$1 AND cashed_out=FALSE "
+                "RETURNING id, bet, mine_count",
                 uid
             )
-            await deduct_bet(conn, uid, body.bet, "mines")
+            peeked = await store.peek([r["id"] for r in forfeited])
+            record_games(after, "mines", [
+                (uid, r["bet"], 0, 0.0, store.loss_meta(r["mine_count"], revealed))
+                for r, (_, revealed) in zip(forfeited, peeked)
+            ])
+            try:
+                balance = await deduct_bet(conn, after, uid, body.bet, "mines")
+            except ValueError:
+                raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
             await conn.execute(
                 "INSERT INTO mines_sessions(id,user_id,bet,mine_count,board,revealed) VALUES($1,$2,$3,$4,$5,$6)",
-                session_id, uid, body.bet, body.mines, json.dumps(board), json.dumps([])
+                session_id, uid, body.bet, body.mines, json.dumps(store.board_from_mask(mines)), json.dumps([])
             )
-    return {"game_id": session_id}
+            await after.stage(conn)
+    await after.run()
+    await store.create(session_id, uid, body.bet, body.mines, mines)
+    return {"game_id": session_id, "balance": balance[1]}
 
 @router.post("/reveal")
 async def mines_reveal(body: MinesRevealRequest, request: Request):
@@ -61,79 +137,57 @@ async def mines_reveal(body: MinesRevealRequest, request: Request):
     if not (0 <= body.cell <= 24):
         raise HTTPException(400, {"error":"invalid_cell"})
 
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            sess = await conn.fetchrow(
-                "SELECT * FROM mines_sessions WHERE id=$1 FOR UPDATE", body.game_id
-            )
-            if not sess:              raise HTTPException(404, {"error":"game_not_found"})
-            if sess["user_id"] != uid: raise HTTPException(403, {"error":"forbidden"})
-            if sess["cashed_out"]:    raise HTTPException(400, {"error":"session_expired"})
+    res = await store.reveal(body.game_id, uid, body.cell)
+    if res[0] < 0:
+        _raise_for(res[0])
 
-            board    = json.loads(sess["board"])
-            revealed = json.loads(sess["revealed"])
+    if res[0] == 1:
+        _, found, revealed, mines, bet, mine_count = res
+        await _settle_loss(body.game_id, uid, bet, mine_count, found + 1, revealed)
+        return {"safe": False, "symbol": "💣", "game_over": True, "board": store.board_from_mask(mines)}
 
-            if body.cell in revealed:
-                raise HTTPException(400, {"error":"already_revealed"})
-
-            revealed.append(body.cell)
-            cell_type = board[body.cell]
-
-            if cell_type == "mine":
-                await conn.execute(
-                    "UPDATE mines_sessions SET revealed=$1, cashed_out=TRUE WHERE id=$2",
-                    json.dumps(revealed), body.game_id
-                )
-                await record_game(conn, uid, "mines", sess["bet"], 0, 0.0,
-                                  {"mines": sess["mine_count"], "cells": len(revealed)})
-                return {"safe": False, "symbol": "💣", "game_over": True, "board": board}
-
-            await conn.execute(
-                "UPDATE mines_sessions SET revealed=$1 WHERE id=$2",
-                json.dumps(revealed), body.game_id
-            )
-            total_safe = 25 - sess["mine_count"]
-            found = len(revealed)
-            mult  = calc_multiplier(total_safe, found, 25, sess["mine_count"])
-
-    return {"safe": True, "symbol": "💎", "multiplier": mult, "game_over": False, "board": None}
+    _, found, _, mine_count = res
+    return {"safe": True, "symbol": "💎", "multiplier": multiplier_for(mine_count, found), "game_over": False, "board": None}
 
 @router.post("/cashout")
 async def mines_cashout(body: MinesCashoutRequest, request: Request):
     uid = await get_current_user_id(request)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            sess = await conn.fetchrow(
-                "SELECT * FROM mines_sessions WHERE id=$1 FOR UPDATE", body.game_id
-            )
-            if not sess:               raise HTTPException(404, {"error":"game_not_found"})
-            if sess["user_id"] != uid:  raise HTTPException(403, {"error":"forbidden"})
-            if sess["cashed_out"]:      raise HTTPException(400, {"error":"session_expired"})
-
-            board    = json.loads(sess["board"])
-            revealed = json.loads(sess["revealed"])
-            if not revealed:
-                raise HTTPException(400, {"error":"no_cells_revealed"})
-
-            total_safe = 25 - sess["mine_count"]
-            mult   = calc_multiplier(total_safe, len(revealed), 25, sess["mine_count"])
-            payout = math.floor(sess["bet"] * mult)
-
-            await conn.execute(
-                "UPDATE mines_sessions SET cashed_out=TRUE WHERE id=$1", body.game_id
-            )
-            await credit_win(conn, uid, payout, "mines")
-            await record_game(conn, uid, "mines", sess["bet"], payout, mult,
-                              {"mines": sess["mine_count"], "cells": len(revealed)})
-
-    return {"payout": payout, "multiplier": mult, "board": board}
-
-def random_sample(n: int, k: int) -> list:
-    pool = list(range(n))
-    result = []
-    for i in range(k):
-        idx = secrets.randbelow(len(pool))
-        result.append(pool.pop(idx))
-    return result
+    res = await store.cashout(body.game_id, uid)
+    if res[0] < 0:
+        _raise_for(res[0])
+    _, found, revealed, mines, bet, mine_count = res
+    payout, mult, balance = await _settle_cashout(body.game_id, uid, bet, mine_count, found, revealed)
+    return {"payout": payout, "multiplier": mult, "board": store.board_from_mask(mines), "balance": balance}
+
+@router.post("/reveal-batch")
+async def mines_reveal_batch(body: MinesBatchRevealRequest, request: Request):
+    """Several reveals in one request and one state update: the listed cells in
+    order, or auto_pick random ones, stopping at the first mine."""
+    uid = await get_current_user_id(request)
+    if bool(body.cells) == bool(body.auto_pick):
+        raise HTTPException(400, {"error":"invalid_cells", "message":"Укажите клетки или auto_pick"})
+    if body.cells:
+        if len(body.cells) > 25 or not all(0 <= c <= 24 for c in body.cells):
+            raise HTTPException(400, {"error":"invalid_cell"})
+        order, pick = body.cells, 0
+    else:
+        if not (1 <= body.auto_pick <= 24):
+            raise HTTPException(400, {"error":"invalid_auto_pick"})
+        order, pick = rng.sample(25, 25), body.auto_pick
+
+    res = await store.reveal_many(body.game_id, uid, order, pick, body.cashout)
+    if res[0] < 0:
+        _raise_for(res[0])
+    hit, found, revealed, prev, mines, bet, mine_count, cashed = res
+    opened = [c for c in order if (revealed & ~prev) >> c & 1]
+
+    if hit:
+        await _settle_loss(body.game_id, uid, bet, mine_count, found + 1, revealed)
+        return {"safe": False, "cells": opened, "found": found, "multiplier": 0.0,
+                "game_over": True, "payout": 0, "board": store.board_from_mask(mines)}
+    if cashed:
+        payout, mult, balance = await _settle_cashout(body.game_id, uid, bet, mine_count, found, revealed)
+        return {"safe": True, "cells": opened, "found": found, "multiplier": mult,
+                "game_over": True, "payout": payout, "board": store.board_from_mask(mines), "balance": balance}
+    return {"safe": True, "cells": opened, "found": found, "multiplier": multiplier_for(mine_count, found),
+            "game_over": False, "payout": None, "board": None}
@@ -3,54 +3,111 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from database import get_pool
 from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet, credit_win, record_game
+from services.wallet_service import settle_play
+from services import rng
 from config import settings
-import secrets, math
+import math
 from typing import Dict
 
 router = APIRouter()
 
 RED_NUMS = {1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36}
 
+def color_of(number: int) -> str:
+    if number == 0:          return "green"
+    if number in RED_NUMS:   return "red"
+    return "black"
+
+# ── Table ──────────────────────────────────────────────────
+# Every bet the table takes: (key, kind, numbers covered, multiplier). A
+# winning bet returns amount * multiplier * (1 - HOUSE_EDGE), stake included.
+# Inside bets follow the layout (three numbers per row, 1-2-3 first):
+#   num_{n}        straight      split_{a}_{b}  two neighbours, a < b, or 0 with 1/2/3
+#   street_{n}     row n..n+2    corner_{n}     n, n+1, n+3, n+4
+#   line_{n}       rows n..n+5   dozen_{1..3}   column_{1..3}
+# plus the cat_* outside bets. A bet covering k numbers pays 36 / k, so
+# every bet returns the same share; the one exception is cat_green, which
+# keeps the x14 the table has always shown for zero.
+GREEN_MULT = 14
+
+def _bet_types() -> list[tuple[str, str, tuple[int, ...], float]]:
+    out = [(f"num_{n}", "straight", (n,)) for n in range(37)]
+    out += [(f"split_0_{n}", "split", (0, n)) for n in (1, 2, 3)]
+    for n in range(1, 37):
+        if n % 3:  out.append((f"split_{n}_{n + 1}", "split", (n, n + 1)))
+        if n <= 33: out.append((f"split_{n}_{n + 3}", "split", (n, n + 3)))
+    rows = range(1, 37, 3)
+    out += [(f"street_{n}", "street", (n, n + 1, n + 2)) for n in rows]
+    out += [(f"corner_{n}", "corner", (n, n + 1, n + 3, n + 4)) for n in range(1, 33) if n % 3]
+    out += [(f"line_{n}", "line", tuple(range(n, n + 6))) for n in rows if n <= 31]
+    out += [(f"dozen_{d}", "dozen", tuple(range(12 * d - 11, 12 * d + 1))) for d in (1, 2, 3)]
+    out += [(f"column_{c}", "column", tuple(range(c, 37, 3))) for c in (1, 2, 3)]
+    nums = range(1, 37)
+    out += [
+        ("cat_red",   "red",   tuple(n for n in nums if n in RED_NUMS)),
+        ("cat_black", "black", tuple(n for n in nums if n not in RED_NUMS)),
+        ("cat_green", "green", (0,)),
+        ("cat_odd",   "odd",   tuple(n for n in nums if n % 2)),
+        ("cat_even",  "even",  tuple(n for n in nums if not n % 2)),
+        ("cat_half1", "half",  tuple(range(1, 19))),
+        ("cat_half2", "half",  tuple(range(19, 37))),
+    ]
+    return [(key, kind, numbers, GREEN_MULT if key == "cat_green" else 36 // len(numbers))
+            for key, kind, numbers in out]
+
+BET_TYPES = _bet_types()
+BET_INDEX = {key: i for i, (key, *_) in enumerate(BET_TYPES)}
+# MATRIX[number][i]: multiplier bet type i pays when the ball lands on number, 0 if it loses
+MATRIX = [tuple(mult if n in numbers else 0 for _, _, numbers, mult in BET_TYPES) for n in range(37)]
+
+def parse_bets(bets: Dict[str, int]) -> list[tuple[int, int]]:
+    """(bet type index, amount) pairs; raises ValueError naming the first
+    unknown key or non-positive amount."""
+    parsed = []
+    for key, amount in bets.items():
+        i = BET_INDEX.get(key)
+        if i is None or amount <= 0:
+            raise ValueError(key)
+        parsed.append((i, amount))
+    return parsed
+
+def payout_for(bets: list[tuple[int, int]], number: int) -> int:
+    row = MATRIX[number]
+    HE  = 1 - settings.HOUSE_EDGE
+    return sum(math.floor(amount * row[i] * HE) for i, amount in bets if row[i])
+
+def rtp_report(bet: int = 1000) -> list[tuple[str, str, float]]:
+    """(key, kind, exact RTP) of every bet type, payouts floored at `bet` as in play."""
+    HE = 1 - settings.HOUSE_EDGE
+    return [(key, kind, sum(math.floor(bet * row[i] * HE) for row in MATRIX) / 37 / bet)
+            for i, (key, kind, _, _) in enumerate(BET_TYPES)]
+
 class RouletteRequest(BaseModel):
     bets: Dict[str, int]
 
 @router.post("/play")
 async def roulette_play(body: RouletteRequest, request: Request):
     uid = await get_current_user_id(request)
-    total_bet = sum(body.bets.values())
+    try:
+        bets = parse_bets(body.bets)
+    except ValueError as e:
+        raise HTTPException(400, {"error":"invalid_bet","message":f"Недопустимая ставка: {e}"})
+    total_bet = sum(amount for _, amount in bets)
     if total_bet < settings.MIN_BET:  raise HTTPException(400, {"error":"bet_too_low"})
     if total_bet > settings.MAX_BET:  raise HTTPException(400, {"error":"bet_too_high"})
 
-    number = secrets.randbelow(37)
-    if number == 0:      color = "green"
-    elif number in RED_NUMS: color = "red"
-    else:                color = "black"
-
-    HE = 1 - settings.HOUSE_EDGE
-    total_payout = 0
-    for key, amount in body.bets.items():
-        if key.startswith("num_"):
-            n = int(key.split("_")[1])
-            if n == number:
-                total_payout += math.floor(amount * 35 * HE)
-        elif key == "cat_red"   and color == "red":    total_payout += math.floor(amount * 2 * HE)
-        elif key == "cat_black" and color == "black":  total_payout += math.floor(amount * 2 * HE)
-        elif key == "cat_green" and color == "green":  total_payout += math.floor(amount * 14 * HE)
-        elif key == "cat_odd"   and number % 2 == 1 and number != 0: total_payout += math.floor(amount * 2 * HE)
-        elif key == "cat_even"  and number % 2 == 0 and number != 0: total_payout += math.floor(amount * 2 * HE)
-        elif key == "cat_half1" and 1 <= number <= 18: total_payout += math.floor(amount * 2 * HE)
-        elif key == "cat_half2" and 19 <= number <= 36: total_payout += math.floor(amount * 2 * HE)
+    number = rng.below(37)
+    color  = color_of(number)
+    total_payout = payout_for(bets, number)
 
     won  = total_payout > 0
     mult = round(total_payout / total_bet, 2) if won else 0.0
 
     pool = await get_pool()
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            await deduct_bet(conn, uid, total_bet, "roulette")
-            await credit_win(conn, uid, total_payout, "roulette")
-            await record_game(conn, uid, "roulette", total_bet, total_payout, mult,
-                              {"number": number, "color": color})
+        res = await settle_play(conn, uid, "roulette", total_bet, total_payout, mult,
+                                {"number": number, "color": color})
+    if not res.ok:
+        raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
 
-    return {"number": number, "color": color, "won": won, "payout": total_payout}
+    return {"number": number, "color": color, "won": won, "payout": total_payout, "balance": res.balance}
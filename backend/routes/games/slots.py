@@ -3,9 +3,11 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from database import get_pool
 from middleware.tg_auth import get_current_user_id
-from services.wallet_service import deduct_bet, credit_win, record_game
+from services.wallet_service import settle_play
+from services.autoplay import AutoplayParams, check_bet, run_autoplay
+from services import rng
 from config import settings
-import secrets, math
+import math
 from collections import Counter
 
 router = APIRouter()
@@ -15,24 +17,10 @@ WEIGHTS  = [2,   4,   5,   8,   8,   12,  14,  15]
 TOTAL_W  = sum(WEIGHTS)
 PAYOUTS_5 = {'🎯':500,'⭐':200,'💎':100,'🔫':50,'💣':25}
 
-def weighted_choice():
-    r = secrets.randbelow(TOTAL_W)
-    acc = 0
-    for sym, w in zip(SYMBOLS, WEIGHTS):
-        acc += w
-        if r < acc:
-            return sym
+REEL = rng.Alias(WEIGHTS)   # symbol index drawn with probability WEIGHTS[i] / TOTAL_W
 
-class SlotsRequest(BaseModel):
-    bet: int
-
-@router.post("/play")
-async def slots_play(body: SlotsRequest, request: Request):
-    uid = await get_current_user_id(request)
-    if body.bet < settings.MIN_BET: raise HTTPException(400, {"error":"bet_too_low"})
-    if body.bet > settings.MAX_BET: raise HTTPException(400, {"error":"bet_too_high"})
-
-    reels = [weighted_choice() for _ in range(5)]
+def score(reels: list) -> tuple[int, str]:
+    """(multiplier before house edge, combo) for five reels."""
     counts = Counter(reels)
     best_sym, max_match = counts.most_common(1)[0]
 
@@ -48,16 +36,48 @@ async def slots_play(body: SlotsRequest, request: Request):
     else:
         multiplier = 0
         combo = ""
+    return multiplier, combo
 
-    payout = math.floor(body.bet * multiplier * (1 - settings.HOUSE_EDGE)) if multiplier > 0 else 0
-    won    = payout > 0
+def payout_for(bet: int, multiplier: int) -> int:
+    return math.floor(bet * multiplier * (1 - settings.HOUSE_EDGE)) if multiplier > 0 else 0
+
+def spin(bet: int, draws: list[int] | None = None) -> tuple[list, int, str, int]:
+    """draws: five pre-drawn REEL indices, for batches."""
+    reels = [SYMBOLS[i] for i in draws or REEL.draw_many(5)]
+    multiplier, combo = score(reels)
+    payout = payout_for(bet, multiplier)
+    return reels, multiplier, combo, payout
+
+class SlotsRequest(BaseModel):
+    bet: int
+
+@router.post("/play")
+async def slots_play(body: SlotsRequest, request: Request):
+    uid = await get_current_user_id(request)
+    if body.bet < settings.MIN_BET: raise HTTPException(400, {"error":"bet_too_low"})
+    if body.bet > settings.MAX_BET: raise HTTPException(400, {"error":"bet_too_high"})
+
+    reels, multiplier, combo, payout = spin(body.bet)
+    won = payout > 0
 
     pool = await get_pool()
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            await deduct_bet(conn, uid, body.bet, "slots")
-            await credit_win(conn, uid, payout, "slots")
-            await record_game(conn, uid, "slots", body.bet, payout, float(multiplier),
-                              {"reels": reels, "combo": combo})
+        res = await settle_play(conn, uid, "slots", body.bet, payout, float(multiplier),
+                                {"reels": reels, "combo": combo})
+    if not res.ok:
+        raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
+
+    return {"reels": reels, "won": won, "payout": payout, "combo": combo, "balance": res.balance}
+
+@router.post("/autoplay")
+async def slots_autoplay(body: AutoplayParams, request: Request):
+    uid = await get_current_user_id(request)
+    check_bet(body.bet)
 
-    return {"reels": reels, "won": won, "payout": payout, "combo": combo}
+    outcomes = []
+    draws = REEL.draw_many(5 * body.rounds)
+    for j in range(0, len(draws), 5):
+        reels, multiplier, combo, payout = spin(body.bet, draws[j:j + 5])
+        outcomes.append((payout, float(multiplier), {"reels": reels, "combo": combo},
+                         {"reels": reels, "won": payout > 0, "payout": payout, "combo": combo}))
+    return await run_autoplay(uid, "slots", body, outcomes)
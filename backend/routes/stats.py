@@ -1,38 +1,42 @@
-from fastapi import APIRouter, Query
-from database import get_pool
-from redis_client import get_redis
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel
+from typing import Optional
+from services.live_stats import lobby_snapshot
+from services import leaderboard as lb, presence
+from middleware.tg_auth import get_current_user_id
 import json
 
 router = APIRouter()
 
 @router.get("/lobby")
 async def lobby_stats():
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        jackpot_row = await conn.fetchrow(
-            "SELECT COALESCE(SUM(bet_amount),0) AS total FROM bets WHERE created_at > NOW() - INTERVAL '1 hour'"
-        )
-        jackpot = int(jackpot_row["total"] * 0.02)
-        online_row = await conn.fetchrow("SELECT COUNT(*) AS cnt FROM users WHERE last_seen > NOW() - INTERVAL '15 minutes'")
-    return {"online": int(online_row["cnt"]), "jackpot": jackpot}
+    wagered, online = await lobby_snapshot()
+    return {"online": online, "jackpot": int(wagered * 0.02)}
 
 @router.get("/online")
 async def online_stats():
-    redis = await get_redis()
-    games = ["crash", "roulette", "slots", "coin", "mines", "dice"]
-    result = {}
-    for g in games:
-        cnt = await redis.scard(f"online:{g}")
-        result[g] = cnt
-    return result
+    return await presence.counts()
+
+class PresenceRequest(BaseModel):
+    game: Optional[str] = None   # None from the lobby: online, not in a game
+
+# Pages call this every 30s, so players watching or thinking count too
+@router.post("/presence")
+async def presence_heartbeat(body: PresenceRequest, request: Request):
+    uid = await get_current_user_id(request)
+    if body.game is not None and body.game not in presence.GAMES:
+        raise HTTPException(400, {"error": "unknown_game"})
+    presence.seen(uid, body.game)
+    return {"ok": True}
 
 @router.get("/leaderboard")
-async def leaderboard(type: str = Query("profit", regex="^(profit|wagered)$")):
-    field = "total_profit" if type == "profit" else "total_wagered"
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            f"SELECT first_name AS name, {field} AS value, games_played AS games "
-            f"FROM users ORDER BY {field} DESC LIMIT 10"
-        )
-    return {"players": [dict(r) for r in rows]}
+async def leaderboard(type: str = Query("profit", pattern="^(profit|wagered)$"),
+                      window: str = Query("all", pattern="^(all|day|week)$")):
+    return {"players": await lb.top(type, window)}
+
+@router.get("/leaderboard/me")
+async def leaderboard_me(request: Request,
+                         type: str = Query("profit", pattern="^(profit|wagered)$"),
+                         window: str = Query("all", pattern="^(all|day|week)$")):
+    uid = await get_current_user_id(request)
+    return await lb.rank(uid, type, window)
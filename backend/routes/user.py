@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from database import get_pool
+from typing import Optional
+from database import get_pool, get_read_pool
 from middleware.tg_auth import get_current_user_id
+from services import balance_cache, history, user_stats
 from config import settings
 
 router = APIRouter()
@@ -9,44 +12,55 @@ router = APIRouter()
 @router.get("/balance")
 async def get_balance(request: Request):
     uid = await get_current_user_id(request)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT gold FROM users WHERE id=$1", uid)
-        if not row:
-            raise HTTPException(404, {"error": "user_not_found"})
-    return {"gold": row["gold"]}
+    gold = await balance_cache.get_balance(uid)
+    if gold is None:
+        raise HTTPException(404, {"error": "user_not_found"})
+    return {"gold": gold}
 
 @router.get("/profile")
 async def get_profile(request: Request):
     uid = await get_current_user_id(request)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT first_name, xp, games_played, games_won, total_profit FROM users WHERE id=$1", uid
-        )
-        if not row:
-            raise HTTPException(404, {"error": "user_not_found"})
-    level = min(6, row["xp"] // 100)
+    pool = await get_read_pool()
+    row = await pool.fetchrow("SELECT first_name FROM users WHERE id=$1", uid)
+    if not row:
+        raise HTTPException(404, {"error": "user_not_found"})
+    stats = await user_stats.get_stats(uid) or dict.fromkeys(user_stats.FIELDS, 0)
+    level = min(6, stats["xp"] // 100)
     return {
         "name":   row["first_name"],
-        "xp":     row["xp"],
+        "xp":     stats["xp"],
         "level":  level,
-        "games":  row["games_played"],
-        "wins":   row["games_won"],
-        "profit": row["total_profit"]
+        "games":  stats["played"],
+        "wins":   stats["won"],
+        "profit": stats["profit"]
     }
 
 @router.get("/transactions")
-async def get_transactions(request: Request, limit: int = Query(10, le=50)):
+async def get_transactions(request: Request, limit: int = Query(10, ge=1, le=100),
+                           cursor: Optional[str] = None,
+                           game: Optional[str] = Query(None, pattern=f"^({'|'.join(history.GAMES)})$"),
+                           type: Optional[str] = Query(None, pattern=f"^({'|'.join(history.TX_TYPES)})$")):
     uid = await get_current_user_id(request)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT type, amount, description, game, created_at FROM transactions "
-            "WHERE user_id=$1 ORDER BY created_at DESC LIMIT $2",
-            uid, limit
-        )
-    return {"transactions": [dict(r) for r in rows]}
+    try:
+        rows, next_cursor = await history.transactions_page(uid, limit, cursor, game, type)
+    except ValueError:
+        raise HTTPException(400, {"error": "invalid_cursor"})
+    return {"transactions": rows, "next_cursor": next_cursor}
+
+@router.get("/history/export")
+async def export_history(request: Request,
+                         kind: str = Query("transactions", pattern="^(transactions|bets)$"),
+                         format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    uid = await get_current_user_id(request)
+    try:
+        chunks = history.export_rows(uid, kind, format)
+    except RuntimeError:
+        raise HTTPException(429, {"error": "export_busy", "message": "Слишком много выгрузок, попробуйте позже"})
+    media = "text/csv" if format == "csv" else "application/x-ndjson"
+    ext   = "csv" if format == "csv" else "ndjson"
+    return StreamingResponse(chunks, media_type=media, headers={
+        "Content-Disposition": f'attachment; filename="{kind}-{uid}.{ext}"'
+    })
 
 class WithdrawRequest(BaseModel):
     nick: str
@@ -67,7 +81,10 @@ async def withdraw(body: WithdrawRequest, request: Request):
             row = await conn.fetchrow("SELECT gold FROM users WHERE id=$1 FOR UPDATE", uid)
             if not row or row["gold"] < body.amount:
                 raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
-            await conn.execute("UPDATE users SET gold = gold - $1 WHERE id=$2", body.amount, uid)
+            balance = await conn.fetchrow(
+                "UPDATE users SET gold = gold - $1, gold_ver = gold_ver + 1 WHERE id=$2 RETURNING gold, gold_ver",
+                body.amount, uid
+            )
             wid = await conn.fetchval(
                 "INSERT INTO withdrawals(user_id, amount, fee, net_amount, so2_nick) VALUES($1,$2,$3,$4,$5) RETURNING id",
                 uid, body.amount, fee, net_amount, body.nick
@@ -76,4 +93,5 @@ async def withdraw(body: WithdrawRequest, request: Request):
                 "INSERT INTO transactions(user_id,type,amount,description) VALUES($1,'withdraw',$2,$3)",
                 uid, -body.amount, f"Вывод → {body.nick}"
             )
-    return {"ok": True, "withdrawal_id": wid}
+    await balance_cache.publish([(uid, balance["gold"], balance["gold_ver"])])
+    return {"ok": True, "withdrawal_id": wid, "balance": balance["gold"]}
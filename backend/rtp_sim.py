@@ -0,0 +1,268 @@
+
+"""
+Return-to-player check for every game, using the rules imported from the
+route modules:
+
+    python rtp_sim.py                       # report, 10M rounds per variant
+    python rtp_sim.py --games dice crash    # only some games
+    python rtp_sim.py --rounds 1000000 --check
+
+Each variant (a game with a fixed bet choice) gets an exact RTP where the
+outcome space can be enumerated, and a vectorized Monte Carlo run reporting
+RTP, variance of the return per unit bet, hit rate and percentiles of the
+payout multiple, i.e. how much the house can owe on one round.
+
+--check exits non-zero when a simulation disagrees with its exact RTP by
+more than 5 standard errors (from the exact variance) or any variant pays
+back more than it takes; --strict also fails variants more than --tolerance away from 1 - HOUSE_EDGE.
+Variants in KNOWN_ISSUES are reported but do not fail the check.
+Needs numpy (requirements-dev.txt); the server itself does not.
+"""
+import argparse, itertools, math, os, sys, time
+
+# Settings requires a DATABASE_URL; nothing here connects to it.
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("rtp_sim needs numpy: pip install -r requirements-dev.txt")
+
+from config import settings
+from routes.games import coin, dice, mines, roulette, slots
+from services.crash_worker import crash_point, crash_payout
+
+BET   = 1000           # reference bet; payouts are floored per round as in the routes
+CHUNK = 1_000_000      # rounds per vectorized batch
+
+MINES_PLAYS   = [(1, 1), (1, 12), (1, 24), (3, 1), (3, 5), (3, 22), (5, 3), (10, 3), (10, 15), (24, 1)]
+CRASH_TARGETS = [1.01, 1.5, 2.0, 5.0, 10.0, 100.0, 1000.0]
+
+# Known to be off until their rules change: reported, not failed, by --check
+KNOWN_ISSUES = {
+    ("slots", "spin"): "the paytable pays back more than it takes",
+    ("roulette", "cat_green"): "pays x14 on zero where num_0 pays x36",
+    **{("crash", f"cashout x{t:g}"): "the house edge is taken twice, in the crash point and in the payout"
+       for t in CRASH_TARGETS},
+}
+
+class Variant:
+    """One bet choice: a payout table over equally weighted or weighted outcomes,
+    or a single win probability with a fixed payout."""
+
+    def __init__(self, game: str, label: str, payouts, probs=None, p_win: float = None):
+        self.game, self.label = game, label
+        self.payouts = np.asarray(payouts, dtype=np.int64)
+        self.probs   = None if probs is None else np.asarray(probs, dtype=np.float64)
+        self.p_win   = p_win
+
+    def _distribution(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.p_win is not None:
+            return np.array([self.p_win, 1 - self.p_win]), np.array([self.payouts[0], 0]) / BET
+        probs = self.probs if self.probs is not None else np.full(len(self.payouts), 1 / len(self.payouts))
+        return probs, self.payouts / BET
+
+    def exact_rtp(self) -> float:
+        probs, r = self._distribution()
+        return float(probs @ r)
+
+    def exact_var(self) -> float:
+        probs, r = self._distribution()
+        return float(probs @ r**2) - self.exact_rtp() ** 2
+
+    def sample(self, rng, n: int) -> np.ndarray:
+        if self.p_win is not None:
+            return np.where(rng.random(n) < self.p_win, self.payouts[0], 0)
+        if self.probs is None:
+            return self.payouts[rng.integers(0, len(self.payouts), n)]
+        return self.payouts[rng.choice(len(self.payouts), n, p=self.probs)]
+
+# ── Games ────────────────────────────────────────────────
+
+def coin_variants():
+    yield Variant("coin", "heads", [coin.payout_for(BET, "heads", r) for r in ("heads", "tails")])
+
+def dice_variants():
+    for chosen in dice.MULTIPLIERS:
+        yield Variant("dice", f"sum={chosen}",
+                      [dice.payout_for(BET, chosen, a + b) for a in range(1, 7) for b in range(1, 7)])
+
+def roulette_variants():
+    # One bet of each kind; the exact RTP of every bet type is checked in run()
+    seen = set()
+    for i, (key, kind, _, _) in enumerate(roulette.BET_TYPES):
+        if kind not in seen:
+            seen.add(kind)
+            yield Variant("roulette", key, [roulette.payout_for([(i, BET)], n) for n in range(37)])
+
+class SlotsVariant(Variant):
+    """Draws the five reels independently, like spin(), and looks the
+    combination up in a table of all 8^5 outcomes."""
+
+    def __init__(self):
+        n = len(slots.SYMBOLS)
+        table, probs = [], []
+        weights = [w / slots.TOTAL_W for w in slots.WEIGHTS]
+        for combo in itertools.product(range(n), repeat=5):
+            multiplier, _ = slots.score([slots.SYMBOLS[i] for i in combo])
+            table.append(slots.payout_for(BET, multiplier))
+            probs.append(math.prod(weights[i] for i in combo))
+        super().__init__("slots", "spin", table, probs)
+        self.weights = np.asarray(weights)
+        self.place   = n ** np.arange(4, -1, -1)
+
+    def sample(self, rng, n: int) -> np.ndarray:
+        reels = rng.choice(len(self.weights), (n, 5), p=self.weights)
+        return self.payouts[reels @ self.place]
+
+def slots_variants():
+    yield SlotsVariant()
+
+class MinesVariant(Variant):
+    """Reveals `found` cells and cashes out. Cells are drawn one at a time
+    without replacement, so every pick has the conditional safe chance."""
+
+    def __init__(self, mine_count: int, found: int):
+        safe = 25 - mine_count
+        p = math.prod((safe - i) / (25 - i) for i in range(found))
+        payout = math.floor(BET * mines.multiplier_for(mine_count, found))
+        super().__init__("mines", f"{mine_count} mines, {found} cells", [payout], p_win=p)
+        self.steps = [(safe - i) / (25 - i) for i in range(found)]
+
+    def sample(self, rng, n: int) -> np.ndarray:
+        alive = np.ones(n, dtype=bool)
+        for p in self.steps:
+            alive &= rng.random(n) < p
+        return np.where(alive, self.payouts[0], 0)
+
+class CrashVariant(Variant):
+    """Auto-cashout at `target`: wins when the round's crash point reaches it.
+    crash_point() falls as its 32-bit input grows, so the win set is every
+    value up to a threshold, found by bisection on the real function."""
+
+    def __init__(self, target: float):
+        lo, hi = -1, 2**32 - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if crash_point(mid) >= target: lo = mid
+            else:                          hi = mid - 1
+        self.last_win = lo
+        super().__init__("crash", f"cashout x{target:g}", [crash_payout(BET, target)],
+                         p_win=(lo + 1) / 2**32)
+
+    def sample(self, rng, n: int) -> np.ndarray:
+        val = rng.integers(0, 2**32, n, dtype=np.uint64)
+        return np.where(val <= self.last_win, self.payouts[0], 0)
+
+def mines_variants():
+    for mine_count, found in MINES_PLAYS:
+        yield MinesVariant(mine_count, found)
+
+def crash_variants():
+    for target in CRASH_TARGETS:
+        yield CrashVariant(target)
+
+GAMES = {
+    "coin":     coin_variants,
+    "dice":     dice_variants,
+    "roulette": roulette_variants,
+    "slots":    slots_variants,
+    "mines":    mines_variants,
+    "crash":    crash_variants,
+}
+
+# ── Simulation ───────────────────────────────────────────
+
+PERCENTILES = (99, 99.9, 99.99)
+
+def simulate(variant: Variant, rng, rounds: int) -> dict:
+    total = total_sq = hits = 0
+    counts: dict[int, int] = {}
+    done = 0
+    while done < rounds:
+        n = min(CHUNK, rounds - done)
+        x = variant.sample(rng, n)
+        total    += int(x.sum())
+        total_sq += float(np.square(x, dtype=np.float64).sum())
+        hits     += int(np.count_nonzero(x))
+        # Payouts take few distinct values, so percentiles come from counts
+        values, c = np.unique(x, return_counts=True)
+        for v, k in zip(values.tolist(), c.tolist()):
+            counts[v] = counts.get(v, 0) + k
+        done += n
+
+    mean = total / rounds / BET
+    var  = max(0.0, total_sq / rounds / BET**2 - mean**2)
+    cum, exposure, levels = 0, {}, sorted(counts)
+    want = list(PERCENTILES)
+    for v in levels:
+        cum += counts[v]
+        while want and cum >= rounds * want[0] / 100:
+            exposure[want.pop(0)] = v / BET
+    return {"rtp": mean, "var": var, "hit": hits / rounds,
+            "exposure": exposure, "max": levels[-1] / BET}
+
+def run(games: list[str], rounds: int, seed: int | None, tolerance: float, strict: bool) -> int:
+    rng    = np.random.default_rng(seed)
+    target = 1 - settings.HOUSE_EDGE
+    failures = []
+    print(f"HOUSE_EDGE={settings.HOUSE_EDGE}  target RTP={target:.4f}  rounds/variant={rounds:,}  bet={BET}")
+    print(f"{'game':9} {'variant':20} {'exact':>8} {'sim':>8} {'±5se':>7} {'var':>10} {'hit':>7} "
+          + " ".join(f"{'p' + format(p, 'g'):>8}" for p in PERCENTILES) + f" {'max':>8}")
+    for game in games:
+        for v in GAMES[game]():
+            t0 = time.perf_counter()
+            exact = v.exact_rtp()
+            bound = 5 * math.sqrt(v.exact_var() / rounds)
+            s = simulate(v, rng, rounds)
+            off  = abs(exact - target) > tolerance
+            flag = "!" if off or exact > 1 else " "
+            print(f"{game:9} {v.label:20} {exact:8.4f} {s['rtp']:8.4f} {bound:7.4f} {s['var']:10.3f} "
+                  f"{s['hit']:7.4f} " + " ".join(f"{s['exposure'][p]:8.2f}" for p in PERCENTILES)
+                  + f" {s['max']:8.2f} {flag} {time.perf_counter() - t0:5.1f}s")
+            if abs(s["rtp"] - exact) > bound + 1e-9:
+                failures.append(f"{game} {v.label}: simulated {s['rtp']:.4f}, exact {exact:.4f}")
+            if (game, v.label) in KNOWN_ISSUES:
+                print(f"KNOWN {game} {v.label}: RTP {exact:.4f}, {KNOWN_ISSUES[game, v.label]}")
+            elif exact > 1:
+                failures.append(f"{game} {v.label}: RTP {exact:.4f} above 1")
+            elif strict and off:
+                failures.append(f"{game} {v.label}: RTP {exact:.4f}, target {target:.4f} ± {tolerance}")
+
+    if "mines" in games:
+        # Every (mine_count, found) pair of the multiplier table, not only the simulated ones
+        worst = max(((MinesVariant(m, f).exact_rtp(), m, f)
+                     for m in range(1, 25) for f in range(1, 26 - m)))
+        print(f"mines: highest exact RTP over the whole multiplier table {worst[0]:.4f} "
+              f"({worst[1]} mines, {worst[2]} cells)")
+        if worst[0] > 1:
+            failures.append(f"mines {worst[1]} mines, {worst[2]} cells: RTP {worst[0]:.4f} above 1")
+
+    if "roulette" in games:
+        report = roulette.rtp_report(BET)
+        for kind in dict.fromkeys(k for _, k, _ in report):
+            rtps = [rtp for _, k, rtp in report if k == kind]
+            print(f"roulette: {kind:9} {len(rtps):3} bet types, exact RTP {min(rtps):.4f}..{max(rtps):.4f}")
+        for key, _, rtp in report:
+            if rtp > 1:
+                failures.append(f"roulette {key}: RTP {rtp:.4f} above 1")
+
+    for f in failures:
+        print("FAIL", f)
+    return 1 if failures else 0
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    ap.add_argument("--games", nargs="+", choices=list(GAMES), default=list(GAMES))
+    ap.add_argument("--rounds", type=lambda s: int(float(s)), default=10_000_000)
+    ap.add_argument("--seed", type=int)
+    ap.add_argument("--tolerance", type=float, default=0.01)
+    ap.add_argument("--check", action="store_true", help="exit 1 on any failure")
+    ap.add_argument("--strict", action="store_true", help="also fail RTPs off target by more than --tolerance")
+    args = ap.parse_args()
+    status = run(args.games, args.rounds, args.seed, args.tolerance, args.strict)
+    if args.check or args.strict:
+        sys.exit(status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from database import get_pool
+from services.wallet_service import settle_batch
+from config import settings
+from typing import Optional
+
+MAX_ROUNDS = 100
+
+class AutoplayParams(BaseModel):
+    bet: int
+    rounds: int = Field(ge=1, le=MAX_ROUNDS)
+    stop_on_profit: Optional[int] = Field(None, gt=0)
+    stop_on_loss:   Optional[int] = Field(None, gt=0)
+
+def check_bet(bet: int):
+    if bet < settings.MIN_BET: raise HTTPException(400, {"error":"bet_too_low"})
+    if bet > settings.MAX_BET: raise HTTPException(400, {"error":"bet_too_high"})
+
+async def run_autoplay(uid: int, game: str, params: AutoplayParams, outcomes: list[tuple[int, float, dict, dict]]) -> dict:
+    """outcomes: one (payout, multiplier, meta, result) per round, already drawn.
+
+    All rounds are settled in one transaction; the response lists the rounds
+    that were actually played before a stop rule or the balance ended the run.
+    """
+    plays = [(params.bet, payout, mult, meta) for payout, mult, meta, _ in outcomes]
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        res, played = await settle_batch(conn, uid, game, plays, params.stop_on_profit, params.stop_on_loss)
+    if not res.ok:
+        raise HTTPException(400, {"error": "insufficient_funds", "message": "Недостаточно Gold"})
+
+    total_payout = sum(o[0] for o in outcomes[:played])
+    return {
+        "rounds":       [o[3] for o in outcomes[:played]],
+        "played":       played,
+        "total_bet":    params.bet * played,
+        "total_payout": total_payout,
+        "net":          total_payout - params.bet * played,
+        "balance":      res.balance,
+    }
@@ -0,0 +1,66 @@
+
+import logging
+from redis_client import get_redis
+from database import get_pool
+
+log = logging.getLogger("balance_cache")
+
+# Write-through cache of users.gold:
+#   bal:{uid}   hash gold, ver
+# Every statement that changes gold also bumps users.gold_ver and returns
+# both; the pair is written here after the transaction commits. A write only
+# lands if its version is newer than the cached one, so a slow writer or a
+# reader filling a miss can never replace a newer balance with an older one.
+BALANCE_TTL = 600     # seconds; bounds staleness if a write here was lost
+
+Balance = tuple[int, int, int]    # (user_id, gold, gold_ver)
+
+def balance_key(uid: int) -> str: return f"bal:{uid}"
+
+_SET = """
+local v = tonumber(redis.call('HGET', KEYS[1], 'ver'))
+if v and v >= tonumber(ARGV[2]) then return 0 end
+redis.call('HSET', KEYS[1], 'gold', ARGV[1], 'ver', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+_script = None
+
+async def publish(balances: list[Balance | None]):
+    """Writes committed balances; never raises, the play itself already went through."""
+    global _script
+    balances = [b for b in balances if b]
+    if not balances:
+        return
+    try:
+        redis = await get_redis()
+        if _script is None:
+            _script = redis.register_script(_SET)
+        if len(balances) == 1:
+            uid, gold, ver = balances[0]
+            await _script(keys=[balance_key(uid)], args=[gold, ver, BALANCE_TTL])
+            return
+        async with redis.pipeline(transaction=False) as p:
+            for uid, gold, ver in balances:
+                await _script(keys=[balance_key(uid)], args=[gold, ver, BALANCE_TTL], client=p)
+            await p.execute()
+    except Exception as e:
+        log.warning("write failed, dropping entries: %s", e)
+        try:
+            await (await get_redis()).delete(*[balance_key(b[0]) for b in balances])
+        except Exception:
+            pass
+
+async def get_balance(uid: int) -> int | None:
+    """Cached gold, loaded from the primary on a miss; None if the user does not exist."""
+    redis = await get_redis()
+    gold = await redis.hget(balance_key(uid), "gold")
+    if gold is not None:
+        return int(gold)
+    pool = await get_pool()
+    row = await pool.fetchrow("SELECT gold, gold_ver FROM users WHERE id=$1", uid)
+    if not row:
+        return None
+    await publish([(uid, row["gold"], row["gold_ver"])])
+    return row["gold"]
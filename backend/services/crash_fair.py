@@ -0,0 +1,146 @@
+
+import asyncio, hashlib, hmac, json, logging, os
+from redis_client import get_redis
+from database import get_pool, get_read_pool
+from config import settings
+
+log = logging.getLogger("crash_fair")
+
+# Provably fair crash points. A chain of SHA-256 hashes is generated ahead
+# of time from a random end value:
+#   h[length] = random,  h[i-1] = sha256(h[i]),  h[0] = terminal hash (published)
+# Rounds use h[1], h[2], ... in order, and a round's seed is revealed once it
+# has crashed. Anyone can check that sha256(seed) is the previous round's
+# seed, that hashing it i times gives the terminal hash, and that the crash
+# point follows from it. Nobody can work out the next seed from the revealed
+# ones.
+#
+# Only every SEGMENT-th hash is stored (crash_chains.checkpoints, 32 bytes
+# each). The worker reserves a whole segment with one UPDATE and rebuilds its
+# hashes from the checkpoint. A reserved segment is never handed out again,
+# even if the worker dies half way through it, so no seed is ever used twice.
+SEGMENT = 1000
+
+# Last HISTORY_SIZE finished rounds, newest first, as JSON:
+#   crash:history   list {"round_id","crash_point","bets","wagered","chain_id","index","seed"}
+HISTORY_KEY  = "crash:history"
+HISTORY_SIZE = 100
+
+def crash_value(seed: str) -> int:
+    """The uniform 32-bit value behind a seed's crash point."""
+    digest = hmac.new(bytes.fromhex(seed), settings.CRASH_SALT.encode(), hashlib.sha256).hexdigest()
+    return int(digest[:8], 16)
+
+def previous_seed(seed: str) -> str:
+    return hashlib.sha256(bytes.fromhex(seed)).hexdigest()
+
+def build_chain(length: int) -> tuple[str, bytes]:
+    """(terminal hash, checkpoints): h[SEGMENT], h[2*SEGMENT], ..., h[length]."""
+    h = os.urandom(32)
+    checkpoints = [b""] * (length // SEGMENT)
+    for i in range(length, 0, -1):
+        if i % SEGMENT == 0:
+            checkpoints[i // SEGMENT - 1] = h
+        h = hashlib.sha256(h).digest()
+    return h.hex(), b"".join(checkpoints)
+
+def segment_seeds(checkpoint: bytes) -> list[str]:
+    """The SEGMENT seeds ending at a checkpoint, in the order rounds use them."""
+    out = [checkpoint]
+    for _ in range(SEGMENT - 1):
+        out.append(hashlib.sha256(out[-1]).digest())
+    return [h.hex() for h in reversed(out)]
+
+# ── Seeds ────────────────────────────────────────────────
+
+_RESERVE = """
+UPDATE crash_chains SET next_index = next_index + $1
+WHERE id = (SELECT id FROM crash_chains WHERE next_index + $1 - 1 <= length ORDER BY id LIMIT 1 FOR UPDATE)
+RETURNING id, next_index - $1 AS start,
+          substring(checkpoints FROM ((next_index - 1) / $1 - 1) * 32 + 1 FOR 32) AS checkpoint
+"""
+
+_segment: dict = {"chain_id": None, "start": 0, "seeds": []}
+
+async def _reserve_segment():
+    pool = await get_pool()
+    row = await pool.fetchrow(_RESERVE, SEGMENT)
+    if row is None:
+        length = settings.CRASH_CHAIN_LENGTH // SEGMENT * SEGMENT
+        terminal, checkpoints = await asyncio.to_thread(build_chain, length)
+        await pool.execute(
+            "INSERT INTO crash_chains(length, terminal_hash, checkpoints) VALUES($1,$2,$3)",
+            length, terminal, checkpoints
+        )
+        log.info("new seed chain of %d rounds, terminal hash %s", length, terminal)
+        row = await pool.fetchrow(_RESERVE, SEGMENT)
+    seeds = await asyncio.to_thread(segment_seeds, bytes(row["checkpoint"]))
+    _segment.update(chain_id=row["id"], start=row["start"], seeds=seeds)
+
+async def next_seed() -> tuple[int, int, str]:
+    """(chain_id, index, seed) for the next round."""
+    if not _segment["seeds"]:
+        await _reserve_segment()
+    index = _segment["start"] + SEGMENT - len(_segment["seeds"])
+    return _segment["chain_id"], index, _segment["seeds"].pop(0)
+
+# ── History ──────────────────────────────────────────────
+
+async def record_round(round_id: str, chain_id: int, index: int, seed: str,
+                       crash_point: float, bets: int, wagered: int):
+    """Reveals a finished round: into the history buffer and crash_rounds."""
+    entry = {"round_id": round_id, "crash_point": crash_point, "bets": bets,
+             "wagered": wagered, "chain_id": chain_id, "index": index, "seed": seed}
+    redis = await get_redis()
+    async with redis.pipeline(transaction=True) as p:
+        p.lpush(HISTORY_KEY, json.dumps(entry))
+        p.ltrim(HISTORY_KEY, 0, HISTORY_SIZE - 1)
+        await p.execute()
+    pool = await get_pool()
+    await pool.execute(
+        "INSERT INTO crash_rounds(round_id, chain_id, idx, seed, crash_point, bets, wagered) "
+        "VALUES($1,$2,$3,$4,$5,$6,$7)",
+        round_id, chain_id, index, seed, crash_point, bets, wagered
+    )
+
+async def history(n: int = HISTORY_SIZE) -> list[dict]:
+    redis = await get_redis()
+    return [json.loads(e) for e in await redis.lrange(HISTORY_KEY, 0, n - 1)]
+
+async def find_round(round_id: str) -> dict | None:
+    """A revealed round, from the buffer or else crash_rounds, with its chain's terminal hash."""
+    for entry in await history():
+        if entry["round_id"] == round_id:
+            break
+    else:
+        entry = None
+    pool = await get_read_pool()
+    if entry is None:
+        row = await pool.fetchrow(
+            "SELECT round_id, chain_id, idx AS index, seed, crash_point, bets, wagered "
+            "FROM crash_rounds WHERE round_id=$1", round_id
+        )
+        if not row:
+            return None
+        entry = dict(row)
+        entry["crash_point"] = float(entry["crash_point"])
+    entry["terminal_hash"] = await pool.fetchval(
+        "SELECT terminal_hash FROM crash_chains WHERE id=$1", entry["chain_id"]
+    )
+    return entry
+
+async def chain_check(chain_id: int, index: int, seed: str) -> bool:
+    """Whether a seed sits at `index` of the stored chain: hashed down to the
+    checkpoint (or terminal hash) below it, it has to land on that value."""
+    pool = await get_read_pool()
+    row = await pool.fetchrow(
+        "SELECT terminal_hash, length, substring(checkpoints FROM ($2::int / $3::int - 1) * 32 + 1 FOR 32) AS cp "
+        "FROM crash_chains WHERE id=$1", chain_id, index, SEGMENT
+    )
+    if not row or not 1 <= index <= row["length"]:
+        return False
+    below = index // SEGMENT * SEGMENT
+    h = bytes.fromhex(seed)
+    for _ in range(index - below):
+        h = hashlib.sha256(h).digest()
+    return h == (bytes(row["cp"]) if below else bytes.fromhex(row["terminal_hash"]))
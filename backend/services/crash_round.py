@@ -0,0 +1,198 @@
+
+import json
+from redis.exceptions import ResponseError
+from redis_client import get_redis
+from services.leader import FENCE_CHECK, LeaseLost, fence_key
+
+# Round state lives in small Redis structures that are only ever changed by
+# the scripts below, so bets, cashouts and worker ticks never overwrite each
+# other:
+#   crash:round               hash  round_id, phase, multiplier, crash_at, countdown, seq,
+#                                   started_at, chain_id, index, seed, settled
+#   crash:bets:{round}        hash  user_id -> {"i","name","bet","auto_cashout"}   (immutable)
+#   crash:cashouts:{round}    hash  user_id -> cashout multiplier                  (HSETNX)
+#   crash:auto:{round}        zset  user_id scored by auto-cashout target, pending only
+# The scripts the engine runs are fenced by its lease (services/leader.py):
+# once another process has taken over, a stale engine's writes fail with
+# LeaseLost instead of landing. The round hash carries everything a new
+# leader needs to carry on with a round its predecessor left half way.
+ROUND_KEY = "crash:round"
+ROUND_TTL = 3600
+LEASE     = "crash"
+FENCE_KEY = fence_key(LEASE)
+
+def bets_key(round_id: str) -> str:     return f"crash:bets:{round_id}"
+def cashouts_key(round_id: str) -> str: return f"crash:cashouts:{round_id}"
+def auto_key(round_id: str) -> str:     return f"crash:auto:{round_id}"
+
+def _keys(round_id: str) -> list:
+    return [ROUND_KEY, bets_key(round_id), cashouts_key(round_id), auto_key(round_id)]
+
+_NEW_ROUND = FENCE_CHECK + """
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'round_id', ARGV[1], 'phase', 'waiting', 'multiplier', '1.0',
+           'crash_at', ARGV[2], 'countdown', ARGV[3], 'seq', 0,
+           'chain_id', ARGV[4], 'index', ARGV[5], 'seed', ARGV[6])
+return 1
+"""
+
+_SET_FIELDS = FENCE_CHECK + """
+redis.call('HSET', KEYS[1], unpack(ARGV, 1, #ARGV - 1))
+return 1
+"""
+
+# 1 for the first caller only, so a round is settled once across failovers
+_CLAIM_SETTLEMENT = FENCE_CHECK + """
+if redis.call('HGET', KEYS[1], 'round_id') ~= ARGV[1] then return 0 end
+return redis.call('HSETNX', KEYS[1], 'settled', 1)
+"""
+
+# -1 wrong phase / round, -2 already has a bet in this round, else bet index
+_PLACE_BET = """
+local r = redis.call('HMGET', KEYS[1], 'round_id', 'phase')
+if r[1] ~= ARGV[1] or r[2] ~= 'waiting' then return -1 end
+if redis.call('HEXISTS', KEYS[2], ARGV[2]) == 1 then return -2 end
+local i = redis.call('HINCRBY', KEYS[1], 'seq', 1) - 1
+local ac = 'null'
+if ARGV[5] ~= '' then
+    ac = cjson.encode(tonumber(ARGV[5]))
+    redis.call('ZADD', KEYS[4], ARGV[5], ARGV[2])
+    redis.call('EXPIRE', KEYS[4], ARGV[6])
+end
+redis.call('HSET', KEYS[2], ARGV[2],
+    '{"i":' .. i .. ',"name":' .. cjson.encode(ARGV[3]) .. ',"bet":' .. ARGV[4] .. ',"auto_cashout":' .. ac .. '}')
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return i
+"""
+
+_CANCEL_BET = """
+local r = redis.call('HMGET', KEYS[1], 'round_id', 'phase')
+if r[1] ~= ARGV[1] or r[2] ~= 'waiting' then return 0 end
+redis.call('ZREM', KEYS[4], ARGV[2])
+return redis.call('HDEL', KEYS[2], ARGV[2])
+"""
+
+# -1 wrong phase / round, -2 no open bet, else {multiplier, bet json}
+_CASHOUT = """
+local r = redis.call('HMGET', KEYS[1], 'round_id', 'phase', 'multiplier')
+if r[1] ~= ARGV[1] or r[2] ~= 'running' then return -1 end
+local b = redis.call('HGET', KEYS[2], ARGV[2])
+if not b then return -2 end
+if redis.call('HSETNX', KEYS[3], ARGV[2], r[3]) == 0 then return -2 end
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+redis.call('ZREM', KEYS[4], ARGV[2])
+return {r[3], b}
+"""
+
+# Sets the multiplier and fires only the auto-cashouts whose target was
+# crossed since the previous tick; returns {user_id, target, bet json, ...}
+_TICK = FENCE_CHECK + """
+local r = redis.call('HMGET', KEYS[1], 'round_id', 'phase')
+if r[1] ~= ARGV[1] or r[2] ~= 'running' then return {} end
+redis.call('HSET', KEYS[1], 'multiplier', ARGV[2])
+local due = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[2], 'WITHSCORES')
+local out = {}
+for j = 1, #due, 2 do
+    local uid, ac = due[j], due[j + 1]
+    if redis.call('HSETNX', KEYS[3], uid, ac) == 1 then
+        out[#out + 1] = uid
+        out[#out + 1] = ac
+        out[#out + 1] = redis.call('HGET', KEYS[2], uid)
+    end
+end
+if #due > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', ARGV[2])
+    redis.call('EXPIRE', KEYS[3], ARGV[4])
+end
+if ARGV[3] == '1' then redis.call('HSET', KEYS[1], 'phase', 'crashed') end
+return out
+"""
+
+_scripts = {}
+
+async def _script(name: str, lua: str):
+    if name not in _scripts:
+        redis = await get_redis()
+        _scripts[name] = redis.register_script(lua)
+    return _scripts[name]
+
+async def _fenced(name: str, lua: str, fence: int, keys: list, args: list):
+    s = await _script(name, lua)
+    try:
+        return await s(keys=keys + [FENCE_KEY], args=args + [fence])
+    except ResponseError as e:
+        if "FENCED" in str(e):
+            raise LeaseLost(LEASE) from e
+        raise
+
+# ── Engine (fenced) ──────────────────────────────────────
+
+async def new_round(fence: int, round_id: str, crash_at: float, countdown: float,
+                    chain_id: int, index: int, seed: str):
+    await _fenced("new_round", _NEW_ROUND, fence, [ROUND_KEY],
+                  [round_id, crash_at, countdown, chain_id, index, seed])
+
+async def set_fields(fence: int, **fields):
+    args = []
+    for k, v in fields.items():
+        args += [k, "" if v is None else v]
+    await _fenced("set_fields", _SET_FIELDS, fence, [ROUND_KEY], args)
+
+async def claim_settlement(fence: int, round_id: str) -> bool:
+    return bool(await _fenced("claim_settlement", _CLAIM_SETTLEMENT, fence, [ROUND_KEY], [round_id]))
+
+async def tick(fence: int, round_id: str, multiplier: float, crashed: bool = False) -> list[dict]:
+    res = await _fenced("tick", _TICK, fence, _keys(round_id),
+                        [round_id, multiplier, "1" if crashed else "0", ROUND_TTL])
+    fired = []
+    for j in range(0, len(res), 3):
+        bet = json.loads(res[j + 2])
+        bet.update(user_id=int(res[j]), cashout=float(res[j + 1]))
+        fired.append(bet)
+    return fired
+
+# ── Players ──────────────────────────────────────────────
+
+async def load_round() -> dict:
+    """The whole round hash; empty before the first round."""
+    redis = await get_redis()
+    return await redis.hgetall(ROUND_KEY)
+
+async def current_round() -> tuple[str | None, str | None]:
+    """(round_id, phase) of the live round."""
+    redis = await get_redis()
+    round_id, phase = await redis.hmget(ROUND_KEY, "round_id", "phase")
+    return round_id, phase
+
+async def place_bet(round_id: str, user_id: int, name: str, bet: int, auto_cashout: float | None) -> int:
+    s = await _script("place_bet", _PLACE_BET)
+    return int(await s(keys=_keys(round_id),
+                       args=[round_id, user_id, name, bet, "" if auto_cashout is None else auto_cashout, ROUND_TTL]))
+
+async def cancel_bet(round_id: str, user_id: int) -> bool:
+    s = await _script("cancel_bet", _CANCEL_BET)
+    return bool(await s(keys=_keys(round_id), args=[round_id, user_id]))
+
+async def cashout(round_id: str, user_id: int) -> tuple[int, float, dict]:
+    """Returns (code, multiplier, bet); code is 0 on success, -1/-2 on rejection."""
+    s = await _script("cashout", _CASHOUT)
+    res = await s(keys=_keys(round_id), args=[round_id, user_id, ROUND_TTL])
+    if not isinstance(res, list):
+        return int(res), 0.0, {}
+    return 0, float(res[0]), json.loads(res[1])
+
+async def load_bets(round_id: str) -> list[dict]:
+    """All bets of a round with their cashout (None if lost), ordered by index."""
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        p.hgetall(bets_key(round_id))
+        p.hgetall(cashouts_key(round_id))
+        bets, cashouts = await p.execute()
+    out = []
+    for uid, raw in bets.items():
+        b = json.loads(raw)
+        co = cashouts.get(uid)
+        b.update(user_id=int(uid), cashout=float(co) if co is not None else None)
+        out.append(b)
+    out.sort(key=lambda b: b["i"])
+    return out
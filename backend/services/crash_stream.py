@@ -0,0 +1,125 @@
+
+import asyncio, json, logging
+from redis_client import get_redis
+from services import crash_round
+
+log = logging.getLogger("crash_stream")
+
+# Round events go out on a Redis channel and every process, the one running
+# the engine included, follows it (listen()) to keep its own copy of the
+# round and feed its WebSocket clients. Every event is serialized once and
+# the same string is queued for every subscriber; a late joiner first
+# receives a snapshot of the current round. On (re)subscribing the copy is
+# rebuilt from the round's Redis state, since events may have been missed.
+CHANNEL    = "crash:events"
+QUEUE_SIZE = 256
+
+_subscribers: set[asyncio.Queue] = set()
+_state = {"phase": "waiting", "multiplier": 1.0, "round_id": None, "countdown": 5, "bets": []}
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+def _apply(event: dict):
+    kind = event["type"]
+    if kind == "round":
+        _state.update(phase="waiting", multiplier=1.0, round_id=event["round_id"],
+                      countdown=event["countdown"], bets=[])
+    elif kind == "countdown":
+        _state["countdown"] = event["countdown"]
+    elif kind == "running":
+        _state.update(phase="running", countdown=None)
+    elif kind == "tick":
+        _state["multiplier"] = event["multiplier"]
+    elif kind == "crash":
+        _state.update(phase="crashed", multiplier=event["multiplier"])
+    elif kind == "bet":
+        if any(b["i"] == event["i"] for b in _state["bets"]):
+            return   # already in the state rebuilt by resync()
+        _state["bets"].append({"i": event["i"], "name": event["name"], "bet": event["bet"], "cashout": None})
+    elif kind == "cashout":
+        for b in _state["bets"]:
+            if b["i"] == event["i"]:
+                b["cashout"] = event["multiplier"]
+                break
+
+def snapshot() -> dict:
+    return {**_state, "bets": [dict(b) for b in _state["bets"]]}
+
+def _snapshot_message() -> str:
+    return _dumps({"type": "snapshot", **_state})
+
+async def publish(event: dict):
+    """Sends an event to every process. A lost event only leaves followers
+    behind until the next one, so failures are logged, not raised."""
+    try:
+        redis = await get_redis()
+        await redis.publish(CHANNEL, _dumps(event))
+    except Exception as e:
+        log.warning("publish failed: %s", e)
+
+def _deliver(msg: str):
+    event = json.loads(msg)
+    if event.get("round_id", _state["round_id"]) != _state["round_id"] and event["type"] != "round":
+        return   # stale event from a finished round
+    _apply(event)
+    _fan_out(msg)
+
+def _fan_out(msg: str):
+    for q in _subscribers:
+        try:
+            q.put_nowait(msg)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and resync it with a snapshot
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(_snapshot_message())
+
+async def resync():
+    """Rebuilds the local state from Redis and resends it to every subscriber."""
+    r = await crash_round.load_round()
+    if not r:
+        return
+    bets = await crash_round.load_bets(r["round_id"])
+    _state.update(
+        round_id=r["round_id"], phase=r["phase"], multiplier=float(r["multiplier"]),
+        countdown=float(r["countdown"]) if r.get("countdown") else None,
+        bets=[{"i": b["i"], "name": b["name"], "bet": b["bet"], "cashout": b["cashout"]} for b in bets],
+    )
+    _fan_out(_snapshot_message())
+
+async def listen():
+    """Follows the event channel for the life of the process."""
+    while True:
+        try:
+            redis  = await get_redis()
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CHANNEL)
+                await resync()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        _deliver(message["data"])
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("subscription lost: %s", e)
+            await asyncio.sleep(1)
+
+def subscribe() -> asyncio.Queue:
+    q = asyncio.Queue(maxsize=QUEUE_SIZE)
+    q.put_nowait(_snapshot_message())
+    _subscribers.add(q)
+    return q
+
+def unsubscribe(q: asyncio.Queue):
+    _subscribers.discard(q)
+
+def send_private(q: asyncio.Queue, payload: dict):
+    """Queue a reply for a single subscriber (e.g. the result of its own bet)."""
+    try:
+        q.put_nowait(_dumps(payload))
+    except asyncio.QueueFull:
+        pass
@@ -1,106 +1,168 @@
 
-import asyncio, json, time, uuid, hmac, hashlib, math, os
-from redis_client import get_redis
+import asyncio, uuid, math, logging, time
 from database import get_pool
+from services import crash_stream, crash_round, crash_fair, metrics
+from services.leader import Lease, LeaseLost
+from services.wallet_service import AfterCommit, credit_wins, record_games
 from config import settings
 
-CRASH_KEY = "crash:state"
+log = logging.getLogger("crash_worker")
 
-def generate_crash_point() -> float:
-    seed = str(uuid.uuid4())
-    h = hmac.new(seed.encode(), os.urandom(32), hashlib.sha256).hexdigest()
-    val = int(h[:8], 16)
+def crash_point(val: int) -> float:
+    """Crash multiplier for a uniform 32-bit value."""
     return max(1.0, round((2**32 / (val + 1)) * (1 - settings.HOUSE_EDGE), 2))
 
-async def crash_loop():
-    redis = await get_redis()
-    pool  = await get_pool()
+def seed_crash_point(seed: str) -> float:
+    return crash_point(crash_fair.crash_value(seed))
+
+def crash_payout(bet: int, cashout: float | None) -> int:
+    return 0 if cashout is None else math.floor(bet * cashout * (1 - settings.HOUSE_EDGE))
+
+async def settle_round(round_id: str) -> list[dict]:
+    """Bet rows and player stats for a finished round; returns its bets."""
+    bets = await crash_round.load_bets(round_id)
+    metrics.CRASH_ROUND_BETS.observe(len(bets))
+    after = AfterCommit()
+    record_games(after, "crash", [
+        (b["user_id"], b["bet"], crash_payout(b["bet"], b["cashout"]),
+         b["cashout"] or 0.0, {"round": round_id})
+        for b in bets
+    ])
+    await after.run()
+    return bets
+
+async def _new_round(fence: int) -> dict:
+    round_id = str(uuid.uuid4())
+    chain_id, index, seed = await crash_fair.next_seed()
+    crash_at = seed_crash_point(seed)
+    await crash_round.new_round(fence, round_id, crash_at, 5, chain_id, index, seed)
+    await crash_stream.publish({"type": "round", "round_id": round_id, "countdown": 5})
+    return {"round_id": round_id, "phase": "waiting", "crash_at": crash_at, "countdown": 5,
+            "chain_id": chain_id, "index": index, "seed": seed}
+
+async def _run_round(fence: int, pool, r: dict):
+    """Plays a round from whatever phase it is in; `r` is its round hash."""
+    round_id = r["round_id"]
+    crash_at = float(r["crash_at"])
+    loop     = asyncio.get_running_loop()
+
+    # ── Waiting phase (5 sec) ──────────────────────────────
+    if r["phase"] == "waiting":
+        steps = round(float(r["countdown"] or 0) * 10)
+        for i in range(steps):
+            await asyncio.sleep(0.1)
+            countdown = round((steps - i) / 10, 1)
+            await crash_round.set_fields(fence, countdown=countdown)
+            await crash_stream.publish({"type": "countdown", "countdown": countdown})
+        # started_at is wall time, so a successor can tell how far the curve has got
+        started_at = int(time.time() * 1000)
+        await crash_round.set_fields(fence, phase="running", countdown=None, started_at=started_at)
+        await crash_stream.publish({"type": "running"})
+        start = loop.time()
+    else:
+        start = loop.time() - (time.time() * 1000 - int(r["started_at"])) / 1000
+
+    # ── Running phase ──────────────────────────────────────
+    next_tick = loop.time()
+    crashed   = r["phase"] == "crashed"
+    while not crashed:
+        # Ticks are scheduled on absolute deadlines, so time spent on
+        # payouts shortens the next sleep instead of adding drift.
+        next_tick += 0.1
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        woke = loop.time()
+        metrics.CRASH_TICK_LAG.observe(max(0.0, woke - next_tick))
+        t_ms = (woke - start) * 1000
+        mult = min(round(math.exp(0.00006 * t_ms), 2), crash_at)
+        crashed = mult >= crash_at
+
+        # One script call per tick: sets the multiplier, fires the
+        # auto-cashouts whose target was crossed and, on the last
+        # tick, closes the round to manual cashouts.
+        fired = await crash_round.tick(fence, round_id, mult, crashed)
+        if fired:
+            for bet in fired:
+                await crash_stream.publish({"type": "cashout", "round_id": round_id,
+                                            "i": bet["i"], "multiplier": bet["cashout"]})
+            after = AfterCommit()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await credit_wins(conn, after, "crash", [
+                        (b["user_id"], crash_payout(b["bet"], b["cashout"]),
+                         f"Crash auto-cashout x{b['cashout']}")
+                        for b in fired
+                    ])
+                    await after.stage(conn)
+            await after.run()
+
+        if crashed:
+            await crash_stream.publish({"type": "crash", "multiplier": crash_at})
+        else:
+            await crash_stream.publish({"type": "tick", "multiplier": mult})
+        metrics.CRASH_TICK.observe(loop.time() - woke)
+
+    # Claimed before writing, so a leader dying here loses the round's bet
+    # rows rather than letting its successor write them a second time.
+    if await crash_round.claim_settlement(fence, round_id):
+        bets = await settle_round(round_id)
+        await crash_fair.record_round(round_id, int(r["chain_id"]), int(r["index"]), r["seed"],
+                                      crash_at, len(bets), sum(b["bet"] for b in bets))
+
+async def _unfinished_round() -> dict | None:
+    """The round hash if its round has not been settled yet."""
+    r = await crash_round.load_round()
+    if not r or r.get("settled") or "seed" not in r:
+        return None
+    log.info("resuming round %s in phase %s", r["round_id"], r["phase"])
+    return r
+
+async def crash_loop(fence: int):
+    """Runs rounds for as long as `fence` is the engine's lease. After a
+    takeover or a failed round it carries on with the unsettled round, if
+    any, so bets already taken are always played out and settled."""
+    pool   = await get_pool()
+    resume = True
 
     while True:
         try:
-            round_id  = str(uuid.uuid4())
-            crash_at  = generate_crash_point()
-            state = {
-                "phase": "waiting", "multiplier": 1.0, "round_id": round_id,
-                "crash_at": crash_at, "countdown": 5, "bets": []
-            }
-            await redis.set(CRASH_KEY, json.dumps(state))
-
-            # ── Waiting phase (5 sec) ──────────────────────────────
-            for i in range(50):
-                await asyncio.sleep(0.1)
-                raw = await redis.get(CRASH_KEY)
-                s   = json.loads(raw)
-                s["countdown"] = round(5 - i * 0.1, 1)
-                await redis.set(CRASH_KEY, json.dumps(s))
-
-            # ── Running phase ──────────────────────────────────────
-            raw = await redis.get(CRASH_KEY)
-            s   = json.loads(raw)
-            s["phase"] = "running"
-            s["countdown"] = None
-            await redis.set(CRASH_KEY, json.dumps(s))
-
-            start_ms  = time.time() * 1000
-            crashed   = False
-            while not crashed:
-                await asyncio.sleep(0.1)
-                t_ms = time.time() * 1000 - start_ms
-                mult = round(math.exp(0.00006 * t_ms), 2)
-
-                raw = await redis.get(CRASH_KEY)
-                s   = json.loads(raw)
-                s["multiplier"] = mult
-
-                # Auto-cashout
-                for bet in s["bets"]:
-                    ac = bet.get("auto_cashout")
-                    if ac and bet.get("cashout") is None and mult >= ac:
-                        payout = math.floor(bet["bet"] * ac * (1 - settings.HOUSE_EDGE))
-                        bet["cashout"] = ac
-                        async with pool.acquire() as conn:
-                            async with conn.transaction():
-                                await conn.execute(
-                                    "UPDATE users SET gold=gold+$1 WHERE id=$2", payout, bet["user_id"]
-                                )
-                                await conn.execute(
-                                    "INSERT INTO transactions(user_id,type,amount,description,game) "
-                                    "VALUES($1,'win',$2,$3,'crash')",
-                                    bet["user_id"], payout, f"Crash auto-cashout x{ac}"
-                                )
-
-                if mult >= s["crash_at"]:
-                    crashed = True
-                    s["phase"] = "crashed"
-                    s["multiplier"] = s["crash_at"]
-                    # Record losses
-                    async with pool.acquire() as conn:
-                        for bet in s["bets"]:
-                            payout = 0 if bet.get("cashout") is None else math.floor(
-                                bet["bet"] * bet["cashout"] * (1 - settings.HOUSE_EDGE))
-                            won = bet.get("cashout") is not None
-                            async with conn.transaction():
-                                await conn.execute(
-                                    "INSERT INTO bets(user_id,game,bet_amount,payout,multiplier,meta) "
-                                    "VALUES($1,'crash',$2,$3,$4,$5)",
-                                    bet["user_id"], bet["bet"], payout if won else 0,
-                                    bet.get("cashout") or 0.0, json.dumps({"round": round_id})
-                                )
-                                await conn.execute(
-                                    "UPDATE users SET games_played=games_played+1,"
-                                    "games_won=games_won+$1, total_wagered=total_wagered+$2,"
-                                    "total_profit=total_profit+$3, xp=xp+8 WHERE id=$4",
-                                    1 if won else 0, bet["bet"],
-                                    (payout if won else 0) - bet["bet"], bet["user_id"]
-                                )
-
-                await redis.set(CRASH_KEY, json.dumps(s))
+            r = await _unfinished_round() if resume else None
+            resume = True
+            await _run_round(fence, pool, r or await _new_round(fence))
+            resume = False
 
             # ── Post-crash pause 3s ────────────────────────────────
             await asyncio.sleep(3)
 
         except asyncio.CancelledError:
             break
+        except LeaseLost:
+            log.warning("crash engine lease lost, stopping")
+            return
         except Exception as e:
-            print(f"[crash_worker] error: {e}")
+            metrics.CRASH_ERRORS.inc()
+            log.exception("round failed: %s", e)
             await asyncio.sleep(2)
+
+async def run_engine():
+    """Every process runs this; only the holder of the crash lease runs the
+    rounds. The others wait to take over once its lease runs out, which takes
+    at most CRASH_LEASE_TTL after it stops renewing."""
+    lease = Lease(crash_round.LEASE, settings.CRASH_LEASE_TTL)
+    try:
+        while True:
+            fence = await lease.acquire(retry=settings.CRASH_LEASE_TTL / 6)
+            log.info("took the crash engine lease, fence %s", fence)
+            metrics.CRASH_LEADER.set(1)
+            metrics.CRASH_LEADER_CHANGES.inc()
+            engine = asyncio.create_task(crash_loop(fence))
+            keeper = asyncio.create_task(lease.keep())
+            try:
+                await asyncio.wait({engine, keeper}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for t in (engine, keeper):
+                    t.cancel()
+                await asyncio.gather(engine, keeper, return_exceptions=True)
+                metrics.CRASH_LEADER.set(0)
+            await lease.release()
+    finally:
+        await lease.release()
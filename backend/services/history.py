@@ -0,0 +1,123 @@
+
+import base64, csv, io, json, weakref
+from datetime import datetime
+from database import get_read_pool
+
+# A user's ledger and bet history, newest first, paged by keyset on
+# (created_at, id): each page continues strictly after the last row of the
+# previous one, so a page costs the same however deep it is. The cursor is
+# that row's key, base64'd so clients treat it as opaque.
+#
+# Rows reach these tables through the ledger outbox (services/ledger.py),
+# so the last fraction of a second of plays may not be listed yet.
+TX_TYPES = ("bet", "win", "withdraw")
+GAMES    = ("coin", "dice", "roulette", "slots", "crash", "mines")
+
+EXPORT_PREFETCH = 500     # rows per round trip of the export cursor
+EXPORT_SLOTS    = 2       # concurrent exports per process; each holds a read connection
+
+_exports = 0              # slots taken in this process
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Raises ValueError on anything encode_cursor() did not produce."""
+    try:
+        at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(at), int(row_id)
+    except Exception as e:
+        raise ValueError("invalid_cursor") from e
+
+async def transactions_page(uid: int, limit: int, cursor: str | None = None,
+                            game: str | None = None, type: str | None = None) -> tuple[list[dict], str | None]:
+    """One page of a user's transactions and the cursor of the next, None on the last page."""
+    # Only the conditions in use go into the statement, so each variant gets
+    # its own plan on the (user_id, created_at, id) index.
+    where, args = ["user_id = $1"], [uid]
+    if cursor:
+        at, row_id = decode_cursor(cursor)
+        args += [at, row_id]
+        where.append(f"(created_at, id) < (${len(args) - 1}, ${len(args)})")
+    if game:
+        args.append(game)
+        where.append(f"game = ${len(args)}")
+    if type:
+        args.append(type)
+        where.append(f"type = ${len(args)}")
+    args.append(limit + 1)
+    pool = await get_read_pool()
+    rows = await pool.fetch(
+        f"SELECT id, type, amount, description, game, created_at FROM transactions "
+        f"WHERE {' AND '.join(where)} ORDER BY created_at DESC, id DESC LIMIT ${len(args)}",
+        *args
+    )
+    page = [dict(r) for r in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return page, next_cursor
+
+# ── Export ───────────────────────────────────────────────
+
+EXPORT_CHUNK = 64 * 1024   # bytes handed to the response at a time
+
+EXPORTS = {
+    "transactions": ["id", "created_at", "type", "amount", "description", "game"],
+    "bets":         ["id", "created_at", "game", "bet_amount", "payout", "multiplier", "meta"],
+}
+
+def _value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v if v is None or isinstance(v, (int, str)) else str(v)
+
+def export_rows(uid: int, kind: str, fmt: str):
+    """The whole history of one kind as NDJSON or CSV, in chunks. Rows come
+    through a server-side cursor EXPORT_PREFETCH at a time, so memory stays
+    flat however long the history is. Raises RuntimeError("export_busy")
+    when every export slot of this process is taken.
+
+    The slot is taken here, before the response starts, and given back when
+    the stream ends or, if it never started, when it is dropped."""
+    global _exports
+    if _exports >= EXPORT_SLOTS:
+        raise RuntimeError("export_busy")
+    _exports += 1
+    released = False
+    def release():
+        global _exports
+        nonlocal released
+        if not released:
+            released = True
+            _exports -= 1
+    stream = _stream(uid, kind, fmt, release)
+    weakref.finalize(stream, release)
+    return stream
+
+async def _stream(uid: int, kind: str, fmt: str, release):
+    columns = EXPORTS[kind]
+    query = f"SELECT {', '.join(columns)} FROM {kind} WHERE user_id = $1 ORDER BY created_at, id"
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == "csv":
+        writer.writerow(columns)
+    try:
+        pool = await get_read_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(query, uid, prefetch=EXPORT_PREFETCH):
+                    if fmt == "csv":
+                        writer.writerow([_value(v) for v in row.values()])
+                    else:
+                        item = {k: _value(v) for k, v in row.items()}
+                        if kind == "bets" and row["meta"]:
+                            item["meta"] = json.loads(row["meta"])
+                        buf.write(json.dumps(item, ensure_ascii=False))
+                        buf.write("\n")
+                    if buf.tell() >= EXPORT_CHUNK:
+                        yield buf.getvalue()
+                        buf.seek(0)
+                        buf.truncate()
+    finally:
+        release()
+    if buf.tell():
+        yield buf.getvalue()
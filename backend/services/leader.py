@@ -0,0 +1,98 @@
+
+import asyncio, logging, os, socket
+from redis_client import get_redis
+
+log = logging.getLogger("leader")
+
+# Leader election by lease: one Redis key per role, holding "owner:fence"
+# with a TTL the holder keeps renewing. Every acquisition takes the next
+# value of a counter as its fencing token:
+#   lease:{name}          owner:fence, PX ttl
+#   lease:{name}:fence    last token handed out
+# Writes made on behalf of the leader pass their token, and the scripts doing
+# them refuse it unless it is still the counter's value (FENCE_CHECK), so
+# a leader that stalled past its TTL cannot act after its successor started.
+
+class LeaseLost(Exception):
+    """This process no longer holds the lease it is acting under."""
+
+_ACQUIRE = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+local fence = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. fence, 'PX', ARGV[2])
+return fence
+"""
+
+_RENEW = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+return redis.call('DEL', KEYS[1])
+"""
+
+# Prepended to a Lua script whose last KEYS entry is the fence counter and
+# whose last ARGV entry is the caller's token
+FENCE_CHECK = """
+if redis.call('GET', KEYS[#KEYS]) ~= ARGV[#ARGV] then return redis.error_reply('FENCED') end
+"""
+
+def fence_key(name: str) -> str: return f"lease:{name}:fence"
+
+class Lease:
+    def __init__(self, name: str, ttl: float):
+        self.name, self.ttl_ms = name, int(ttl * 1000)
+        self.key   = f"lease:{name}"
+        self.owner = f"{socket.gethostname()}/{os.getpid()}"
+        self.fence: int | None = None
+        self._scripts = {}
+
+    async def _run(self, lua: str, args: list):
+        if lua not in self._scripts:
+            self._scripts[lua] = (await get_redis()).register_script(lua)
+        return await self._scripts[lua](keys=[self.key, fence_key(self.name)], args=args)
+
+    @property
+    def _value(self) -> str:
+        return f"{self.owner}:{self.fence}"
+
+    async def acquire(self, retry: float) -> int:
+        """Waits until the lease is free, takes it and returns the fencing token."""
+        while True:
+            try:
+                fence = int(await self._run(_ACQUIRE, [self.owner, self.ttl_ms]))
+            except Exception as e:
+                log.warning("%s: acquire failed: %s", self.name, e)
+                fence = 0
+            if fence:
+                self.fence = fence
+                return fence
+            await asyncio.sleep(retry)
+
+    async def keep(self):
+        """Renews every third of the TTL; returns once the lease is lost, or
+        when renewals have failed for a whole TTL."""
+        period = self.ttl_ms / 3000
+        last_ok = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(period)
+            try:
+                if not await self._run(_RENEW, [self._value, self.ttl_ms]):
+                    return
+                last_ok = asyncio.get_running_loop().time()
+            except Exception as e:
+                log.warning("%s: renew failed: %s", self.name, e)
+                if asyncio.get_running_loop().time() - last_ok >= self.ttl_ms / 1000:
+                    return
+
+    async def release(self):
+        if self.fence is None:
+            return
+        try:
+            await self._run(_RELEASE, [self._value])
+        except Exception:
+            pass   # it lapses on its own
+        self.fence = None
@@ -0,0 +1,135 @@
+
+from datetime import datetime, timedelta, timezone
+from redis_client import get_redis
+from database import get_pool
+from services import user_stats
+
+# Leaderboards as sorted sets, one per metric and window (UTC):
+#   lb:{metric}:all              all-time, rebuilt from Postgres on a cold start
+#   lb:{metric}:d:{YYYY-MM-DD}   daily, expires two days after the day starts
+#   lb:{metric}:w:{YYYY-Www}     weekly (ISO week), expires after two weeks
+#   lb:names                     hash user_id -> display name
+# The wallet service feeds them through live_stats.track_plays.
+METRICS = ("profit", "wagered", "games")
+WINDOWS = ("all", "day", "week")
+NAMES_KEY = "lb:names"
+BUILT_KEY = "lb:built"     # set by rebuild(); gone after a Redis flush or restart without persistence
+DAY_TTL   = 2 * 86400
+WEEK_TTL  = 14 * 86400
+
+def _window_keys(now: datetime) -> dict[str, tuple[str, int | None]]:
+    iso = now.isocalendar()
+    return {
+        "all":  ("all", None),
+        "day":  (f"d:{now:%Y-%m-%d}", DAY_TTL),
+        "week": (f"w:{iso[0]}-W{iso[1]:02d}", WEEK_TTL),
+    }
+
+def _key(metric: str, window: str, now: datetime = None) -> str:
+    return f"lb:{metric}:{_window_keys(now or datetime.now(timezone.utc))[window][0]}"
+
+def queue_updates(pipe, rows: list[tuple[int, int, int]]):
+    """Adds the increments for (user_id, bet, payout) rows to a Redis pipeline."""
+    per_user: dict[int, list[int]] = {}
+    for uid, bet, payout in rows:
+        acc = per_user.setdefault(uid, [0, 0, 0])
+        acc[0] += payout - bet
+        acc[1] += bet
+        acc[2] += 1
+    for suffix, ttl in _window_keys(datetime.now(timezone.utc)).values():
+        for i, metric in enumerate(METRICS):
+            key = f"lb:{metric}:{suffix}"
+            for uid, acc in per_user.items():
+                pipe.zincrby(key, acc[i], uid)
+            if ttl:
+                pipe.expire(key, ttl)
+
+async def set_name(user_id: int, name: str):
+    redis = await get_redis()
+    await redis.hset(NAMES_KEY, user_id, name or "")
+
+async def top(metric: str, window: str, n: int = 10) -> list[dict]:
+    redis = await get_redis()
+    key = _key(metric, window)
+    rows = await redis.zrevrange(key, 0, n - 1, withscores=True)
+    if not rows:
+        return []
+    ids = [uid for uid, _ in rows]
+    async with redis.pipeline(transaction=False) as p:
+        p.hmget(NAMES_KEY, ids)
+        p.zmscore(_key("games", window), ids)
+        names, games = await p.execute()
+    return [{"name": name, "value": int(score), "games": int(g or 0)}
+            for (_, score), name, g in zip(rows, names, games)]
+
+async def rank(user_id: int, metric: str, window: str) -> dict:
+    """1-based rank and value of a user; rank is None when they have no entry."""
+    redis = await get_redis()
+    key = _key(metric, window)
+    async with redis.pipeline(transaction=False) as p:
+        p.zrevrank(key, user_id)
+        p.zscore(key, user_id)
+        p.zcard(key)
+        r, score, total = await p.execute()
+    return {"rank": None if r is None else r + 1, "value": int(score or 0), "total": total}
+
+async def rebuild_if_missing():
+    """Cold start: rebuilds every window from Postgres unless Redis already has them."""
+    redis = await get_redis()
+    if await redis.exists(BUILT_KEY):
+        return
+    if not await redis.set("lb:rebuild:lock", 1, nx=True, ex=300):
+        return   # another process is on it
+    try:
+        await rebuild()
+    finally:
+        await redis.delete("lb:rebuild:lock")
+
+async def rebuild():
+    now = datetime.now(timezone.utc)
+    day_start  = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = day_start - timedelta(days=now.weekday())
+    windows = _window_keys(now)
+
+    # All-time totals are user_stats plus the counters still in Redis; read
+    # from the primary, which already has what flush() just wrote
+    await user_stats.flush()
+    pending = await user_stats.pending_totals()
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        users = await conn.fetch(
+            "SELECT u.id, u.first_name, COALESCE(s.total_profit, 0) AS profit, "
+            "COALESCE(s.total_wagered, 0) AS wagered, COALESCE(s.games_played, 0) AS games "
+            "FROM users u LEFT JOIN user_stats s ON s.user_id = u.id"
+        )
+        recent = {}
+        for window, since in (("day", day_start), ("week", week_start)):
+            # bets.created_at is a naive UTC timestamp
+            recent[window] = await conn.fetch(
+                "SELECT user_id AS id, SUM(payout - bet_amount) AS profit, SUM(bet_amount) AS wagered, "
+                "COUNT(*) AS games FROM bets WHERE created_at >= $1 GROUP BY user_id",
+                since.replace(tzinfo=None)
+            )
+
+    redis = await get_redis()
+    async with redis.pipeline(transaction=True) as p:
+        if users:
+            p.hset(NAMES_KEY, mapping={u["id"]: u["first_name"] or "" for u in users})
+        sources = {"all": []}
+        for u in users:
+            extra = pending.get(u["id"], {})
+            sources["all"].append((u["id"], u["profit"] + extra.get("profit", 0),
+                                   u["wagered"] + extra.get("wagered", 0), u["games"] + extra.get("played", 0)))
+        for window in ("day", "week"):
+            sources[window] = [(r["id"], r["profit"], r["wagered"], r["games"]) for r in recent[window]]
+        for window, rows in sources.items():
+            suffix, ttl = windows[window]
+            for i, metric in enumerate(METRICS):
+                key = f"lb:{metric}:{suffix}"
+                p.delete(key)
+                if rows:
+                    p.zadd(key, {r[0]: int(r[i + 1]) for r in rows})
+                if ttl:
+                    p.expire(key, ttl)
+        p.set(BUILT_KEY, int(now.timestamp()))
+        await p.execute()
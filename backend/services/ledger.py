@@ -0,0 +1,167 @@
+
+import asyncio, json, logging, time, uuid
+import asyncpg
+from datetime import datetime, timezone
+from decimal import Decimal
+from database import get_pool
+from services import metrics
+from config import settings
+
+log = logging.getLogger("ledger")
+
+# Write-behind for bets and transactions rows. A play's rows go into an
+# outbox in the same transaction as its gold change, so they commit or roll
+# back with it:
+#   ledger_outbox   one row per play, entries = JSON list of entries
+#   ledger_dead     entries Postgres rejected, with the error
+# The writer takes a batch of outbox rows FOR UPDATE SKIP LOCKED, COPYs
+# their entries into a staging table, inserts them with ON CONFLICT
+# (dedupe_key, created_at) DO NOTHING and deletes the outbox rows, all in one
+# transaction: every entry is stored exactly once, and writers in several
+# processes work on disjoint rows. created_at is the time of the play, not
+# of the write.
+#
+# A batch Postgres rejects for its data (a value out of range, a missing
+# user) is split in halves, each under a savepoint, until the offending
+# entries are alone; those go to ledger_dead for someone to look at and the
+# rest is written. Any other error rolls the batch back to be retried.
+
+# Errors that retrying the same rows cannot fix
+BAD_DATA = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, ValueError, TypeError, KeyError)
+
+TX_COLUMNS  = ["dedupe_key", "created_at", "user_id", "type", "amount", "description", "game"]
+BET_COLUMNS = ["dedupe_key", "created_at", "user_id", "game", "bet_amount", "payout", "multiplier", "meta"]
+
+Entry = list   # ["tx"|"bet", dedupe_key, created_at, *columns]
+
+def _now() -> str:
+    # created_at columns hold naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+def tx_entry(user_id: int, type: str, amount: int, description: str, game: str | None) -> Entry:
+    return ["tx", uuid.uuid4().hex, _now(), user_id, type, amount, description, game]
+
+def bet_entry(user_id: int, game: str, bet: int, payout: int, multiplier: float, meta: dict = None) -> Entry:
+    return ["bet", uuid.uuid4().hex, _now(), user_id, game, bet, payout, str(multiplier), json.dumps(meta or {})]
+
+# ── Producing ────────────────────────────────────────────
+
+async def stage(conn, entries: list[Entry]):
+    """Writes entries to the outbox. Pass the connection of the transaction
+    that makes them true, or the pool for entries that stand alone."""
+    if entries:
+        await conn.execute("INSERT INTO ledger_outbox(entries) VALUES($1::jsonb)", json.dumps(entries))
+
+_backlog = 0    # outbox rows, as last seen by this process's writer
+
+async def throttle():
+    """Waits while the outbox is over LEDGER_QUEUE_HIGH, so producers slow
+    down to what the writer sustains."""
+    if _backlog <= settings.LEDGER_QUEUE_HIGH:
+        return
+    metrics.LEDGER_BACKPRESSURE.inc()
+    deadline = time.monotonic() + settings.LEDGER_BACKPRESSURE_WAIT
+    while _backlog > settings.LEDGER_QUEUE_HIGH and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+# ── Writing ──────────────────────────────────────────────
+
+def _records(entries: list[Entry]) -> tuple[list[tuple], list[tuple]]:
+    txs, bets = [], []
+    for kind, key, at, *cols in entries:
+        head = (uuid.UUID(key), datetime.fromisoformat(at))
+        if kind == "tx":
+            txs.append(head + tuple(cols))
+        else:
+            user_id, game, bet, payout, mult, meta = cols
+            bets.append(head + (user_id, game, bet, payout, Decimal(mult), meta))
+    return txs, bets
+
+async def _copy(conn, table: str, columns: list[str], records: list[tuple]):
+    if not records:
+        return
+    staging = f"{table}_stage"
+    await conn.execute(
+        f"CREATE TEMP TABLE {staging} AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+    )
+    await conn.copy_records_to_table(staging, columns=columns, records=records)
+    await conn.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) SELECT * FROM {staging} "
+        f"ON CONFLICT (dedupe_key, created_at) DO NOTHING"
+    )
+    await conn.execute(f"DROP TABLE {staging}")
+
+async def write(conn, entries: list[Entry]):
+    """Stores entries under a savepoint of conn's transaction; entries
+    already stored are skipped."""
+    txs, bets = _records(entries)
+    async with conn.transaction():
+        await _copy(conn, "transactions", TX_COLUMNS, txs)
+        await _copy(conn, "bets", BET_COLUMNS, bets)
+
+async def _write_isolating(conn, batch: list[Entry]) -> list[tuple[Entry, str]]:
+    """Writes a batch, splitting it on bad data; returns the entries
+    rejected on their own, with the error."""
+    try:
+        await write(conn, batch)
+        return []
+    except BAD_DATA as e:
+        if len(batch) == 1:
+            log.error("rejected entry %s: %r", batch[0], e)
+            return [(batch[0], repr(e))]
+    mid = len(batch) // 2
+    return await _write_isolating(conn, batch[:mid]) + await _write_isolating(conn, batch[mid:])
+
+_TAKE = """
+SELECT id, entries FROM ledger_outbox ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED
+"""
+
+# Outbox rows not yet written; ids are handed out in order, so this is read
+# from the ends of the primary key
+_BACKLOG = "SELECT COALESCE(max(id) - min(id) + 1, 0) FROM ledger_outbox"
+
+async def flush_once() -> int:
+    """Writes one batch of outbox rows; returns how many were taken."""
+    global _backlog
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch(_TAKE, settings.LEDGER_BATCH)
+            if rows:
+                t0 = time.perf_counter()
+                batch = [e for r in rows for e in json.loads(r["entries"])]
+                dead = await _write_isolating(conn, batch)
+                if dead:
+                    await conn.executemany(
+                        "INSERT INTO ledger_dead(entry, error) VALUES($1::jsonb, $2)",
+                        [(json.dumps(e), err) for e, err in dead]
+                    )
+                await conn.execute("DELETE FROM ledger_outbox WHERE id = ANY($1::bigint[])", [r["id"] for r in rows])
+        if rows:
+            metrics.LEDGER_FLUSH.observe(time.perf_counter() - t0)
+            metrics.LEDGER_ROWS.inc(len(batch) - len(dead))
+            metrics.LEDGER_DEAD.inc(len(dead))
+        _backlog = await conn.fetchval(_BACKLOG)
+    metrics.LEDGER_BACKLOG.set(_backlog)
+    return len(rows)
+
+async def writer_loop():
+    """Flushes a full batch as soon as there is one, otherwise every
+    LEDGER_FLUSH_INTERVAL seconds."""
+    while True:
+        try:
+            n = await flush_once()
+        except Exception:
+            log.exception("write failed")
+            n = None
+        if n != settings.LEDGER_BATCH:
+            await asyncio.sleep(settings.LEDGER_FLUSH_INTERVAL)
+
+async def drain(timeout: float = 30.0):
+    """Shutdown: writes until the outbox is empty or the timeout passes.
+    Anything left stays in the outbox for the next writer."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await flush_once() == 0:
+            return
+    log.warning("drain timed out, %d outbox rows left", _backlog)
@@ -0,0 +1,44 @@
+
+import logging, time
+from redis.exceptions import RedisError
+from redis_client import get_redis
+from services import leaderboard, user_stats, presence
+
+log = logging.getLogger("live_stats")
+
+# Lobby numbers kept up to date as games are recorded, so reading them costs
+# one pipelined round trip whatever the size of bets/users:
+#   stats:wager:{minute}   per-minute wagered total, summed over the last hour
+# Who is online comes from services/presence.py.
+WAGER_PREFIX  = "stats:wager:"
+WAGER_WINDOW  = 60           # minutes
+
+async def track_plays(rows: list[tuple[int, int, int]]):
+    """rows: (user_id, bet, payout) of games just committed; also feeds the
+    leaderboards and the pending per-user stats. Never raises, the plays
+    themselves already went through."""
+    if not rows:
+        return
+    minute = int(time.time() // 60)
+    key = f"{WAGER_PREFIX}{minute}"
+    try:
+        redis = await get_redis()
+        async with redis.pipeline(transaction=False) as p:
+            p.incrby(key, sum(r[1] for r in rows))
+            p.expire(key, (WAGER_WINDOW + 1) * 60)
+            leaderboard.queue_updates(p, rows)
+            user_stats.queue_updates(p, rows)
+            await p.execute()
+    except RedisError:
+        log.exception("counters for %d plays not recorded", len(rows))
+
+async def lobby_snapshot() -> tuple[int, int]:
+    """(wagered over the last hour, users online, as counted by presence)"""
+    now = time.time()
+    minute = int(now // 60)
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        p.mget([f"{WAGER_PREFIX}{m}" for m in range(minute - WAGER_WINDOW + 1, minute + 1)])
+        presence.queue_online_count(p)
+        buckets, online = await p.execute()
+    return sum(int(b) for b in buckets if b), online
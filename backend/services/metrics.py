@@ -0,0 +1,166 @@
+
+import asyncio, time
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+# Everything exported at /metrics. Label values are bounded: route templates,
+# statements as written in the code, Redis command names.
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+FAST_BUCKETS    = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route",
+                         ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled by route", ["method", "route"])
+
+DB_QUERY = Histogram("db_query_duration_seconds", "Postgres statement latency",
+                     ["statement"], buckets=FAST_BUCKETS)
+DB_ERRORS = Counter("db_query_errors_total", "Postgres statements that raised", ["statement"])
+DB_ACQUIRE = Histogram("db_pool_acquire_seconds", "Wait for a pooled connection", ["pool"], buckets=FAST_BUCKETS)
+DB_ACQUIRE_TIMEOUTS = Counter("db_pool_acquire_timeouts_total", "Acquires that gave up waiting", ["pool"])
+DB_POOL_WAITING = Gauge("db_pool_waiting", "Tasks waiting for a connection", ["pool"])
+DB_POOL_IN_USE  = Gauge("db_pool_in_use", "Connections checked out", ["pool"])
+DB_POOL_SIZE    = Gauge("db_pool_size", "Open connections", ["pool"])
+DB_POOL_MAX     = Gauge("db_pool_max_size", "Connection limit", ["pool"])
+
+REDIS_COMMAND = Histogram("redis_command_duration_seconds", "Redis command latency; a pipeline is one entry",
+                          ["command"], buckets=FAST_BUCKETS)
+REDIS_ERRORS = Counter("redis_command_errors_total", "Redis commands that raised", ["command"])
+
+CRASH_TICK = Histogram("crash_tick_duration_seconds", "Work done per crash tick (script, payouts, publish)",
+                       buckets=FAST_BUCKETS)
+CRASH_TICK_LAG = Histogram("crash_tick_lag_seconds", "How late a crash tick woke up against its deadline",
+                           buckets=FAST_BUCKETS)
+CRASH_ROUND_BETS = Histogram("crash_round_bets", "Bets per crash round",
+                             buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+CRASH_ERRORS = Counter("crash_worker_errors_total", "Crash rounds aborted by an error")
+CRASH_LEADER = Gauge("crash_engine_leader", "1 while this process holds the crash engine lease")
+CRASH_LEADER_CHANGES = Counter("crash_engine_lease_acquired_total", "Times this process took the crash engine lease")
+
+LEDGER_BACKLOG = Gauge("ledger_outbox_length", "Outbox rows (plays) waiting for the ledger writer")
+LEDGER_ROWS = Counter("ledger_rows_written_total", "Ledger entries written to bets/transactions")
+LEDGER_FLUSH = Histogram("ledger_flush_duration_seconds", "Time to write one batch of outbox rows",
+                         buckets=LATENCY_BUCKETS)
+LEDGER_BACKPRESSURE = Counter("ledger_backpressure_total", "Plays that found the outbox over its limit")
+LEDGER_DEAD = Counter("ledger_dead_letter_total", "Ledger entries Postgres rejected, moved to ledger_dead")
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+# ── Postgres ─────────────────────────────────────────────
+
+STATEMENT_LABEL_LEN = 120
+_labels: dict[str, str] = {}
+
+def statement_label(query: str) -> str:
+    label = _labels.get(query)
+    if label is None:
+        label = " ".join(query.split())[:STATEMENT_LABEL_LEN]
+        if len(_labels) < 10_000:
+            _labels[query] = label
+    return label
+
+def _timed_query(fn, label_of):
+    async def wrapper(*args, **kwargs):
+        label = label_of(args)
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.labels(label).inc()
+            raise
+        finally:
+            DB_QUERY.labels(label).observe(time.perf_counter() - t0)
+    return wrapper
+
+_QUERY_METHODS = {"execute", "executemany", "fetch", "fetchrow", "fetchval"}
+_COPY_METHODS  = {"copy_records_to_table", "copy_to_table"}
+
+def _instrument(target, name: str):
+    attr = getattr(target, name)
+    if name in _QUERY_METHODS:
+        return _timed_query(attr, lambda args: statement_label(args[0]))
+    if name in _COPY_METHODS:
+        return _timed_query(attr, lambda args: f"COPY {args[0]}")
+    return attr
+
+class InstrumentedConnection:
+    """An acquired connection whose statements are timed; everything else
+    (transaction(), prepare(), ...) is the asyncpg connection's own."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return _instrument(self._conn, name)
+
+class _Acquire:
+    def __init__(self, ctx, name: str):
+        self._ctx, self._name = ctx, name
+
+    async def __aenter__(self):
+        waiting = DB_POOL_WAITING.labels(self._name)
+        waiting.inc()
+        t0 = time.perf_counter()
+        try:
+            conn = await self._ctx.__aenter__()
+        except asyncio.TimeoutError:
+            DB_ACQUIRE_TIMEOUTS.labels(self._name).inc()
+            raise
+        finally:
+            waiting.dec()
+            DB_ACQUIRE.labels(self._name).observe(time.perf_counter() - t0)
+        return InstrumentedConnection(conn)
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+class InstrumentedPool:
+    """What get_pool()/get_read_pool() return: an asyncpg pool timing acquires
+    and statements, with its saturation exported under the pool's name."""
+
+    def __init__(self, pool, name: str, acquire_timeout: float | None = None):
+        self._pool, self._name, self._timeout = pool, name, acquire_timeout
+        DB_POOL_MAX.labels(name).set(pool.get_max_size())
+        DB_POOL_SIZE.labels(name).set_function(pool.get_size)
+        DB_POOL_IN_USE.labels(name).set_function(lambda: pool.get_size() - pool.get_idle_size())
+
+    def __getattr__(self, name):
+        return _instrument(self._pool, name)
+
+    def acquire(self, timeout: float | None = None):
+        return _Acquire(self._pool.acquire(timeout=timeout or self._timeout), self._name)
+
+# ── Redis ────────────────────────────────────────────────
+
+def _observe_redis(command: str, t0: float, failed: bool):
+    REDIS_COMMAND.labels(command).observe(time.perf_counter() - t0)
+    if failed:
+        REDIS_ERRORS.labels(command).inc()
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        t0, failed = time.perf_counter(), True
+        try:
+            result = await super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            _observe_redis(command, t0, failed)
+
+class InstrumentedRedis(Redis):
+    """Redis client timing each command; scripts show up as EVALSHA."""
+
+    async def execute_command(self, *args, **options):
+        t0, failed = time.perf_counter(), True
+        try:
+            result = await super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            _observe_redis(str(args[0]).upper(), t0, failed)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
@@ -0,0 +1,202 @@
+
+import asyncio, logging
+from redis_client import get_redis
+from database import get_pool
+from services.wallet_service import AfterCommit, record_games
+
+log = logging.getLogger("mines")
+
+# Live Mines sessions are Redis hashes; Postgres only sees the session when
+# it is created (debit) and when it ends (bet record, payout). Boards are
+# 25-bit masks, bit n = cell n:
+#   mines:{id}        hash  uid, bet, count, mines, revealed, found, state (open|lost|cashed)
+#   mines:user:{uid}  id of the user's current session
+# Bit tests use arithmetic rather than the bit library, for any Lua version.
+SESSION_TTL = 3600     # seconds since the last action
+
+def session_key(session_id: str) -> str: return f"mines:{session_id}"
+def user_key(uid: int) -> str:           return f"mines:user:{uid}"
+
+# Error codes shared by the scripts
+NOT_FOUND, FORBIDDEN, EXPIRED, ALREADY_REVEALED, NOTHING_REVEALED = -404, -403, -410, -409, -400
+
+_CHECK = """
+local s = redis.call('HMGET', KEYS[1], 'uid', 'state', 'mines', 'revealed', 'found', 'bet', 'count')
+if not s[1] then return {-404} end
+if s[1] ~= ARGV[1] then return {-403} end
+if s[2] ~= 'open' then return {-410} end
+local mines, revealed, found = tonumber(s[3]), tonumber(s[4]), tonumber(s[5])
+"""
+
+# -> {0, found, revealed, count} for a safe cell, {1, found, revealed, mines, bet, count} for a mine
+_REVEAL = _CHECK + """
+local b = 2 ^ tonumber(ARGV[2])
+if math.floor(revealed / b) % 2 == 1 then return {-409} end
+revealed = revealed + b
+if math.floor(mines / b) % 2 == 1 then
+    redis.call('HSET', KEYS[1], 'revealed', revealed, 'state', 'lost')
+    return {1, found, revealed, mines, tonumber(s[6]), tonumber(s[7])}
+end
+found = found + 1
+redis.call('HSET', KEYS[1], 'revealed', revealed, 'found', found)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {0, found, revealed, tonumber(s[7])}
+"""
+
+# -> {0, found, revealed, mines, bet, count}; the session is closed
+_CASHOUT = _CHECK + """
+if found == 0 then return {-400} end
+redis.call('HSET', KEYS[1], 'state', 'cashed')
+return {0, found, revealed, mines, tonumber(s[6]), tonumber(s[7])}
+"""
+
+# Reveals several cells in order, stopping at the first mine, and optionally
+# cashes out after the last one, all in one state update.
+# ARGV: uid, pick, cashout, ttl, cells... With pick > 0 the first `pick` cells of
+# the list that are not yet revealed are taken; with pick = 0 every cell is
+# taken and an already revealed one rejects the whole request.
+# -> {hit, found, revealed, previously revealed, mines (0 while open), bet, count, cashed}
+_REVEAL_MANY = _CHECK + """
+local prev, pick, taken, hit = revealed, tonumber(ARGV[2]), 0, 0
+for j = 5, #ARGV do
+    if pick > 0 and taken >= pick then break end
+    local b = 2 ^ tonumber(ARGV[j])
+    if math.floor(revealed / b) % 2 == 1 then
+        if pick == 0 then return {-409} end
+    else
+        taken = taken + 1
+        revealed = revealed + b
+        if math.floor(mines / b) % 2 == 1 then
+            hit = 1
+            break
+        end
+        found = found + 1
+    end
+end
+local state = 'open'
+if hit == 1 then state = 'lost' elseif ARGV[3] == '1' and found > 0 then state = 'cashed' end
+redis.call('HSET', KEYS[1], 'revealed', revealed, 'found', found, 'state', state)
+local shown, cashed = mines, 0
+if state == 'open' then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    shown = 0
+elseif state == 'cashed' then
+    cashed = 1
+end
+return {hit, found, revealed, prev, shown, tonumber(s[6]), tonumber(s[7]), cashed}
+"""
+
+_REOPEN = """
+if redis.call('HGET', KEYS[1], 'state') == 'cashed' then
+    redis.call('HSET', KEYS[1], 'state', 'open')
+end
+return 1
+"""
+
+_scripts = {}
+
+async def _run(name: str, lua: str, keys: list, args: list):
+    if name not in _scripts:
+        _scripts[name] = (await get_redis()).register_script(lua)
+    return await _scripts[name](keys=keys, args=args)
+
+def to_mask(cells) -> int:
+    m = 0
+    for c in cells:
+        m |= 1 << c
+    return m
+
+def cells(mask: int) -> list[int]:
+    return [i for i in range(25) if mask >> i & 1]
+
+def board_from_mask(mines: int) -> list[str]:
+    return ['mine' if mines >> i & 1 else 'safe' for i in range(25)]
+
+async def create(session_id: str, uid: int, bet: int, mine_count: int, mines: int) -> str | None:
+    """Stores a new session; returns the id of the user's previous session, if any."""
+    redis = await get_redis()
+    async with redis.pipeline(transaction=True) as p:
+        p.getset(user_key(uid), session_id)
+        p.hset(session_key(session_id), mapping={
+            "uid": uid, "bet": bet, "count": mine_count, "mines": mines,
+            "revealed": 0, "found": 0, "state": "open",
+        })
+        p.expire(session_key(session_id), SESSION_TTL)
+        p.expire(user_key(uid), SESSION_TTL)
+        prev, *_ = await p.execute()
+    if prev:
+        await redis.hset(session_key(prev), "state", "lost")
+    return prev
+
+async def reveal(session_id: str, uid: int, cell: int) -> list[int]:
+    return await _run("reveal", _REVEAL, [session_key(session_id)], [uid, cell, SESSION_TTL])
+
+async def reveal_many(session_id: str, uid: int, order: list[int], pick: int = 0, cash: bool = False) -> list[int]:
+    """Reveals the cells of order (all of them, or the first pick unrevealed
+    ones) until a mine; with cash, a surviving session is cashed out too."""
+    return await _run("reveal_many", _REVEAL_MANY, [session_key(session_id)],
+                      [uid, pick, int(cash), SESSION_TTL, *order])
+
+async def cashout(session_id: str, uid: int) -> list[int]:
+    return await _run("cashout", _CASHOUT, [session_key(session_id)], [uid])
+
+async def reopen(session_id: str):
+    """Undoes a cashout whose payout could not be written."""
+    await _run("reopen", _REOPEN, [session_key(session_id)], [])
+
+async def peek(session_ids: list[str]) -> list[tuple[str | None, int | None]]:
+    """(state, revealed mask) of each session; (None, None) once it expired."""
+    if not session_ids:
+        return []
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        for sid in session_ids:
+            p.hmget(session_key(sid), "state", "revealed")
+        return [(state, None if revealed is None else int(revealed))
+                for state, revealed in await p.execute()]
+
+def loss_meta(mine_count: int, revealed: int | None) -> dict:
+    """Bet meta of a session that ended without a payout. Reveals live only in
+    Redis until the session ends, so cells is left out once they are gone."""
+    meta = {"mines": mine_count}
+    if revealed is not None:
+        meta["cells"] = revealed.bit_count()
+    return meta
+
+async def sweep_abandoned():
+    """Ends Postgres sessions whose Redis side expired or already ended
+    (e.g. a loss whose bet record failed) and records them as lost."""
+    pool  = await get_pool()
+    after = AfterCommit()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT id FROM mines_sessions WHERE NOT cashed_out AND created_at < NOW() - make_interval(secs => $1)",
+            SESSION_TTL
+        )
+        if not rows:
+            return
+        ids = [r["id"] for r in rows]
+        stale = {sid: revealed for sid, (state, revealed) in zip(ids, await peek(ids))
+                 if state in (None, "lost")}
+        if not stale:
+            return
+        async with conn.transaction():
+            ended = await conn.fetch(
+                "UPDATE mines_sessions SET cashed_out=TRUE WHERE id = ANY($1) AND NOT cashed_out "
+                "RETURNING id, user_id, bet, mine_count",
+                list(stale)
+            )
+            record_games(after, "mines", [
+                (r["user_id"], r["bet"], 0, 0.0, loss_meta(r["mine_count"], stale[r["id"]]))
+                for r in ended
+            ])
+            await after.stage(conn)
+    await after.run()
+
+async def sweeper_loop():
+    while True:
+        await asyncio.sleep(300)
+        try:
+            await sweep_abandoned()
+        except Exception:
+            log.exception("sweeper failed")
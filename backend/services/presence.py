@@ -0,0 +1,69 @@
+
+import asyncio, logging, time
+from redis_client import get_redis
+
+log = logging.getLogger("presence")
+
+# Who is online and what they are playing, for the lobby counters:
+#   online:{game}   zset user_id -> last seen in that game
+#   online:all      zset user_id -> last seen anywhere (any authenticated request)
+# Requests only add the user to a per-process buffer, which costs a set
+# insert and no I/O. flusher_loop() writes the buffer every FLUSH_INTERVAL
+# in one pipeline and trims entries older than WINDOW in the same trip.
+# Counts only take entries inside the window, so anything a trim has not
+# reached yet is never counted, and keys expire once nobody plays.
+GAMES          = ("crash", "roulette", "slots", "coin", "mines", "dice")
+ALL_KEY        = "online:all"
+WINDOW         = 90      # seconds a player stays counted after the last sign of life
+FLUSH_INTERVAL = 2       # seconds
+
+def game_key(game: str) -> str: return f"online:{game}"
+
+_pending: dict[str, set[int]] = {}   # game key -> users; ALL_KEY holds everyone
+
+def seen(user_id: int, game: str | None = None):
+    _pending.setdefault(ALL_KEY, set()).add(user_id)
+    if game in GAMES:
+        _pending.setdefault(game_key(game), set()).add(user_id)
+
+def seen_request(user_id: int, path: str):
+    """Any authenticated request counts as online; one to
+    /api/games/{game}/... also as playing that game."""
+    seen(user_id, path.split("/", 4)[3] if path.startswith("/api/games/") else None)
+
+async def flush():
+    global _pending
+    if not _pending:
+        return
+    pending, _pending = _pending, {}
+    now   = time.time()
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        for key, uids in pending.items():
+            p.zadd(key, dict.fromkeys(uids, now))
+            p.zremrangebyscore(key, "-inf", now - WINDOW)
+            p.expire(key, WINDOW * 2)
+        await p.execute()
+
+async def flusher_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception:
+            log.exception("flush failed")
+
+def queue_online_count(pipe):
+    """Adds the count of users online to a pipeline."""
+    pipe.zcount(ALL_KEY, time.time() - WINDOW, "+inf")
+
+async def counts() -> dict[str, int]:
+    """Players per game and in total (distinct), in one round trip."""
+    since = time.time() - WINDOW
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        for g in GAMES:
+            p.zcount(game_key(g), since, "+inf")
+        queue_online_count(p)
+        *per_game, total = await p.execute()
+    return {**dict(zip(GAMES, per_game)), "total": total}
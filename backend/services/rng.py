@@ -0,0 +1,115 @@
+
+import os, random
+
+# Randomness for every game outcome. os.urandom is read BLOCK bytes at a time
+# and handed out as 32-bit words, so a draw costs an index into a buffer
+# instead of a syscall. Bounded integers use Lemire's multiply-shift with
+# rejection, so they are exactly uniform. Everything else is built on below().
+#
+# seed() swaps the source for a deterministic generator, for tests and
+# simulation only: never in a process that serves real bets.
+BLOCK = 64 * 1024    # bytes per refill
+MASK  = 0xFFFFFFFF
+
+_source = os.urandom
+_words  = memoryview(b"").cast("I")
+_pos    = 0
+
+def seed(value: int | None):
+    """Deterministic output from here on; None goes back to os.urandom."""
+    global _source, _words, _pos
+    _source = os.urandom if value is None else random.Random(value).randbytes
+    _words, _pos = memoryview(b"").cast("I"), 0
+
+def _refill():
+    global _words, _pos
+    _words, _pos = memoryview(_source(BLOCK)).cast("I"), 0
+
+def _take(k: int) -> list[int]:
+    """Up to k words (fewer at the end of a block)."""
+    global _pos
+    if _pos == len(_words):
+        _refill()
+    out = _words[_pos:_pos + k].tolist()
+    _pos += len(out)
+    return out
+
+def word() -> int:
+    global _pos
+    if _pos == len(_words):
+        _refill()
+    w = _words[_pos]
+    _pos += 1
+    return w
+
+def below(n: int) -> int:
+    """Uniform in [0, n), 1 <= n <= 2**32."""
+    m = word() * n
+    if (m & MASK) < n:
+        # Only now can the draw fall in the biased zone; reject it if it does
+        t = (1 << 32) % n
+        while (m & MASK) < t:
+            m = word() * n
+    return m >> 32
+
+def below_many(n: int, count: int) -> list[int]:
+    """`count` independent below(n) draws, taken from the buffer in slices."""
+    t = (1 << 32) % n
+    out = []
+    while len(out) < count:
+        for w in _take(count - len(out)):
+            m = w * n
+            if (m & MASK) >= t:
+                out.append(m >> 32)
+    return out
+
+def sample(n: int, k: int) -> list[int]:
+    """k distinct values of range(n) in random order (partial Fisher-Yates)."""
+    pool = list(range(n))
+    for i in range(k):
+        j = i + below(n - i)
+        pool[i], pool[j] = pool[j], pool[i]
+    return pool[:k]
+
+def sample_mask(n: int, k: int) -> int:
+    """k distinct bits of the low n, as a mask; at most ~2k draws."""
+    if 2 * k > n:
+        return ((1 << n) - 1) ^ sample_mask(n, n - k)
+    mask = 0
+    while k:
+        bit = 1 << below(n)
+        if not mask & bit:
+            mask |= bit
+            k -= 1
+    return mask
+
+class Alias:
+    """Draws index i with probability weights[i] / sum(weights) in O(1)
+    (Vose's alias method). Integer weights keep the table exact, and one
+    word picks both the column and the coin."""
+
+    def __init__(self, weights: list[int]):
+        n, total = len(weights), sum(weights)
+        self.n, self.total = n, total
+        self.prob  = [total] * n    # keep i when the coin is below prob[i]...
+        self.alias = list(range(n)) # ...else take alias[i]
+        scaled = [w * n for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < total]
+        large = [i for i, p in enumerate(scaled) if p >= total]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] -= total - scaled[s]
+            (small if scaled[l] < total else large).append(l)
+
+    def draw(self) -> int:
+        i, coin = divmod(below(self.n * self.total), self.total)
+        return i if coin < self.prob[i] else self.alias[i]
+
+    def draw_many(self, count: int) -> list[int]:
+        prob, alias, total = self.prob, self.alias, self.total
+        out = []
+        for r in below_many(self.n * total, count):
+            i, coin = divmod(r, total)
+            out.append(i if coin < prob[i] else alias[i])
+        return out
@@ -0,0 +1,171 @@
+
+import asyncio, logging
+from redis_client import get_redis
+from database import get_pool
+
+log = logging.getLogger("user_stats")
+
+# Per-user play statistics, kept off the users row so a play writes that row
+# once (the balance). Plays are counted in Redis and folded into user_stats
+# in bulk:
+#   stats:p:{uid}     hash of pending counters, HINCRBY'd by track_plays
+#   stats:dirty       set of user ids with pending counters
+#   stats:f:{uid}     counters taken by a flush, tagged with its batch id
+#   stats:flushing    set of user ids with a stats:f hash
+#   stats:batch       flush batch counter
+# A flush renames stats:p to stats:f, adds the hashes to user_stats and only
+# then deletes them. user_stats.flushed_batch records the last batch applied
+# to a row, so a flush that died after committing can be replayed without
+# counting twice, and readers know whether a stats:f hash is already in the
+# table.
+FIELDS = ("played", "won", "wagered", "profit", "xp")
+XP_PER_GAME    = 8
+FLUSH_INTERVAL = 5        # seconds
+FLUSH_BATCH    = 1000     # users per statement
+LOCK_KEY       = "stats:flush:lock"
+
+def pending_key(uid) -> str:  return f"stats:p:{uid}"
+def flushing_key(uid) -> str: return f"stats:f:{uid}"
+
+def queue_updates(pipe, rows: list[tuple[int, int, int]]):
+    """Adds the counters for (user_id, bet, payout) rows to a Redis pipeline."""
+    per_user: dict[int, list[int]] = {}
+    for uid, bet, payout in rows:
+        acc = per_user.setdefault(uid, [0, 0, 0, 0, 0])
+        acc[0] += 1
+        acc[1] += payout > 0
+        acc[2] += bet
+        acc[3] += payout - bet
+        acc[4] += XP_PER_GAME
+    for uid, acc in per_user.items():
+        for field, value in zip(FIELDS, acc):
+            if value:
+                pipe.hincrby(pending_key(uid), field, value)
+    if per_user:
+        pipe.sadd("stats:dirty", *per_user)
+
+# ── Flushing ─────────────────────────────────────────────
+
+# Moves up to ARGV[1] pending hashes aside under a new batch id. A user whose
+# previous flush hash is still there is put back for the next run.
+_TAKE = """
+local batch = redis.call('INCR', 'stats:batch')
+local taken = {}
+for _, uid in ipairs(redis.call('SPOP', 'stats:dirty', ARGV[1])) do
+    local p, f = 'stats:p:' .. uid, 'stats:f:' .. uid
+    if redis.call('EXISTS', f) == 1 then
+        redis.call('SADD', 'stats:dirty', uid)
+    elseif redis.call('EXISTS', p) == 1 then
+        redis.call('RENAME', p, f)
+        redis.call('HSET', f, 'batch', batch)
+        redis.call('SADD', 'stats:flushing', uid)
+        taken[#taken + 1] = uid
+    end
+end
+return taken
+"""
+
+_APPLY = """
+INSERT INTO user_stats AS s (user_id, games_played, games_won, total_wagered, total_profit, xp, flushed_batch)
+SELECT * FROM unnest($1::bigint[], $2::int[], $3::int[], $4::bigint[], $5::bigint[], $6::int[], $7::bigint[])
+ON CONFLICT (user_id) DO UPDATE SET
+    games_played  = s.games_played + EXCLUDED.games_played,
+    games_won     = s.games_won + EXCLUDED.games_won,
+    total_wagered = s.total_wagered + EXCLUDED.total_wagered,
+    total_profit  = s.total_profit + EXCLUDED.total_profit,
+    xp            = s.xp + EXCLUDED.xp,
+    flushed_batch = EXCLUDED.flushed_batch
+WHERE s.flushed_batch < EXCLUDED.flushed_batch
+"""
+
+_take = None
+
+async def _apply(uids: list[str]):
+    """Adds the stats:f hashes of these users to user_stats, then drops them."""
+    if not uids:
+        return
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as p:
+        for uid in uids:
+            p.hgetall(flushing_key(uid))
+        hashes = await p.execute()
+    rows = [(int(uid), *(int(h.get(f, 0)) for f in FIELDS), int(h["batch"]))
+            for uid, h in zip(uids, hashes) if h]
+    if rows:
+        pool = await get_pool()
+        await pool.execute(_APPLY, *map(list, zip(*rows)))
+    async with redis.pipeline(transaction=True) as p:
+        p.delete(*[flushing_key(uid) for uid in uids])
+        p.srem("stats:flushing", *uids)
+        await p.execute()
+
+async def flush():
+    """Writes every pending counter to user_stats; one flusher at a time."""
+    global _take
+    redis = await get_redis()
+    if not await redis.set(LOCK_KEY, 1, nx=True, ex=60):
+        return
+    try:
+        # Left over from a flush that stopped half way
+        await _apply(list(await redis.smembers("stats:flushing")))
+        if _take is None:
+            _take = redis.register_script(_TAKE)
+        while True:
+            uids = await _take(args=[FLUSH_BATCH])
+            await _apply(uids)
+            if len(uids) < FLUSH_BATCH:
+                break
+    finally:
+        await redis.delete(LOCK_KEY)
+
+async def flusher_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush()
+        except Exception:
+            log.exception("flush failed")
+
+# ── Reading ──────────────────────────────────────────────
+
+async def get_stats(uid: int) -> dict | None:
+    """Totals of a user as of now: user_stats plus whatever is still in Redis.
+    None if the user has no stats row and nothing pending. Reads the primary:
+    a lagging replica could miss a flush whose Redis side is already gone."""
+    redis = await get_redis()
+    pool = await get_pool()
+    for _ in range(3):
+        async with redis.pipeline(transaction=True) as p:
+            p.hgetall(pending_key(uid))
+            p.hgetall(flushing_key(uid))
+            p.get("stats:batch")
+            pending, flushing, batch = await p.execute()
+        row = await pool.fetchrow(
+            "SELECT games_played, games_won, total_wagered, total_profit, xp, flushed_batch "
+            "FROM user_stats WHERE user_id=$1", uid
+        )
+        applied = row["flushed_batch"] if row else 0
+        if applied > int(batch or 0):
+            continue   # a flush committed between the two reads; the Redis side is stale
+        if flushing and int(flushing["batch"]) <= applied:
+            flushing = {}
+        if not row and not pending and not flushing:
+            return None
+        stats = {f: int(pending.get(f, 0)) + int(flushing.get(f, 0)) for f in FIELDS}
+        if row:
+            for f, col in zip(FIELDS, ("games_played", "games_won", "total_wagered", "total_profit", "xp")):
+                stats[f] += row[col]
+        return stats
+    raise RuntimeError("user_stats: could not get a consistent read")
+
+async def pending_totals() -> dict[int, dict]:
+    """Counters not yet in user_stats, per user; call right after flush()."""
+    redis = await get_redis()
+    uids = list(await redis.smembers("stats:dirty"))
+    if not uids:
+        return {}
+    async with redis.pipeline(transaction=False) as p:
+        for uid in uids:
+            p.hgetall(pending_key(uid))
+        hashes = await p.execute()
+    return {int(uid): {f: int(h.get(f, 0)) for f in FIELDS} for uid, h in zip(uids, hashes) if h}
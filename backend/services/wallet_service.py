@@ -1,41 +1,178 @@
-import asyncpg
-import json
+import asyncpg, json
+from dataclasses import dataclass
+from database import get_pool
+from services.live_stats import track_plays
+from services import balance_cache, ledger
+from services.balance_cache import Balance
 
-async def deduct_bet(conn: asyncpg.Connection, user_id: int, bet: int, game: str):
-    row = await conn.fetchrow("SELECT gold FROM users WHERE id=$1 FOR UPDATE", user_id)
-    if not row or row["gold"] < bet:
-        raise ValueError("insufficient_funds")
-    await conn.execute("UPDATE users SET gold = gold - $1 WHERE id=$2", bet, user_id)
-    await conn.execute(
-        "INSERT INTO transactions(user_id,type,amount,description,game) VALUES($1,'bet',$2,$3,$4)",
-        user_id, -bet, f"Ставка · {game}", game
+# A play's transaction changes users.gold and writes its bets/transactions
+# rows to the ledger outbox (services/ledger.py), so the audit trail commits
+# with the gold. Every other effect waits for the commit, so a rollback
+# leaves nothing behind:
+#   balances   every gold change bumps gold_ver; (user_id, gold, gold_ver)
+#              goes to the balance cache (services/balance_cache.py)
+#   plays      counted for stats and leaderboards (services/live_stats.py)
+# Functions that run inside a caller's transaction collect these in the
+# caller's AfterCommit, which stage() writes the rows of before the commit;
+# the ones that own their statement or transaction run their own.
+Play = tuple[int, int, int]    # (user_id, bet, payout)
+
+class AfterCommit:
+    def __init__(self):
+        self.balances: list[Balance] = []
+        self.entries:  list[ledger.Entry] = []
+        self.plays:    list[Play] = []
+
+    async def stage(self, conn):
+        """Writes the collected rows to the ledger outbox; call it inside the
+        transaction, so they commit with the gold change."""
+        await ledger.stage(conn, self.entries)
+        self.entries = []
+
+    async def run(self):
+        if self.entries:
+            # Rows that no Postgres write makes true (crash round results)
+            await ledger.stage(await get_pool(), self.entries)
+            self.entries = []
+        await balance_cache.publish(self.balances)
+        await ledger.throttle()
+        await track_plays(self.plays)
+
+async def deduct_bet(conn: asyncpg.Connection, after: AfterCommit, user_id: int, bet: int, game: str) -> Balance:
+    row = await conn.fetchrow(
+        "UPDATE users SET gold = gold - $1, gold_ver = gold_ver + 1 WHERE id=$2 AND gold >= $1 "
+        "RETURNING gold, gold_ver",
+        bet, user_id
     )
+    if not row:
+        raise ValueError("insufficient_funds")
+    balance = (user_id, row["gold"], row["gold_ver"])
+    after.balances.append(balance)
+    after.entries.append(ledger.tx_entry(user_id, "bet", -bet, f"Ставка · {game}", game))
+    return balance
 
-async def credit_win(conn: asyncpg.Connection, user_id: int, payout: int, game: str):
+async def credit_win(conn: asyncpg.Connection, after: AfterCommit, user_id: int, payout: int, game: str) -> Balance | None:
     if payout <= 0:
-        return
-    await conn.execute("UPDATE users SET gold = gold + $1 WHERE id=$2", payout, user_id)
-    await conn.execute(
-        "INSERT INTO transactions(user_id,type,amount,description,game) VALUES($1,'win',$2,$3,$4)",
-        user_id, payout, f"Победа · {game}", game
+        return None
+    row = await conn.fetchrow(
+        "UPDATE users SET gold = gold + $1, gold_ver = gold_ver + 1 WHERE id=$2 RETURNING gold, gold_ver",
+        payout, user_id
     )
+    balance = (user_id, row["gold"], row["gold_ver"])
+    after.balances.append(balance)
+    after.entries.append(ledger.tx_entry(user_id, "win", payout, f"Победа · {game}", game))
+    return balance
 
-async def record_game(conn: asyncpg.Connection, user_id: int, game: str,
-                      bet: int, payout: int, multiplier: float, meta: dict = None):
-    won = payout > 0
-    await conn.execute(
-        "INSERT INTO bets(user_id,game,bet_amount,payout,multiplier,meta) VALUES($1,$2,$3,$4,$5,$6)",
-        user_id, game, bet, payout, multiplier, json.dumps(meta or {})
-    )
-    await conn.execute(
+def record_game(after: AfterCommit, user_id: int, game: str,
+                bet: int, payout: int, multiplier: float, meta: dict = None):
+    after.entries.append(ledger.bet_entry(user_id, game, bet, payout, multiplier, meta))
+    after.plays.append((user_id, bet, payout))
+
+# ── Instant games ───────────────────────────────────────────
+@dataclass(frozen=True)
+class Settlement:
+    ok: bool        # False: not enough gold, nothing was written
+    balance: int    # balance after the play, or the current one when not ok
+
+_SETTLE_PLAY = """
+WITH u AS (
+    UPDATE users SET
+        gold          = gold - $2::bigint + $3::bigint,
+        gold_ver      = gold_ver + 1
+    WHERE id = $1 AND gold >= $2::bigint
+    RETURNING gold, gold_ver
+), o AS (
+    INSERT INTO ledger_outbox(entries) SELECT $4::jsonb FROM u
+)
+SELECT (SELECT gold FROM u) AS balance, (SELECT gold_ver FROM u) AS ver,
+       (SELECT gold FROM users WHERE id = $1) AS current
+"""
+
+def _play_entries(after: AfterCommit, user_id: int, game: str, bet: int, payout: int, multiplier: float, meta: dict):
+    after.entries.append(ledger.tx_entry(user_id, "bet", -bet, f"Ставка · {game}", game))
+    if payout > 0:
+        after.entries.append(ledger.tx_entry(user_id, "win", payout, f"Победа · {game}", game))
+    record_game(after, user_id, game, bet, payout, multiplier, meta)
+
+async def settle_play(conn: asyncpg.Connection, user_id: int, game: str,
+                      bet: int, payout: int, multiplier: float, meta: dict = None) -> Settlement:
+    """Balance check, debit, credit and the ledger rows in one statement; run
+    it outside a transaction."""
+    after = AfterCommit()
+    _play_entries(after, user_id, game, bet, payout, multiplier, meta)
+    row = await conn.fetchrow(_SETTLE_PLAY, user_id, bet, payout, json.dumps(after.entries))
+    if row["balance"] is None:
+        return Settlement(False, row["current"] or 0)
+    after.entries = []
+    after.balances.append((user_id, row["balance"], row["ver"]))
+    await after.run()
+    return Settlement(True, row["balance"])
+
+async def settle_batch(conn: asyncpg.Connection, user_id: int, game: str,
+                       plays: list[tuple[int, int, float, dict]],
+                       stop_on_profit: int | None = None,
+                       stop_on_loss: int | None = None) -> tuple[Settlement, int]:
+    """Settles consecutive rounds of one player with one balance update.
+
+    plays: (bet, payout, multiplier, meta), already drawn. Rounds are taken in
+    order until the balance can't cover the next bet or a stop limit on the
+    running net result is reached. Returns the settlement and the number of
+    rounds played.
+    """
+    after = AfterCommit()
+    async with conn.transaction():
+        row = await conn.fetchrow("SELECT gold FROM users WHERE id=$1 FOR UPDATE", user_id)
+        balance = row["gold"] if row else 0
+        net, n = 0, 0
+        for bet, payout, _, _ in plays:
+            if balance + net < bet:
+                break
+            net += payout - bet
+            n   += 1
+            if stop_on_profit is not None and net >= stop_on_profit:
+                break
+            if stop_on_loss is not None and -net >= stop_on_loss:
+                break
+        if n == 0:
+            return Settlement(False, balance), 0
+
+        updated = await conn.fetchrow(
+            "UPDATE users SET gold = gold + $2, gold_ver = gold_ver + 1 WHERE id=$1 RETURNING gold, gold_ver",
+            user_id, net
+        )
+        for bet, payout, mult, meta in plays[:n]:
+            _play_entries(after, user_id, game, bet, payout, mult, meta)
+        await after.stage(conn)
+    after.balances.append((user_id, updated["gold"], updated["gold_ver"]))
+    await after.run()
+    return Settlement(True, updated["gold"]), n
+
+# ── Bulk variants (crash settlement) ───────────────────────
+# Rows may repeat a user; balances are aggregated per user so each users row
+# is touched once.
+
+async def credit_wins(conn: asyncpg.Connection, after: AfterCommit, game: str,
+                      wins: list[tuple[int, int, str]]) -> list[Balance]:
+    """wins: (user_id, payout, description)"""
+    wins = [w for w in wins if w[1] > 0]
+    if not wins:
+        return []
+    rows = await conn.fetch(
         """
-        UPDATE users SET
-            games_played  = games_played + 1,
-            games_won     = games_won + $1,
-            total_wagered = total_wagered + $2,
-            total_profit  = total_profit + $3,
-            xp            = xp + 8
-        WHERE id=$4
+        UPDATE users u SET gold = u.gold + v.payout, gold_ver = u.gold_ver + 1
+        FROM (SELECT id, SUM(payout)::bigint AS payout
+              FROM unnest($1::bigint[], $2::bigint[]) AS t(id, payout) GROUP BY id) v
+        WHERE u.id = v.id
+        RETURNING u.id, u.gold, u.gold_ver
         """,
-        1 if won else 0, bet, payout - bet, user_id
+        [w[0] for w in wins], [w[1] for w in wins]
     )
+    balances = [(r["id"], r["gold"], r["gold_ver"]) for r in rows]
+    after.balances.extend(balances)
+    after.entries.extend(ledger.tx_entry(uid, "win", payout, descr, game) for uid, payout, descr in wins)
+    return balances
+
+def record_games(after: AfterCommit, game: str, rows: list[tuple[int, int, int, float, dict]]):
+    """rows: (user_id, bet, payout, multiplier, meta)"""
+    for uid, bet, payout, mult, meta in rows:
+        record_game(after, uid, game, bet, payout, mult, meta)
@@ -0,0 +1,33 @@
+import os, sys
+import pytest
+
+# Settings are read at import, so the environment is fixed before anything
+# from the app is imported. Tests that need Postgres run against
+# TEST_DATABASE_URL, a disposable database the app migrates on startup;
+# Redis is always fakeredis.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", "postgresql://localhost/unused")
+os.environ["DEV_MODE"] = "true"
+os.environ.setdefault("CRASH_CHAIN_LENGTH", "2000")
+
+@pytest.fixture(scope="session")
+def client():
+    if not os.environ.get("TEST_DATABASE_URL"):
+        pytest.skip("needs TEST_DATABASE_URL")
+    import fakeredis, redis_client
+    from fastapi.testclient import TestClient
+    redis_client._redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    import main
+    with TestClient(main.app) as c:
+        yield c
+
+@pytest.fixture
+def user(client):
+    """A fresh user id with 100 000 gold."""
+    import random, database
+    uid = random.randint(10**9, 2 * 10**9)
+    async def create():
+        pool = await database.get_pool()
+        await pool.execute("INSERT INTO users(id, first_name, gold) VALUES($1, 'test', 100000)", uid)
+    client.portal.call(create)
+    return uid
@@ -0,0 +1,99 @@
+import uuid
+import pytest
+from services import crash_round, crash_stream, leader
+from services.crash_worker import crash_payout
+
+async def _take_engine() -> int:
+    """Takes the crash lease from the app's own engine, so the test moves
+    the round by hand; returns the fencing token."""
+    redis = await crash_round.get_redis()
+    async with redis.pipeline(transaction=True) as p:
+        p.set("lease:crash", "test", px=600_000)
+        p.incr(crash_round.FENCE_KEY)
+        _, fence = await p.execute()
+    return fence
+
+def _reply(ws, msg_id):
+    while True:
+        ev = ws.receive_json()
+        if ev["type"] == "reply" and ev["id"] == msg_id:
+            return ev
+
+@pytest.fixture
+def round_(client):
+    fence = client.portal.call(_take_engine)
+    rid = str(uuid.uuid4())
+    async def start():
+        await crash_round.new_round(fence, rid, 50.0, 5, 0, 0, "00" * 32)
+        await crash_stream.publish({"type": "round", "round_id": rid, "countdown": 5})
+    client.portal.call(start)
+    return fence, rid
+
+def test_bet_and_cashout_over_ws(client, user, round_):
+    fence, rid = round_
+    with client.websocket_connect(f"/api/games/crash/ws?uid={user}") as ws:
+        assert ws.receive_json()["type"] == "snapshot"
+
+        ws.send_json({"action": "bet", "id": 1, "bet": 100})
+        bet = _reply(ws, 1)
+        assert bet["ok"] is True and bet["round_id"] == rid and bet["balance"] == 99_900
+
+        ws.send_json({"action": "bet", "id": 2, "bet": 100})
+        again = _reply(ws, 2)
+        assert again["ok"] is False and again["error"] == "already_bet"
+
+        async def run():
+            await crash_round.set_fields(fence, phase="running", countdown=None)
+            await crash_round.tick(fence, rid, 2.0)
+        client.portal.call(run)
+
+        ws.send_json({"action": "cashout", "id": 3})
+        out = _reply(ws, 3)
+        payout = crash_payout(100, 2.0)
+        assert out["ok"] is True and out["multiplier"] == 2.0 and out["payout"] == payout
+        assert out["balance"] == 99_900 + payout
+
+def test_unexpected_error_keeps_socket_open(client, user, round_, monkeypatch):
+    from routes.games import crash
+    async def broken(*args):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(crash, "place_bet", broken)
+    with client.websocket_connect(f"/api/games/crash/ws?uid={user}") as ws:
+        ws.receive_json()
+        ws.send_json({"action": "bet", "id": 1, "bet": 100})
+        assert _reply(ws, 1)["status"] == 500
+        ws.send_json({"action": "nope", "id": 2})
+        assert _reply(ws, 2)["error"] == "unknown_action"
+
+@pytest.mark.parametrize("target", ["1e999", "Infinity", "NaN", "-2", "0.5", "1e12"])
+def test_auto_cashout_is_bounded(client, user, round_, target):
+    body = f'{{"bet": 100, "auto_cashout": {target}}}'
+    r = client.post("/api/games/crash/bet", content=body,
+                    headers={"X-User-Id": str(user), "Content-Type": "application/json"})
+    assert r.status_code == 422
+    with client.websocket_connect(f"/api/games/crash/ws?uid={user}") as ws:
+        ws.receive_json()
+        ws.send_text(f'{{"action": "bet", "id": 1, "bet": 100, "auto_cashout": {target}}}')
+        assert _reply(ws, 1)["error"] == "invalid_request"
+
+def test_auto_cashout_stored_as_json(client, user, round_):
+    _, rid = round_
+    r = client.post("/api/games/crash/bet", json={"bet": 100, "auto_cashout": 2.5},
+                    headers={"X-User-Id": str(user)})
+    assert r.status_code == 200
+    bets = client.portal.call(crash_round.load_bets, rid)
+    assert [b["auto_cashout"] for b in bets] == [2.5]
+
+def test_failed_round_is_resumed(client, round_, monkeypatch):
+    import asyncio
+    from services import crash_worker
+    fence, rid = round_
+    played = []
+    async def run_round(fence, pool, r):
+        played.append(r["round_id"])
+        if len(played) == 1:
+            raise RuntimeError("db down")
+        raise asyncio.CancelledError
+    monkeypatch.setattr(crash_worker, "_run_round", run_round)
+    client.portal.call(crash_worker.crash_loop, fence)
+    assert played == [rid, rid]
@@ -0,0 +1,17 @@
+import pytest
+from services import history
+
+def test_export_slots_are_taken_before_streaming(client, user):
+    first  = history.export_rows(user, "bets", "csv")
+    second = history.export_rows(user, "transactions", "ndjson")
+    with pytest.raises(RuntimeError, match="export_busy"):
+        history.export_rows(user, "bets", "csv")
+    r = client.get("/api/user/history/export", headers={"X-User-Id": str(user)})
+    assert r.status_code == 429 and r.json()["detail"]["error"] == "export_busy"
+
+    del first          # a response dropped before it started gives its slot back
+    async def drain(stream):
+        return [chunk async for chunk in stream]
+    client.portal.call(drain, second)
+    assert history._exports == 0
+    assert client.get("/api/user/history/export", headers={"X-User-Id": str(user)}).status_code == 200
@@ -0,0 +1,71 @@
+import json
+import pytest
+import database
+from services import ledger, metrics
+
+def _count(client, table: str, keys: list[str]) -> int:
+    async def count():
+        pool = await database.get_pool()
+        return await pool.fetchval(f"SELECT count(*) FROM {table} WHERE dedupe_key = ANY($1::uuid[])", keys)
+    return client.portal.call(count)
+
+def _outbox(client, keys: list[str]) -> int:
+    """Outbox entries among these keys."""
+    async def count():
+        pool = await database.get_pool()
+        return await pool.fetchval(
+            "SELECT count(*) FROM ledger_outbox, jsonb_array_elements(entries) e WHERE e->>1 = ANY($1::text[])", keys
+        )
+    return client.portal.call(count)
+
+def test_rows_commit_with_the_play(client, user):
+    H = {"X-User-Id": str(user)}
+    assert client.post("/api/games/dice/play", json={"bet": 100, "chosen": 7}, headers=H).status_code == 200
+    assert client.post("/api/games/dice/play", json={"bet": 10**6, "chosen": 7}, headers=H).status_code == 400
+    client.portal.call(ledger.drain, 10)
+
+    async def rows():
+        pool = await database.get_pool()
+        return (await pool.fetchval("SELECT count(*) FROM bets WHERE user_id=$1", user),
+                await pool.fetchval("SELECT count(*) FROM transactions WHERE user_id=$1 AND type='bet'", user))
+    assert client.portal.call(rows) == (1, 1)
+
+def test_bad_rows_go_to_dead_letter(client, user):
+    good = [ledger.bet_entry(user, "crash", 100, 200, 2.0) for _ in range(20)]
+    overflow = ledger.bet_entry(user, "crash", 100, 0, 1e9)      # above DECIMAL(10,2)
+    no_user  = ledger.tx_entry(-1, "win", 5, "x", "crash")         # FK violation
+    dead_before = metrics.LEDGER_DEAD._value.get()
+
+    async def run():
+        pool = await database.get_pool()
+        await ledger.stage(pool, good[:7] + [overflow] + good[7:15])
+        await ledger.stage(pool, [no_user] + good[15:])
+        await ledger.drain(timeout=10)
+        return await pool.fetch(
+            "SELECT entry, error FROM ledger_dead WHERE entry->>1 = ANY($1::text[])", [overflow[1], no_user[1]]
+        )
+    dead = client.portal.call(run)
+
+    assert sorted(json.loads(r["entry"])[1] for r in dead) == sorted([overflow[1], no_user[1]])
+    assert all(r["error"] for r in dead)
+    assert metrics.LEDGER_DEAD._value.get() - dead_before == 2
+    assert _count(client, "bets", [e[1] for e in good]) == 20
+    assert _outbox(client, [e[1] for e in good]) == 0
+
+def test_transient_error_keeps_batch(client, user, monkeypatch):
+    entries = [ledger.tx_entry(user, "win", 5, "x", "dice") for _ in range(3)]
+    async def down(conn, entries):
+        raise ConnectionError("postgres unavailable")
+    monkeypatch.setattr(ledger, "write", down)
+
+    async def run():
+        await ledger.stage(await database.get_pool(), entries)
+        with pytest.raises(ConnectionError):
+            await ledger.flush_once()
+    client.portal.call(run)
+    assert _outbox(client, [e[1] for e in entries]) == 3
+
+    monkeypatch.undo()
+    client.portal.call(ledger.drain, 10)
+    assert _count(client, "transactions", [e[1] for e in entries]) == 3
+    assert _outbox(client, [e[1] for e in entries]) == 0
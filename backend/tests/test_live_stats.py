@@ -0,0 +1,17 @@
+import database
+from services import user_stats
+
+def test_play_survives_stats_failure(client, user, monkeypatch):
+    queue_updates = user_stats.queue_updates
+    def broken(pipe, rows):
+        queue_updates(pipe, rows)
+        pipe.execute_command("NO-SUCH-COMMAND")    # fails the pipeline once the play committed
+    monkeypatch.setattr(user_stats, "queue_updates", broken)
+
+    r = client.post("/api/games/dice/play", json={"bet": 100, "chosen": 7}, headers={"X-User-Id": str(user)})
+    assert r.status_code == 200
+
+    async def gold():
+        pool = await database.get_pool()
+        return await pool.fetchval("SELECT gold FROM users WHERE id=$1", user)
+    assert client.portal.call(gold) == r.json()["balance"] != 100000
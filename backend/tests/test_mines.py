@@ -0,0 +1,36 @@
+import json
+import database
+from services import ledger, mines_store as store
+
+def _metas(client, uid) -> list[dict]:
+    async def run():
+        await ledger.drain(10)
+        pool = await database.get_pool()
+        rows = await pool.fetch("SELECT meta FROM bets WHERE user_id=$1 AND game='mines'", uid)
+        return [json.loads(r["meta"]) for r in rows]
+    return client.portal.call(run)
+
+def test_forfeited_session_records_its_reveals(client, user):
+    H = {"X-User-Id": str(user)}
+    game = client.post("/api/games/mines/start", json={"bet": 100, "mines": 3}, headers=H).json()["game_id"]
+    async def mines():
+        return int(await (await store.get_redis()).hget(store.session_key(game), "mines"))
+    safe = [c for c in range(25) if not client.portal.call(mines) >> c & 1][:2]
+    r = client.post("/api/games/mines/reveal-batch", json={"game_id": game, "cells": safe}, headers=H)
+    assert r.json()["found"] == 2
+    assert client.post("/api/games/mines/start", json={"bet": 100, "mines": 3}, headers=H).status_code == 200
+    assert _metas(client, user) == [{"mines": 3, "cells": 2}]
+
+def test_sweeper_only_records_known_reveals(client, user):
+    async def setup():
+        pool = await database.get_pool()
+        for sid in ("lost", "gone"):
+            await pool.execute(
+                "INSERT INTO mines_sessions(id,user_id,bet,mine_count,board,revealed,created_at) "
+                "VALUES($1,$2,100,3,'[]','[]',NOW() - interval '2 hours')", f"{sid}-{user}", user
+            )
+        await (await store.get_redis()).hset(store.session_key(f"lost-{user}"),
+                                             mapping={"state": "lost", "revealed": 0b10110})
+        await store.sweep_abandoned()
+    client.portal.call(setup)
+    assert sorted(_metas(client, user), key=len) == [{"mines": 3}, {"mines": 3, "cells": 3}]
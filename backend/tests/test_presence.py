@@ -0,0 +1,28 @@
+from services import presence
+
+def test_lobby_and_online_counts_agree(client, user):
+    H = {"X-User-Id": str(user)}
+    assert client.get("/api/user/balance", headers=H).status_code == 200
+    assert client.post("/api/games/dice/play", json={"bet": 10, "chosen": 7}, headers=H).status_code == 200
+    assert client.post("/api/stats/presence", json={"game": "crash"}, headers=H).status_code == 200
+    assert client.post("/api/stats/presence", json={"game": "poker"}, headers=H).status_code == 400
+    client.portal.call(presence.flush)
+
+    async def members(key):
+        redis = await presence.get_redis()
+        return await redis.zscore(key, user)
+    assert client.portal.call(members, presence.game_key("dice")) is not None
+    assert client.portal.call(members, presence.game_key("crash")) is not None
+    assert client.portal.call(members, presence.game_key("slots")) is None
+
+    online = client.get("/api/stats/online").json()
+    assert online["total"] >= 1
+    assert client.get("/api/stats/lobby").json()["online"] == online["total"]
+
+def test_lobby_heartbeat_counts_as_online(client, user):
+    assert client.post("/api/stats/presence", json={}, headers={"X-User-Id": str(user)}).status_code == 200
+    client.portal.call(presence.flush)
+    async def member():
+        redis = await presence.get_redis()
+        return await redis.zscore(presence.ALL_KEY, user)
+    assert client.portal.call(member) is not None
@@ -0,0 +1,27 @@
+import pytest
+from starlette.requests import Request
+from config import settings
+from middleware.rate_limit import client_identity
+
+def _request(forwarded: str | None = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": ("10.0.0.9", 5000)})
+
+@pytest.mark.parametrize("proxies, forwarded, identity", [
+    (0, "1.1.1.1", "ip10.0.0.9"),                      # no proxy: the header is the client's own
+    (1, "1.1.1.1", "ip1.1.1.1"),
+    (1, "6.6.6.6, 1.1.1.1", "ip1.1.1.1"),              # spoofed left entry ignored
+    (2, "6.6.6.6, 1.1.1.1, 10.1.1.1", "ip1.1.1.1"),
+    (2, "1.1.1.1", "ip10.0.0.9"),                      # fewer hops than proxies
+    (1, None, "ip10.0.0.9"),
+])
+def test_anonymous_identity(monkeypatch, proxies, forwarded, identity):
+    monkeypatch.setattr(settings, "TRUSTED_PROXIES", proxies)
+    monkeypatch.setattr(settings, "DEV_MODE", False)
+    assert client_identity(_request(forwarded)) == identity
+
+def test_rotating_forwarded_for_keeps_one_bucket(monkeypatch):
+    monkeypatch.setattr(settings, "TRUSTED_PROXIES", 1)
+    monkeypatch.setattr(settings, "DEV_MODE", False)
+    ids = {client_identity(_request(f"7.7.7.{i}, 1.1.1.1")) for i in range(10)}
+    assert ids == {"ip1.1.1.1"}
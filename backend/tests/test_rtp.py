@@ -0,0 +1,52 @@
+import math
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import rtp_sim
+from config import settings
+from routes.games import roulette
+
+TARGET = 1 - settings.HOUSE_EDGE
+
+def _variants(game: str) -> list:
+    return list(rtp_sim.GAMES[game]())
+
+def test_coin_and_dice_pay_exactly_the_target():
+    for v in _variants("coin") + _variants("dice"):
+        assert v.exact_rtp() == pytest.approx(TARGET, abs=1e-9), v.label
+
+def test_roulette_every_bet_type():
+    for (key, kind, numbers, mult), (_, _, rtp) in zip(roulette.BET_TYPES, roulette.rtp_report(rtp_sim.BET)):
+        assert rtp == pytest.approx(mult * len(numbers) / 37 * TARGET, abs=1e-9), key
+        assert rtp < 1, key
+        if ("roulette", key) not in rtp_sim.KNOWN_ISSUES:
+            assert mult * len(numbers) == 36, key
+
+def test_mines_whole_multiplier_table():
+    for m in range(1, 25):
+        for f in range(1, 26 - m):
+            rtp = rtp_sim.MinesVariant(m, f).exact_rtp()
+            assert abs(rtp - TARGET) < 0.01 and rtp < 1, (m, f)
+
+def test_crash_keeps_an_edge():
+    for v in _variants("crash"):
+        assert v.exact_rtp() < 1, v.label
+
+@pytest.mark.xfail(strict=True, reason="crash: " + rtp_sim.KNOWN_ISSUES["crash", "cashout x2"])
+def test_crash_auto_cashouts_pay_the_target():
+    for v in _variants("crash"):
+        assert abs(v.exact_rtp() - TARGET) < 0.005, v.label
+
+@pytest.mark.parametrize("game", ["coin", "dice", "roulette", "mines", "crash", "slots"])
+def test_simulation_agrees_with_exact(game):
+    rng = np.random.default_rng(1)
+    rounds = 200_000
+    for v in _variants(game):
+        sim = rtp_sim.simulate(v, rng, rounds)["rtp"]
+        assert abs(sim - v.exact_rtp()) <= 5 * math.sqrt(v.exact_var() / rounds) + 1e-9, v.label
+
+@pytest.mark.xfail(strict=True, reason="slots: " + rtp_sim.KNOWN_ISSUES["slots", "spin"])
+def test_slots_does_not_overpay():
+    (v,) = _variants("slots")
+    assert v.exact_rtp() < 1
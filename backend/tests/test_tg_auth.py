@@ -0,0 +1,12 @@
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from config import settings
+from middleware.tg_auth import verify_token, resolve_user_id
+
+def test_token_without_exp_is_rejected_not_an_error():
+    token = jwt.encode({"sub": "42"}, settings.SECRET_KEY, algorithm="HS256")
+    assert verify_token(token) is None
+    with pytest.raises(HTTPException) as e:
+        resolve_user_id(None, None, token)
+    assert e.value.status_code == 401